@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from bulk_loader import (resolve_batch_size, dataframe_to_csv_buffer, staging_table_name, dedup_insert_query,
+                         merge_queries, ensure_hash_index, ensure_key_index, parse_key_columns, column_list)
+from row_hashing import hash_rows
+from source_readers import iter_source_chunks, count_source_rows
+from ingestion_metrics import stage, annotate_run
+from table_swap import split_table_name, prepare_full_load, finish_full_load, swap_blockers
+from watermarks import METADATA_TABLE, DEFAULT_WATERMARK, advance_watermark, read_chunks_after_watermark
+from streaming_ingestion import DEFAULT_CHUNK_SIZE, split_at_row, starting_watermark, track_loaded_timestamp
+from checkpoints import checkpoint_upsert_query, checkpoint_params, clear_checkpoint
+
+try:
+    import asyncpg
+except ImportError:  # the async pipeline needs asyncpg
+    asyncpg = None
+
+
+# Pipeline sizing: chunks waiting between two stages (backpressure), processes running the CPU stage
+# and connections writing to the database
+DEFAULT_PIPELINE_OPTIONS = {
+    'queue_depth': 4,
+    'cpu_workers': 2,
+    'writers': 2,
+}
+
+# Marker closing a queue
+END_OF_STREAM = None
+
+# CPU stage: convert timestamps, hash, deduplicate keys and serialize a chunk into COPY payloads
+# Runs in a worker process, so it only returns what the writers need (no DataFrame travels back)
+def prepare_chunk(chunk, batch_size, timestamp_column=None, coerce_timestamps=False, add_hash=False, key_columns=None):
+    if timestamp_column and coerce_timestamps:
+        chunk[timestamp_column] = pd.to_datetime(chunk[timestamp_column], errors='coerce')
+    if add_hash:
+        # The chunk is already a worker's share, so it is hashed serially
+        chunk['hash'] = hash_rows(chunk, workers=1)
+    # Source offset reached by the chunk, whose rows are indexed by their position in the source
+    end_row = int(chunk.index[-1]) + 1 if len(chunk) else None
+    if key_columns:
+        chunk = chunk.drop_duplicates(subset=key_columns, keep='last')
+
+    max_timestamp = chunk[timestamp_column].max() if timestamp_column and not chunk.empty else None
+    payloads = [dataframe_to_csv_buffer(chunk.iloc[start:start + batch_size]).getvalue().encode()
+                for start in range(0, len(chunk), batch_size)]
+    return {
+        'rows': len(chunk),
+        'columns': list(chunk.columns),
+        'payloads': payloads,
+        'max_timestamp': None if max_timestamp is None or pd.isna(max_timestamp) else max_timestamp,
+        'end_row': end_row,
+    }
+
+# Function to COPY prepared payloads into a table over an asyncpg connection
+# asyncpg quotes every identifier, so names are passed case-folded as PostgreSQL resolves them unquoted
+async def copy_payloads(connection, prepared, table_name):
+    schema_name, bare_name = split_table_name(table_name)
+    columns = [column.lower() for column in prepared['columns']]
+    for payload in prepared['payloads']:
+        await connection.copy_to_table(bare_name.lower(), schema_name=schema_name.lower() or None, source=io.BytesIO(payload),
+                                       columns=columns, format='csv', null='')
+    return prepared['rows']
+
+# Function to stage prepared payloads in a transaction-scoped temporary table shaped like the target
+async def stage_payloads(connection, prepared, table_name):
+    staging_table = staging_table_name(table_name)
+    await connection.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    await connection.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    await copy_payloads(connection, prepared, staging_table)
+    await connection.execute(f"ANALYZE {staging_table}")
+    return staging_table
+
+# Function to read the row count from an asyncpg command status (e.g. 'INSERT 0 12')
+def status_rows(status):
+    return int(status.split()[-1])
+
+# Function to advance the watermark in the writer's transaction (never backwards, as advance_watermark)
+async def advance_watermark_async(connection, table_name, new_watermark):
+    if new_watermark is None:
+        return
+    await connection.execute(
+        f"UPDATE {METADATA_TABLE} SET watermark = GREATEST(COALESCE(watermark, $1), $1), last_ingestion_date = now() "
+        f"WHERE table_name = $2",
+        pd.Timestamp(new_watermark).to_pydatetime(), table_name,
+    )
+
+# Function to record the source offset reached by a chunk in the writer's transaction (as save_checkpoint)
+async def save_checkpoint_async(connection, checkpoint, end_row):
+    if end_row is not None:
+        checkpoint['rows'] = max(checkpoint['rows'], end_row)
+    checkpoint['chunks'] += 1
+    await connection.execute(checkpoint_upsert_query(lambda n: f"${n}"), *checkpoint_params(checkpoint))
+
+# Function to wait until every chunk before `seq` has gone through a step (handed off, committed)
+async def wait_turn(turn, seq):
+    async with turn['condition']:
+        await turn['condition'].wait_for(lambda: turn['next'] == seq)
+
+# Function to let the next chunk go through the step
+async def end_turn(turn):
+    async with turn['condition']:
+        turn['next'] += 1
+        turn['condition'].notify_all()
+
+# Reader task: pull chunks from the (blocking) source iterator in a thread and number them
+async def read_stage(items, parse_queue, cpu_workers):
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    seq = 0
+    while True:
+        with stage('read') as counters:
+            item = await loop.run_in_executor(None, next, iterator, END_OF_STREAM)
+            if item is not END_OF_STREAM:
+                counters['rows'] = len(item[1])
+        if item is END_OF_STREAM:
+            break
+        await parse_queue.put((seq, item))
+        seq += 1
+    for _ in range(cpu_workers):
+        await parse_queue.put(END_OF_STREAM)
+
+# CPU task: run prepare_chunk in the executor
+# Chunks are handed to the writers in source order: a writer waiting for its turn to commit can then
+# always count on an earlier chunk being held by another writer
+async def transform_stage(parse_queue, write_queue, executor, prepare, handoff):
+    loop = asyncio.get_running_loop()
+    while True:
+        entry = await parse_queue.get()
+        if entry is END_OF_STREAM:
+            return
+        seq, (section, chunk) = entry
+        with stage('transform', rows=len(chunk)):
+            prepared = await loop.run_in_executor(executor, prepare, chunk)
+        await wait_turn(handoff, seq)
+        await write_queue.put((seq, section, prepared))
+        await end_turn(handoff)
+
+# Writer task: one connection, one transaction per chunk
+# The strategy's 'load' step runs concurrently with the other writers; its optional 'apply' step
+# (deduplication against the target, watermark update) and the commit then run in chunk order,
+# so each chunk sees the previous ones committed exactly as in the sequential pipeline
+async def write_stage(pool, write_queue, strategy, turn, totals):
+    async with pool.acquire() as connection:
+        while True:
+            entry = await write_queue.get()
+            if entry is END_OF_STREAM:
+                return
+            seq, section, prepared = entry
+
+            transaction = connection.transaction()
+            await transaction.start()
+            try:
+                with stage('load', rows=prepared['rows']):
+                    loaded = await strategy['load'](connection, section, prepared)
+                if 'apply' in strategy:
+                    await wait_turn(turn, seq)
+                    with stage('load'):
+                        loaded = await strategy['apply'](connection, section, prepared, loaded)
+                with stage('commit'):
+                    await transaction.commit()
+            except BaseException:
+                await transaction.rollback()
+                raise
+            totals['loaded'] += loaded
+            if 'apply' in strategy:
+                await end_turn(turn)
+
+# Function to run reader -> CPU stage -> writers over bounded queues, returning the number of rows loaded
+# items: (section, chunk) pairs; prepare: picklable CPU function chunk -> prepared payloads;
+# strategy: dict of async 'load' and optional 'apply' steps
+async def run_pipeline(dsn, items, prepare, strategy, pipeline_options=None):
+    if asyncpg is None:
+        raise ImportError("asyncpg is required for the async ingestion pipeline.")
+    options = dict(DEFAULT_PIPELINE_OPTIONS, **(pipeline_options or {}))
+    cpu_workers, writers = options['cpu_workers'], options['writers']
+
+    parse_queue = asyncio.Queue(maxsize=options['queue_depth'])
+    write_queue = asyncio.Queue(maxsize=options['queue_depth'])
+    handoff = {'next': 0, 'condition': asyncio.Condition()}
+    turn = {'next': 0, 'condition': asyncio.Condition()}
+    totals = {'loaded': 0}
+
+    pool = await asyncpg.create_pool(dsn, min_size=writers, max_size=writers)
+    executor = ProcessPoolExecutor(max_workers=cpu_workers)
+    try:
+        reader = asyncio.ensure_future(read_stage(items, parse_queue, cpu_workers))
+        transformers = [asyncio.ensure_future(transform_stage(parse_queue, write_queue, executor, prepare, handoff))
+                        for _ in range(cpu_workers)]
+        writer_tasks = [asyncio.ensure_future(write_stage(pool, write_queue, strategy, turn, totals))
+                        for _ in range(writers)]
+        tasks = [reader] + transformers + writer_tasks
+
+        async def close_writers():
+            await asyncio.gather(reader, *transformers)
+            for _ in range(writers):
+                await write_queue.put(END_OF_STREAM)
+        tasks.append(asyncio.ensure_future(close_writers()))
+
+        # The first failure cancels the whole pipeline; transactions of chunks not committed are rolled back
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        failed = [task for task in done if not task.cancelled() and task.exception()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if failed:
+            raise failed[0].exception()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        await pool.close()
+    return totals['loaded']
+
+# Function to pair every chunk with no section (strategies that do not split the source)
+def unsectioned(chunks):
+    return ((None, chunk) for chunk in chunks)
+
+# Function to list what prevents the async pipeline from reloading a table
+# Writers commit chunks on their own connections, so a truncated live table would be seen empty, then
+# partly loaded, and left so by a failure; only a shadow table swapped in at the end keeps a reload atomic
+def async_reload_blockers(conn, table_name, load_mode='swap'):
+    if load_mode != 'swap':
+        return [f"load_mode '{load_mode}'"]
+    return swap_blockers(conn, table_name)
+
+# Function to refuse a reload the async pipeline cannot make atomic (see async_reload_blockers)
+def require_async_reload(conn, table_name, load_mode='swap'):
+    blockers = async_reload_blockers(conn, table_name, load_mode)
+    if blockers:
+        raise ValueError(f"The async pipeline cannot reload {table_name} ({'; '.join(blockers)}): it would truncate "
+                         f"the live table in its own transaction. Load it with the sequential strategy instead.")
+
+# Function for async full ingestion: writers COPY chunks concurrently into a shadow table (see table_swap.py),
+# which is swapped in at the end; tables that cannot be swapped are refused
+async def async_full_ingestion(conn, dsn, file_path, table_name, batch_size=None, chunksize=DEFAULT_CHUNK_SIZE,
+                               read_options=None, load_mode='swap', pipeline_options=None):
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+
+    require_async_reload(conn, table_name, load_mode)
+    target_table = prepare_full_load(conn, table_name, load_mode)
+    conn.commit()
+
+    strategy = {'load': lambda connection, section, prepared: copy_payloads(connection, prepared, target_table)}
+    chunks = unsectioned(iter_source_chunks(file_path, chunksize, **(read_options or {})))
+    prepare = partial(prepare_chunk, batch_size=batch_size)
+    loaded = await run_pipeline(dsn, chunks, prepare, strategy, pipeline_options)
+
+    finish_full_load(conn, table_name, target_table)
+    conn.commit()
+
+    elapsed_time = time.time() - start_time
+    print(f"Async full ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for async date-based ingestion: the watermark filter runs in the reader; on a time-ordered source
+# every chunk advances the watermark in its own transaction, in chunk order, otherwise it advances once the
+# whole file is loaded (see streaming_date_based_ingestion)
+# checkpoint: every chunk records the source offset it reached in its transaction, so a failed attempt
+# resumes after its last committed chunk, filtering against the starting watermark
+# primary_key: stage the new rows and merge them on this key instead of appending them
+# (historical_data_handling = Merge)
+async def async_date_based_ingestion(conn, dsn, file_path, table_name, timestamp_column, batch_size=None,
+                                     chunksize=DEFAULT_CHUNK_SIZE, time_ordered=False, read_options=None,
+                                     pipeline_options=None, checkpoint=None, primary_key=None):
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+    key_columns = parse_key_columns(primary_key) if primary_key is not None else None
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    max_timestamp = starting_watermark(conn, table_name, timestamp_column, checkpoint)
+    if key_columns:
+        ensure_key_index(conn, table_name, key_columns)
+    # Release the metadata row, the writers update it
+    conn.commit()
+    state = checkpoint['state'] if checkpoint is not None else {}
+
+    async def apply(connection, section, prepared, loaded):
+        if key_columns:
+            # The load step returned the staging table
+            update_query, insert_query = merge_queries(table_name, loaded, prepared['columns'], key_columns)
+            updated = status_rows(await connection.execute(update_query))
+            inserted = status_rows(await connection.execute(insert_query))
+            counts['updated'] += updated
+            counts['inserted'] += inserted
+            counts['unchanged'] += prepared['rows'] - inserted - updated
+            loaded = inserted + updated
+        if time_ordered:
+            await advance_watermark_async(connection, table_name, prepared['max_timestamp'])
+        else:
+            track_loaded_timestamp(state, prepared['max_timestamp'])
+        if checkpoint is not None:
+            await save_checkpoint_async(connection, checkpoint, prepared['end_row'])
+        return loaded
+
+    # Merged chunks are staged, the others copied straight into the table
+    load = stage_payloads if key_columns else copy_payloads
+    strategy = {'load': lambda connection, section, prepared: load(connection, prepared, table_name),
+                'apply': apply}
+    chunks = unsectioned(read_chunks_after_watermark(file_path, timestamp_column, max_timestamp, chunksize,
+                                                     time_ordered, read_options,
+                                                     checkpoint['rows'] if checkpoint else 0))
+    prepare = partial(prepare_chunk, batch_size=batch_size, timestamp_column=timestamp_column,
+                      add_hash=bool(key_columns), key_columns=key_columns)
+    loaded = await run_pipeline(dsn, chunks, prepare, strategy, pipeline_options)
+
+    if not time_ordered:
+        advance_watermark(conn, table_name, state.get('loaded'))
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+    if key_columns:
+        annotate_run(merge_counts=counts)
+
+    elapsed_time = time.time() - start_time
+    print(f"Async date-based ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for async hash-based ingestion: chunks are staged concurrently and deduplicated against the
+# target in chunk order (dedup_mode 'anti_join' or 'on_conflict')
+async def async_hash_based_ingestion(conn, dsn, file_path, table_name, batch_size=None, chunksize=DEFAULT_CHUNK_SIZE,
+                                     dedup_mode='anti_join', read_options=None, pipeline_options=None):
+    if dedup_mode not in ('anti_join', 'on_conflict'):
+        raise ValueError(f"dedup_mode '{dedup_mode}' is not supported by the async pipeline.")
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+
+    ensure_hash_index(conn, table_name, unique=(dedup_mode == 'on_conflict'))
+    conn.commit()
+
+    async def apply(connection, section, prepared, staging_table):
+        return status_rows(await connection.execute(
+            dedup_insert_query(table_name, staging_table, prepared['columns'], dedup_mode)))
+
+    strategy = {'load': lambda connection, section, prepared: stage_payloads(connection, prepared, table_name),
+                'apply': apply}
+    chunks = unsectioned(iter_source_chunks(file_path, chunksize, **(read_options or {})))
+    prepare = partial(prepare_chunk, batch_size=batch_size, add_hash=True)
+    loaded = await run_pipeline(dsn, chunks, prepare, strategy, pipeline_options)
+
+    elapsed_time = time.time() - start_time
+    print(f"Async hash-based ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for async hybrid ingestion: full load of the first half, incremental load of the rest
+# Both halves are loaded into a shadow table swapped in at the end, as in async_full_ingestion
+async def async_hybrid_ingestion(conn, dsn, file_path, table_name, timestamp_column, batch_size=None,
+                                 chunksize=DEFAULT_CHUNK_SIZE, dedup_mode='anti_join', read_options=None,
+                                 load_mode='swap', pipeline_options=None):
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+    if pd.isna(timestamp_column):
+        timestamp_column = None
+
+    require_async_reload(conn, table_name, load_mode)
+    half_index = count_source_rows(file_path, chunksize, (read_options or {}).get('file_format')) // 2
+
+    target_table = prepare_full_load(conn, table_name, load_mode)
+    if not timestamp_column:
+        ensure_hash_index(conn, target_table, unique=(dedup_mode == 'on_conflict'))
+    conn.commit()
+
+    # The incremental half is filtered against the max of the first half, known once all of it is applied
+    watermarks = {'full_half': DEFAULT_WATERMARK, 'loaded': DEFAULT_WATERMARK}
+
+    def track(new_watermark, section):
+        if new_watermark is not None and pd.notna(new_watermark):
+            watermarks['loaded'] = max(watermarks['loaded'], pd.Timestamp(new_watermark))
+            if section == 'full':
+                watermarks['full_half'] = watermarks['loaded']
+
+    async def load(connection, section, prepared):
+        if section == 'full':
+            return await copy_payloads(connection, prepared, target_table)
+        return await stage_payloads(connection, prepared, target_table)
+
+    async def apply(connection, section, prepared, loaded):
+        if section == 'full':
+            track(prepared['max_timestamp'], section)
+            return loaded
+        if not timestamp_column:
+            return status_rows(await connection.execute(
+                dedup_insert_query(target_table, loaded, prepared['columns'], dedup_mode)))
+
+        columns = column_list(prepared['columns'])
+        row = await connection.fetchrow(
+            f"WITH inserted AS (INSERT INTO {target_table} ({columns}) SELECT {columns} FROM {loaded} "
+            f"WHERE {column_list([timestamp_column])} > $1 RETURNING {column_list([timestamp_column])} AS ts) "
+            f"SELECT count(*), max(ts) FROM inserted",
+            watermarks['full_half'].to_pydatetime(),
+        )
+        track(row[1], section)
+        return row[0]
+
+    strategy = {'load': load, 'apply': apply}
+    chunks = split_at_row(iter_source_chunks(file_path, chunksize, **(read_options or {})), half_index)
+    prepare = partial(prepare_chunk, batch_size=batch_size, timestamp_column=timestamp_column, coerce_timestamps=True,
+                      add_hash=True)
+    loaded = await run_pipeline(dsn, chunks, prepare, strategy, pipeline_options)
+
+    # Swap the reloaded table in and reset the watermark to its contents, in one transaction
+    finish_full_load(conn, table_name, target_table)
+    if timestamp_column:
+        advance_watermark(conn, table_name, watermarks['loaded'], reset=True)
+    conn.commit()
+
+    elapsed_time = time.time() - start_time
+    print(f"Async hybrid ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for async merge ingestion: chunks are staged concurrently and merged on the primary key in chunk order
+async def async_merge_ingestion(conn, dsn, file_path, table_name, primary_key, batch_size=None,
+                                chunksize=DEFAULT_CHUNK_SIZE, read_options=None, pipeline_options=None):
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+    key_columns = parse_key_columns(primary_key)
+    if not key_columns:
+        raise ValueError(f"No primary key declared for {table_name}, cannot merge.")
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    ensure_key_index(conn, table_name, key_columns)
+    conn.commit()
+
+    async def apply(connection, section, prepared, staging_table):
+        update_query, insert_query = merge_queries(table_name, staging_table, prepared['columns'], key_columns)
+        updated = status_rows(await connection.execute(update_query))
+        inserted = status_rows(await connection.execute(insert_query))
+        counts['updated'] += updated
+        counts['inserted'] += inserted
+        counts['unchanged'] += prepared['rows'] - inserted - updated
+        return inserted + updated
+
+    strategy = {'load': lambda connection, section, prepared: stage_payloads(connection, prepared, table_name),
+                'apply': apply}
+    chunks = unsectioned(iter_source_chunks(file_path, chunksize, **(read_options or {})))
+    prepare = partial(prepare_chunk, batch_size=batch_size, add_hash=True, key_columns=key_columns)
+    loaded = await run_pipeline(dsn, chunks, prepare, strategy, pipeline_options)
+    annotate_run(merge_counts=counts)
+
+    elapsed_time = time.time() - start_time
+    print(f"Async merge ingestion for {file_path} completed in {elapsed_time:.2f} seconds: "
+          f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged.")
+    return loaded
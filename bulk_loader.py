@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+import io
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2.extras import execute_values
+
+
+# Batch size used when the metadata table does not declare a valid one
+DEFAULT_BATCH_SIZE = 1000
+
+# Function to build the column list of a statement
+# Lowercase names are quoted so reserved words (e.g. `from`, `to`) work; quoting them does not change
+# how PostgreSQL resolves them, while mixed-case names keep their unquoted, case-folded behaviour
+def column_list(columns):
+    return ', '.join(f'"{column}"' if column == column.lower() else column for column in columns)
+
+# Function to resolve the batch size declared in the metadata table
+def resolve_batch_size(batch_size):
+    if batch_size is None or pd.isna(batch_size) or int(batch_size) <= 0:
+        return DEFAULT_BATCH_SIZE
+    return int(batch_size)
+
+# Function to render float columns holding only whole numbers (such as nullable integers, read as float64)
+# as integers, since COPY rejects '5.0' for an integer column; float columns take '5' all the same
+def integral_floats_as_ints(df):
+    converted = None
+    for position, dtype in enumerate(df.dtypes):
+        if not pd.api.types.is_float_dtype(dtype):
+            continue
+        values = df.iloc[:, position].to_numpy(dtype='float64', na_value=np.nan)
+        present = values[~np.isnan(values)]
+        # Beyond 2**53 floats are not exact integers any more
+        if len(present) and np.abs(present).max() < 2 ** 53 and (present == np.trunc(present)).all():
+            if converted is None:
+                converted = df.copy()
+            converted.isetitem(position, pd.array(values, dtype='Int64'))
+    return df if converted is None else converted
+
+# Function to serialize a slice of a DataFrame into an in-memory CSV buffer for COPY
+def dataframe_to_csv_buffer(df):
+    df = integral_floats_as_ints(df)
+    buffer = io.StringIO()
+    # Missing values are written as unquoted empty fields, which COPY reads back as NULL
+    df.to_csv(buffer, index=False, header=False, na_rep='')
+    buffer.seek(0)
+    return buffer
+
+# Function to stream a DataFrame into a table with COPY FROM STDIN, one buffer per batch
+def copy_dataframe(conn, df, table_name, batch_size):
+    columns = column_list(df.columns)
+    copy_query = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '')"
+
+    with conn.cursor() as cur:
+        for start in range(0, len(df), batch_size):
+            buffer = dataframe_to_csv_buffer(df.iloc[start:start + batch_size])
+            cur.copy_expert(copy_query, buffer)
+    return len(df)
+
+# Function to insert a DataFrame with multi-row INSERT statements built by execute_values
+def insert_dataframe_values(conn, df, table_name, batch_size):
+    columns = column_list(df.columns)
+    insert_query = f"INSERT INTO {table_name} ({columns}) VALUES %s"
+
+    # Convert missing values to None so psycopg2 sends them as NULL
+    rows_df = df.astype(object).where(pd.notna(df), None)
+
+    with conn.cursor() as cur:
+        for start in range(0, len(rows_df), batch_size):
+            rows = list(rows_df.iloc[start:start + batch_size].itertuples(index=False, name=None))
+            execute_values(cur, insert_query, rows, page_size=batch_size)
+    return len(df)
+
+# Function to bulk-load a DataFrame, preferring COPY and falling back to execute_values batches
+def bulk_load(conn, df, table_name, batch_size=None, method='copy'):
+    batch_size = resolve_batch_size(batch_size)
+    if df.empty:
+        return 0
+
+    if method == 'values':
+        return insert_dataframe_values(conn, df, table_name, batch_size)
+
+    # A savepoint keeps the surrounding transaction usable if COPY is rejected
+    with conn.cursor() as cur:
+        cur.execute("SAVEPOINT bulk_load_copy")
+    try:
+        loaded = copy_dataframe(conn, df, table_name, batch_size)
+    except psycopg2.Error as e:
+        with conn.cursor() as cur:
+            cur.execute("ROLLBACK TO SAVEPOINT bulk_load_copy")
+        print(f"COPY into {table_name} failed ({e}); falling back to batched INSERTs.")
+        loaded = insert_dataframe_values(conn, df, table_name, batch_size)
+
+    with conn.cursor() as cur:
+        cur.execute("RELEASE SAVEPOINT bulk_load_copy")
+    return loaded
+
+# Function to build the name of the (temporary) staging table of a target table
+def staging_table_name(table_name):
+    return f"stg_{table_name.replace('.', '_')}"
+
+# Function to create a transaction-scoped staging table shaped like the target table
+def create_staging_table(conn, table_name):
+    staging_table = staging_table_name(table_name)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {staging_table}")
+        cur.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+    return staging_table
+
+# Function to make sure the target table has an index over its hash column
+def ensure_hash_index(conn, table_name, unique=False):
+    index_name = f"{table_name.split('.')[-1]}_hash_{'uidx' if unique else 'idx'}"
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name} ON {table_name} (hash)")
+
+# Function to build the statement copying the staged rows whose hash is not already in the target
+def dedup_insert_query(table_name, staging_table, columns, method='anti_join'):
+    columns = column_list(columns)
+    if method == 'anti_join':
+        return (f"INSERT INTO {table_name} ({columns}) "
+                f"SELECT {columns} FROM {staging_table} s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE t.hash = s.hash)")
+    return (f"INSERT INTO {table_name} ({columns}) "
+            f"SELECT {columns} FROM {staging_table} "
+            f"ON CONFLICT (hash) DO NOTHING")
+
+# Function to insert only rows whose hash is not already in the target, deduplicating server-side
+def insert_new_rows_by_hash(conn, df, table_name, batch_size=None, method='anti_join'):
+    if method not in ('anti_join', 'on_conflict'):
+        raise ValueError(f"Unknown dedup method: {method}")
+    if df.empty:
+        return 0
+
+    ensure_hash_index(conn, table_name, unique=(method == 'on_conflict'))
+
+    # Stage the incoming batch so the comparison runs inside PostgreSQL
+    staging_table = create_staging_table(conn, table_name)
+    bulk_load(conn, df, staging_table, batch_size)
+
+    with conn.cursor() as cur:
+        cur.execute(f"ANALYZE {staging_table}")
+        cur.execute(dedup_insert_query(table_name, staging_table, df.columns, method))
+        inserted = cur.rowcount
+        cur.execute(f"DROP TABLE {staging_table}")
+    return inserted
+
+# Function to parse the primary_key declared in the metadata table (one column or a comma-separated list)
+def parse_key_columns(primary_key):
+    if primary_key is None or pd.isna(primary_key):
+        return []
+    return [column.strip() for column in str(primary_key).split(',') if column.strip()]
+
+# Function to make sure the target table has an index over its key columns, used to join the staged batch
+def ensure_key_index(conn, table_name, key_columns):
+    index_name = f"{table_name.split('.')[-1]}_{'_'.join(key_columns)}_key_idx".lower()
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({column_list(key_columns)})")
+
+# Function to build the two statements applying a staged batch keyed on `key_columns`:
+# the UPDATE of existing keys whose hash changed, then the INSERT of new keys
+def merge_queries(table_name, staging_table, columns, key_columns):
+    key_match = ' AND '.join(f"t.{column_list([column])} = s.{column_list([column])}" for column in key_columns)
+    assignments = ', '.join(f"{column_list([column])} = s.{column_list([column])}"
+                            for column in columns if column not in key_columns)
+    update_query = (f"UPDATE {table_name} t SET {assignments} FROM {staging_table} s "
+                    f"WHERE {key_match} AND t.hash IS DISTINCT FROM s.hash")
+    insert_query = (f"INSERT INTO {table_name} ({column_list(columns)}) "
+                    f"SELECT {column_list(columns)} FROM {staging_table} s "
+                    f"WHERE NOT EXISTS (SELECT 1 FROM {table_name} t WHERE {key_match})")
+    return update_query, insert_query
+
+# Function to merge a batch into the target keyed on `key_columns`: rows with a new key are inserted,
+# rows whose key exists with a different hash are updated and rows with an unchanged hash are skipped
+# Returns the inserted/updated/unchanged counts
+def merge_rows_by_key(conn, df, table_name, key_columns, batch_size=None):
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if not key_columns:
+        raise ValueError(f"No primary key declared for {table_name}, cannot merge.")
+    if df.empty:
+        return counts
+
+    # Within a batch the last row of a key wins, as if the rows had been applied one by one
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+
+    ensure_key_index(conn, table_name, key_columns)
+    staging_table = create_staging_table(conn, table_name)
+    bulk_load(conn, df, staging_table, batch_size)
+
+    update_query, insert_query = merge_queries(table_name, staging_table, df.columns, key_columns)
+    with conn.cursor() as cur:
+        cur.execute(f"ANALYZE {staging_table}")
+        cur.execute(update_query)
+        counts['updated'] = cur.rowcount
+        cur.execute(insert_query)
+        counts['inserted'] = cur.rowcount
+        cur.execute(f"DROP TABLE {staging_table}")
+
+    counts['unchanged'] = len(df) - counts['inserted'] - counts['updated']
+    return counts
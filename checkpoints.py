@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+from ingestion_metrics import current_run
+
+
+# Table holding the progress of the chunked loads that have not completed yet, one row per table and source
+CHECKPOINT_TABLE = 'ingestion_checkpoints'
+
+# Function to identify the contents of a source file: a checkpoint only applies to the file it was taken on
+def source_signature(file_path):
+    stat = os.stat(file_path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+# Function to create the checkpoint table if needed
+def ensure_checkpoint_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ("
+            f"table_name TEXT, file_path TEXT, source_signature TEXT, strategy TEXT, run_id TEXT, "
+            f"committed_rows BIGINT, committed_chunks BIGINT, state JSONB, updated_at TIMESTAMP, "
+            f"PRIMARY KEY (table_name, file_path))"
+        )
+
+# Function to open the checkpoint of a chunked load of `file_path` into `table_name`
+# A checkpoint left by an earlier attempt on the same source and strategy is resumed; any other one is discarded
+def open_checkpoint(conn, table_name, file_path, strategy):
+    ensure_checkpoint_table(conn)
+    checkpoint = {
+        'table_name': table_name,
+        'file_path': os.path.abspath(file_path),
+        'source_signature': source_signature(file_path),
+        'strategy': strategy,
+        'rows': 0,
+        'chunks': 0,
+        'state': {},
+    }
+    with conn.cursor() as cur:
+        cur.execute(
+            f"SELECT source_signature, strategy, committed_rows, committed_chunks, state FROM {CHECKPOINT_TABLE} "
+            f"WHERE table_name = %s AND file_path = %s",
+            (table_name, checkpoint['file_path']),
+        )
+        row = cur.fetchone()
+    if row and row[0] == checkpoint['source_signature'] and row[1] == strategy:
+        checkpoint.update(rows=row[2], chunks=row[3], state=row[4] or {})
+        print(f"Resuming {strategy} ingestion of {table_name} after {checkpoint['rows']} committed rows.")
+    elif row:
+        clear_checkpoint(conn, checkpoint)
+    return checkpoint
+
+# Function to tell whether a checkpoint resumes an earlier attempt
+def is_resumed(checkpoint):
+    return checkpoint is not None and checkpoint['rows'] > 0
+
+# Function to start a checkpoint over when what it resumes is gone (e.g. a dropped shadow table)
+def restart_checkpoint(checkpoint):
+    print(f"Cannot resume ingestion of {checkpoint['table_name']}, restarting from the beginning.")
+    checkpoint.update(rows=0, chunks=0, state={})
+
+# Function to compute the source offset covered by chunks about to be committed
+# Chunks carry their source row numbers as index; rows filtered out after the last committed row are
+# read again on resume, which the deduplicating strategies skip again
+def committed_offset(chunks, offset):
+    for chunk in chunks:
+        chunk = chunk[1] if isinstance(chunk, tuple) else chunk
+        if len(chunk):
+            offset = max(offset, int(chunk.index[-1]) + 1)
+    return offset
+
+# Function to build the statement recording a checkpoint; `placeholder(n)` renders the n-th parameter
+# ('%s' for psycopg2, '$n' for asyncpg)
+def checkpoint_upsert_query(placeholder=lambda n: '%s'):
+    values = ', '.join(placeholder(n) for n in range(1, 9))
+    return (
+        f"INSERT INTO {CHECKPOINT_TABLE} (table_name, file_path, source_signature, strategy, run_id, "
+        f"committed_rows, committed_chunks, state, updated_at) VALUES ({values}, now()) "
+        f"ON CONFLICT (table_name, file_path) DO UPDATE SET source_signature = EXCLUDED.source_signature, "
+        f"strategy = EXCLUDED.strategy, run_id = EXCLUDED.run_id, committed_rows = EXCLUDED.committed_rows, "
+        f"committed_chunks = EXCLUDED.committed_chunks, state = EXCLUDED.state, updated_at = now()"
+    )
+
+# Function to build the parameters of checkpoint_upsert_query
+def checkpoint_params(checkpoint):
+    run = current_run()
+    return (checkpoint['table_name'], checkpoint['file_path'], checkpoint['source_signature'], checkpoint['strategy'],
+            run['run_id'] if run else None, checkpoint['rows'], checkpoint['chunks'],
+            json.dumps(checkpoint['state'], default=str))
+
+# Function to record the chunks about to be committed, in the caller's transaction
+def save_checkpoint(conn, checkpoint, chunks):
+    checkpoint['rows'] = committed_offset(chunks, checkpoint['rows'])
+    checkpoint['chunks'] += len(chunks)
+    with conn.cursor() as cur:
+        cur.execute(checkpoint_upsert_query(), checkpoint_params(checkpoint))
+
+# Function to drop the checkpoint of a completed load, in the caller's transaction
+def clear_checkpoint(conn, checkpoint):
+    if checkpoint is None:
+        return
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE table_name = %s AND file_path = %s",
+                    (checkpoint['table_name'], checkpoint['file_path']))
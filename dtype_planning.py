@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import threading
+import numpy as np
+import pandas as pd
+from source_readers import read_source, iter_source_chunks, normalize_file_format, downcast_numeric_columns
+
+try:
+    import pyarrow
+except ImportError:  # Arrow-backed strings need pyarrow; without it string columns keep their default dtype
+    pyarrow = None
+
+
+# Rows read by the pre-scan that plans the dtypes of a source without a declared schema
+DTYPE_SAMPLE_ROWS = 10_000
+
+# String columns with at most this share of distinct values in the sample are read as categoricals
+CATEGORY_MAX_RATIO = 0.5
+
+# Rows per chunk of the pre-scan that unifies the dtypes of chunked reads
+PROFILE_CHUNK_ROWS = 500_000
+
+_plans = {}
+_plans_lock = threading.Lock()
+
+# Function to return the Arrow-backed string dtype keeping NaN as missing value (what the strategies expect)
+def arrow_string_dtype():
+    if pyarrow is None:
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+    except TypeError:  # pandas < 2.1 has no na_value argument
+        return pd.StringDtype('pyarrow_numpy')
+
+# Function to parse the schema declared in the metadata table into a dtype per column
+# Accepts a JSON object ({"amount": "float32", ...}) or 'column:dtype' pairs separated by commas;
+# anything else (e.g. a bare column name) declares no dtypes and the source is pre-scanned instead
+def parse_schema_dtypes(schema):
+    if schema is None or not isinstance(schema, str) or not schema.strip():
+        return {}
+
+    text = schema.strip()
+    try:
+        declared = json.loads(text)
+    except ValueError:
+        declared = dict(part.split(':', 1) for part in text.split(',') if ':' in part)
+    if not isinstance(declared, dict):
+        return {}
+
+    dtypes = {}
+    for column, dtype in declared.items():
+        column, dtype = str(column).strip(), str(dtype).strip()
+        if dtype in ('str', 'string'):
+            dtypes[column] = arrow_string_dtype() or 'object'
+            continue
+        try:
+            dtypes[column] = pd.api.types.pandas_dtype(dtype)
+        except TypeError:
+            print(f"Ignoring unknown dtype '{dtype}' declared for column {column}.")
+    return dtypes
+
+# Function to read the first rows of a source for the pre-scan
+def read_sample(file_path, file_format=None, sample_rows=DTYPE_SAMPLE_ROWS):
+    for chunk in iter_source_chunks(file_path, sample_rows, file_format):
+        return chunk
+    return read_source(file_path, file_format)
+
+# Function to plan compact dtypes from a sample: low-cardinality strings become categoricals,
+# other strings Arrow-backed strings; numeric columns are downcast once parsed, since the sample
+# does not bound the values of the rest of the file
+def plan_from_sample(sample):
+    dtypes = {}
+    string_dtype = arrow_string_dtype()
+    for column in sample.columns:
+        values = sample[column]
+        if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+            continue
+        present = values.dropna()
+        # Columns that are empty in the sample may hold anything further down
+        if present.empty or not all(isinstance(value, str) for value in present.head(100)):
+            continue
+        if present.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            dtypes[column] = 'category'
+        elif string_dtype is not None:
+            dtypes[column] = string_dtype
+    return dtypes
+
+# Function to estimate the bytes per row of each column of a sample
+def bytes_per_row(sample):
+    if sample.empty:
+        return {}
+    usage = sample.memory_usage(index=False, deep=True)
+    return {column: usage[column] / len(sample) for column in sample.columns}
+
+# Function to plan the dtypes of a source: the table's declared schema wins, otherwise the source is pre-scanned
+# Plans are cached per source file (and schema), so tables sharing a source get the same read options
+# and can be served by one cached read
+def plan_dtypes(file_path, file_format=None, schema=None):
+    file_format = normalize_file_format(file_format, file_path)
+    declared = parse_schema_dtypes(schema)
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, file_format,
+           repr(sorted(declared.items(), key=lambda item: item[0])))
+
+    with _plans_lock:
+        plan = _plans.get(key)
+    if plan is not None:
+        return plan
+
+    if declared:
+        # A declared schema is authoritative: its dtypes are applied as given
+        plan = {'source': 'schema', 'dtype': declared, 'downcast': False, 'baseline': {}}
+    else:
+        sample = read_sample(file_path, file_format)
+        dtype = plan_from_sample(sample)
+        planned = downcast_numeric_columns(sample.astype(dtype) if dtype else sample)
+        plan = {
+            'source': 'sample',
+            'dtype': dtype,
+            'downcast': True,
+            'sample_rows': len(sample),
+            'baseline': bytes_per_row(sample),
+            'planned': bytes_per_row(planned),
+        }
+
+    with _plans_lock:
+        _plans[key] = plan
+    return plan
+
+# Function to find the cached plan of a source whose dtypes are `dtype` (e.g. to report on a read made with it)
+def cached_plan(file_path, dtype):
+    if dtype is None:
+        return None
+    file_path = os.path.abspath(file_path)
+    with _plans_lock:
+        for key, plan in _plans.items():
+            if key[0] == file_path and plan['dtype'] == dtype:
+                return plan
+    return None
+
+# Function to sum up how one chunk parsed a column: its dtype and the kind of values it holds
+def column_profile(values):
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind == 'f' and values.isna().all():
+        return dtype, 'empty'
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iuf':
+        return dtype, 'number'
+    if dtype == bool:
+        return dtype, 'bool'
+    if isinstance(dtype, pd.StringDtype):
+        return dtype, 'text'
+    if pd.api.types.is_object_dtype(dtype):
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        return dtype, {'string': 'text', 'boolean': 'bool'}.get(inferred, 'other')
+    return dtype, 'other'
+
+# Function to find the dtype a whole-file read gives a column, from how every chunk parsed it
+# (as parallel_csv.unified_dtype does for byte ranges); returns (dtype to cast chunks to, whether the
+# column must be parsed as text), or (None, False) when the chunks are left as parsed
+def unify_profiles(profiles):
+    dtypes = [dtype for dtype, _ in profiles]
+    kinds = {kind for _, kind in profiles}
+    # Text anywhere (with numbers or nothing elsewhere): the whole file keeps the raw text, which a chunk
+    # holding only numbers-like values would otherwise parse as numbers
+    if 'text' in kinds and kinds <= {'text', 'number', 'empty'}:
+        return None, True
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return (dtypes[0] if isinstance(dtypes[0], np.dtype) else None), False
+    if kinds <= {'number', 'empty'}:
+        return np.result_type(*dtypes), False
+    # Booleans with missing values in some chunks only: the whole file holds them as objects
+    if kinds <= {'bool', 'empty'}:
+        return np.dtype(object), False
+    return None, False
+
+# Function to plan how chunked reads of a source get the dtypes of a whole-file read: pandas infers the
+# dtypes of every chunk on its own, so a column with a missing value or a decimal in one chunk only would
+# be integer elsewhere, and its rows would render (and hash) differently than in a whole-file or
+# differently chunked read. The columns without a planned dtype are pre-scanned once, chunk by chunk.
+# Returns the read options with the columns to parse as text added to `dtype` and the dtypes to cast
+# every chunk to in `chunk_dtypes`
+def plan_chunk_dtypes(file_path, read_options):
+    file_format = normalize_file_format(read_options.get('file_format'), file_path)
+    if file_format == 'parquet':
+        return read_options
+
+    dtype = dict(read_options.get('dtype') or {})
+    columns = read_options.get('columns')
+    reader_options = {option: value for option, value in read_options.items()
+                      if option not in ('file_format', 'columns', 'dtype', 'downcast', 'parse_workers')}
+    stat = os.stat(file_path)
+    key = ('chunks', os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, file_format, repr(columns),
+           repr(sorted(dtype.items(), key=lambda item: item[0])), repr(sorted(reader_options.items())))
+
+    with _plans_lock:
+        plan = _plans.get(key)
+    if plan is None:
+        profiles = {}
+        scanned = None if not columns else [column for column in columns if column not in dtype]
+        if scanned is None or scanned:
+            for chunk in iter_source_chunks(file_path, PROFILE_CHUNK_ROWS, file_format, scanned, **reader_options):
+                for column in chunk.columns:
+                    if column not in dtype:
+                        profiles.setdefault(column, []).append(column_profile(chunk[column]))
+        plan = {'text': [], 'cast': {}}
+        for column, column_profiles in profiles.items():
+            target, as_text = unify_profiles(column_profiles)
+            if as_text:
+                plan['text'].append(column)
+            elif target is not None:
+                plan['cast'][column] = target
+        with _plans_lock:
+            _plans[key] = plan
+
+    dtype.update({column: str for column in plan['text']})
+    return dict(read_options, dtype=dtype or None, chunk_dtypes=plan['cast'])
+
+# Function to drop the cached plans (e.g. after changing DTYPE_SAMPLE_ROWS or CATEGORY_MAX_RATIO)
+def clear_dtype_plans():
+    with _plans_lock:
+        _plans.clear()
+
+# Function to report the memory of a frame read with a plan against the default dtypes
+# The baseline is extrapolated from the pre-scan sample, read with the default dtypes
+def memory_report(data, plan):
+    actual = int(data.memory_usage(index=False, deep=True).sum())
+    report = {'rows': len(data), 'bytes': actual, 'baseline_bytes': None, 'reduction_pct': None,
+              'plan': plan['source']}
+    baseline = plan.get('baseline') or {}
+    if baseline and all(column in baseline for column in data.columns):
+        estimated = int(sum(baseline[column] for column in data.columns) * len(data))
+        report['baseline_bytes'] = estimated
+        if estimated:
+            report['reduction_pct'] = round(100 * (1 - actual / estimated), 1)
+    return report
@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # no advisory file locks on this platform (e.g. Windows)
+    fcntl = None
+
+
+# Directory holding one hash index per target table
+HASH_INDEX_DIR = '.hash_index'
+
+# Bloom filter sizing: bits per indexed digest and number of probes per digest
+BLOOM_BITS_PER_KEY = 10
+BLOOM_PROBES = 7
+
+# Segments are merged in memory, so a merged segment never exceeds this many digests (32 bytes each)
+MAX_SEGMENT_ROWS = 16_000_000
+MAX_SEGMENTS = 8
+
+# Rows fetched per round trip when rebuilding an index from the target table
+REBUILD_FETCH_SIZE = 1_000_000
+
+DIGEST_DTYPE = np.dtype('S32')
+
+# Function to locate the index directory of a table
+def hash_index_path(table_name, base_dir=HASH_INDEX_DIR):
+    return os.path.join(base_dir, table_name.replace('.', '_'))
+
+# Function to convert hex digests (as stored in the hash column) to fixed-width 32-byte values
+def hex_to_digests(hex_hashes):
+    hex_hashes = list(hex_hashes)
+    if not hex_hashes:
+        return np.empty(0, dtype=DIGEST_DTYPE)
+    return np.frombuffer(bytes.fromhex(''.join(hex_hashes)), dtype=DIGEST_DTYPE)
+
+# Context manager holding an exclusive lock on an index across processes while its manifest is read, changed
+# and saved; the lock file sits next to the index directory, so rebuilding or dropping the index keeps it
+@contextmanager
+def index_lock(index_dir):
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(index_dir) or '.', exist_ok=True)
+    with open(f"{index_dir}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# Function to read the manifest describing the segments and Bloom filter of an index
+def load_manifest(index_dir):
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+# Function to atomically replace the manifest of an index
+def save_manifest(index_dir, manifest):
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+# Function to memory-map a sorted segment of digests
+def open_segment(index_dir, segment):
+    return np.memmap(os.path.join(index_dir, segment['file']), dtype=DIGEST_DTYPE, mode='r', shape=(segment['rows'],))
+
+# Function to write a sorted array of digests as a new segment file
+def write_segment(index_dir, manifest, digests):
+    file_name = f"segment_{manifest['next_segment']:06d}.bin"
+    manifest['next_segment'] += 1
+    digests.tofile(os.path.join(index_dir, file_name))
+    return {'file': file_name, 'rows': int(len(digests))}
+
+# Function to compute the Bloom filter bit positions of each digest (double hashing over the digest bytes)
+def bloom_positions(digests, bloom_bits):
+    words = np.ascontiguousarray(digests).view(np.uint64).reshape(-1, 4)
+    h1 = words[:, 0]
+    h2 = words[:, 1] | np.uint64(1)
+    probes = np.arange(BLOOM_PROBES, dtype=np.uint64)
+    return (h1[:, None] + probes[None, :] * h2[:, None]) % np.uint64(bloom_bits)
+
+# Function to set the Bloom filter bits of a batch of digests
+def bloom_add(bloom, bloom_bits, digests):
+    if len(digests) == 0:
+        return
+    positions = bloom_positions(digests, bloom_bits).ravel()
+    masks = np.left_shift(np.uint8(1), (positions % np.uint64(8)).astype(np.uint8))
+    np.bitwise_or.at(bloom, (positions // np.uint64(8)).astype(np.int64), masks)
+
+# Function to test digests against the Bloom filter; False means definitely not indexed
+def bloom_might_contain(bloom, bloom_bits, digests):
+    positions = bloom_positions(digests, bloom_bits)
+    bits = bloom[(positions // np.uint64(8)).astype(np.int64)] >> (positions % np.uint64(8)).astype(np.uint8)
+    return np.all(bits & 1, axis=1)
+
+# Function to open the Bloom filter of an index as a memory-mapped bit array
+def open_bloom(index_dir, manifest, mode='r+'):
+    return np.memmap(os.path.join(index_dir, 'bloom.bin'), dtype=np.uint8, mode=mode, shape=(manifest['bloom_bits'] // 8,))
+
+# Function to (re)size the Bloom filter for the current digest count and refill it from the segments
+def rebuild_bloom(index_dir, manifest):
+    capacity = max(manifest['count'] * 2, 1_000_000)
+    manifest['bloom_bits'] = int(capacity * BLOOM_BITS_PER_KEY // 8 * 8)
+    bloom = open_bloom(index_dir, manifest, mode='w+')
+    for segment in manifest['segments']:
+        digests = open_segment(index_dir, segment)
+        for start in range(0, len(digests), REBUILD_FETCH_SIZE):
+            bloom_add(bloom, manifest['bloom_bits'], np.array(digests[start:start + REBUILD_FETCH_SIZE]))
+    bloom.flush()
+
+# Function to check which 32-byte digests are already present in the index
+def lookup_digests(index_dir, digests):
+    found = np.zeros(len(digests), dtype=bool)
+    manifest = load_manifest(index_dir)
+    if manifest is None or manifest['count'] == 0 or len(digests) == 0:
+        return found
+
+    # Only digests that pass the Bloom filter are searched in the sorted segments
+    bloom = open_bloom(index_dir, manifest, mode='r')
+    candidates = np.flatnonzero(bloom_might_contain(bloom, manifest['bloom_bits'], digests))
+    if len(candidates) == 0:
+        return found
+
+    # Probing in sorted order keeps memory-mapped page accesses sequential
+    order = np.argsort(digests[candidates], kind='stable')
+    candidates = candidates[order]
+    probe = digests[candidates]
+    for segment in manifest['segments']:
+        segment_digests = open_segment(index_dir, segment)
+        positions = np.searchsorted(segment_digests, probe)
+        in_range = positions < len(segment_digests)
+        hits = np.zeros(len(probe), dtype=bool)
+        hits[in_range] = segment_digests[positions[in_range]] == probe[in_range]
+        found[candidates[hits]] = True
+    return found
+
+# Function to check which hex digests are already present in the index
+def lookup_hashes(index_dir, hex_hashes):
+    return lookup_digests(index_dir, hex_to_digests(hex_hashes))
+
+# Function to merge the smallest segments together while the merged size stays bounded
+def compact_segments(index_dir, manifest):
+    if len(manifest['segments']) <= MAX_SEGMENTS:
+        return
+
+    merge, rows = [], 0
+    for segment in sorted(manifest['segments'], key=lambda s: s['rows']):
+        if rows + segment['rows'] > MAX_SEGMENT_ROWS:
+            break
+        merge.append(segment)
+        rows += segment['rows']
+    if len(merge) < 2:
+        return
+
+    merged = np.sort(np.concatenate([np.array(open_segment(index_dir, s)) for s in merge]))
+    new_segment = write_segment(index_dir, manifest, merged)
+    manifest['segments'] = [s for s in manifest['segments'] if s not in merge] + [new_segment]
+    save_manifest(index_dir, manifest)
+    for segment in merge:
+        os.remove(os.path.join(index_dir, segment['file']))
+
+# Function to add the hashes of newly committed rows to the index
+# Concurrent loads of the table each add their own rows, so the manifest is updated under the index lock
+def add_hashes(index_dir, hex_hashes):
+    with index_lock(index_dir):
+        manifest = load_manifest(index_dir)
+        if manifest is None:
+            raise FileNotFoundError(f"No hash index found in {index_dir}; rebuild it first.")
+
+        digests = np.unique(hex_to_digests(hex_hashes))
+        # Segments stay disjoint, so the digest count is the sum of segment sizes
+        digests = digests[~lookup_digests(index_dir, digests)]
+        if len(digests) == 0:
+            return 0
+
+        manifest['segments'].append(write_segment(index_dir, manifest, digests))
+        manifest['count'] += int(len(digests))
+        if manifest['count'] * BLOOM_BITS_PER_KEY > manifest['bloom_bits']:
+            rebuild_bloom(index_dir, manifest)
+        else:
+            bloom = open_bloom(index_dir, manifest)
+            bloom_add(bloom, manifest['bloom_bits'], digests)
+            bloom.flush()
+        save_manifest(index_dir, manifest)
+
+        compact_segments(index_dir, manifest)
+    return int(len(digests))
+
+# Function to rebuild the index of a table from its hash column, streaming in hash order (under the index lock)
+def rebuild_hash_index(conn, table_name, base_dir=HASH_INDEX_DIR):
+    index_dir = hash_index_path(table_name, base_dir)
+    with index_lock(index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        for file_name in os.listdir(index_dir):
+            os.remove(os.path.join(index_dir, file_name))
+
+        manifest = {'count': 0, 'segments': [], 'next_segment': 0, 'bloom_bits': 0}
+        file_name = f"segment_{manifest['next_segment']:06d}.bin"
+        manifest['next_segment'] += 1
+
+        # ORDER BY hash lets the whole table land in one sorted segment without sorting in memory
+        last_digest = None
+        with open(os.path.join(index_dir, file_name), 'wb') as segment_file:
+            with conn.cursor(name=f"rebuild_{table_name.replace('.', '_')}_hash_index") as cur:
+                cur.itersize = REBUILD_FETCH_SIZE
+                cur.execute(f"SELECT DISTINCT hash FROM {table_name} WHERE hash IS NOT NULL ORDER BY hash")
+                while True:
+                    rows = cur.fetchmany(REBUILD_FETCH_SIZE)
+                    if not rows:
+                        break
+                    digests = hex_to_digests(row[0] for row in rows)
+                    if last_digest is not None and digests[0] == last_digest:
+                        digests = digests[1:]
+                    if len(digests):
+                        digests.tofile(segment_file)
+                        last_digest = digests[-1]
+                        manifest['count'] += int(len(digests))
+
+        if manifest['count']:
+            manifest['segments'].append({'file': file_name, 'rows': manifest['count']})
+        else:
+            os.remove(os.path.join(index_dir, file_name))
+        rebuild_bloom(index_dir, manifest)
+        save_manifest(index_dir, manifest)
+        return index_dir
+
+# Function to open the index of a table, building it from the table when it does not exist yet
+def open_hash_index(conn, table_name, base_dir=HASH_INDEX_DIR):
+    index_dir = hash_index_path(table_name, base_dir)
+    if load_manifest(index_dir) is None:
+        print(f"No hash index for {table_name}; building it from the table.")
+        rebuild_hash_index(conn, table_name, base_dir)
+    return index_dir
+
+# Function to drop the index of a table, e.g. before a load that writes the table without updating it
+# The manifest goes first, so an interrupted removal still reads as no index; the next run using it rebuilds it
+def invalidate_hash_index(table_name, base_dir=HASH_INDEX_DIR):
+    index_dir = hash_index_path(table_name, base_dir)
+    if not os.path.isdir(index_dir):
+        return False
+    manifest_path = os.path.join(index_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    shutil.rmtree(index_dir, ignore_errors=True)
+    return True
+
+# Function to check that the index and the target table agree on the set of distinct hashes
+def check_hash_index(conn, table_name, base_dir=HASH_INDEX_DIR, sample_size=10_000):
+    index_dir = hash_index_path(table_name, base_dir)
+    manifest = load_manifest(index_dir)
+    if manifest is None:
+        return False
+
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(DISTINCT hash) FROM {table_name}")
+        table_count = cur.fetchone()[0]
+        if table_count != manifest['count']:
+            print(f"Hash index for {table_name} has {manifest['count']} digests, table has {table_count}.")
+            return False
+
+        # Spot-check a random sample of the table against the index
+        cur.execute(f"SELECT hash FROM {table_name} TABLESAMPLE SYSTEM (1) WHERE hash IS NOT NULL LIMIT {int(sample_size)}")
+        sample = [row[0] for row in cur.fetchall()]
+    missing = int((~lookup_hashes(index_dir, sample)).sum())
+    if missing:
+        print(f"Hash index for {table_name} is missing {missing} of {len(sample)} sampled hashes.")
+        return False
+    return True
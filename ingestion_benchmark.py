@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+# Reproducible benchmark of the four ingestion strategies over synthetic, scaled-up versions
+# of the bundled datasets. Every (dataset, size, strategy) run executes in a fresh process so
+# its peak RSS is measured in isolation; results are written as JSON for cross-commit comparison.
+#
+#   python ingestion_benchmark.py --sizes 10000 100000 1000000 --output results.json
+#   python ingestion_benchmark.py --compare baseline.json results.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+import psycopg2
+from bulk_loader import bulk_load
+from ingestion_metrics import ingestion_run, peak_rss_mb
+from row_hashing import hash_rows
+from watermarks import METADATA_TABLE
+
+
+# Bundled seed datasets and the columns the generator rewrites
+DATASETS = {
+    'sales': {
+        'seed_file': 'mock_sales_data_5000.csv',
+        'id_column': 'sale_id',
+        'timestamp_column': 'sale_date',
+        'date_format': '%Y-%m-%d',
+    },
+    'bank': {
+        'seed_file': 'BankTransactionDataset_1K.csv',
+        'id_column': 'transaction_id',
+        'timestamp_column': 'transaction_date',
+        'date_format': '%m/%d/%Y',
+    },
+}
+
+STRATEGIES = ['full', 'date', 'hash', 'hybrid']
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+
+# Synthetic timestamps: the base load covers BASE_DAYS days, new rows of the increment follow it
+BASE_START = datetime(2020, 1, 1)
+BASE_DAYS = 1000
+
+SQL_TYPES = {'i': 'BIGINT', 'u': 'BIGINT', 'f': 'DOUBLE PRECISION', 'b': 'BOOLEAN', 'M': 'TIMESTAMP'}
+
+# Function to generate sorted random dates between two day offsets from BASE_START
+def random_dates(rng, n_rows, first_day, last_day, date_format):
+    days = np.sort(rng.integers(first_day, last_day, n_rows))
+    return (pd.Timestamp(BASE_START) + pd.to_timedelta(days, unit='D')).strftime(date_format)
+
+# Function to build a synthetic frame with the seed's columns, dtypes and value distributions
+# Each column is resampled independently from the seed; ids are unique and dates are regenerated
+def scale_up(seed, spec, n_rows, rng, first_id, first_day, last_day):
+    data = pd.DataFrame({column: rng.choice(seed[column].to_numpy(), n_rows) for column in seed.columns})
+    data = data.astype(seed.dtypes.to_dict())
+    data[spec['id_column']] = np.arange(first_id, first_id + n_rows)
+    data[spec['timestamp_column']] = random_dates(rng, n_rows, first_day, last_day, spec['date_format'])
+    # Keep derived columns consistent with their inputs
+    if {'quantity_sold', 'unit_price', 'total_sale'} <= set(data.columns):
+        data['total_sale'] = data['quantity_sold'] * data['unit_price']
+    return data
+
+# Function to write the base file and the incremental file of one dataset at one size
+# The increment has the same size as the base: `duplicate_ratio` of it repeats base rows exactly,
+# `late_ratio` arrives with timestamps inside the base range, the rest is new and after the base
+def generate_dataset(name, n_rows, duplicate_ratio, late_ratio, seed, out_dir):
+    spec = DATASETS[name]
+    rng = np.random.default_rng(seed)
+    seed_data = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), spec['seed_file']))
+
+    base = scale_up(seed_data, spec, n_rows, rng, 1, 0, BASE_DAYS)
+
+    n_duplicates = int(n_rows * duplicate_ratio)
+    n_late = int(n_rows * late_ratio)
+    n_new = n_rows - n_duplicates - n_late
+    duplicates = base.iloc[rng.choice(n_rows, n_duplicates, replace=False)] if n_duplicates else base.iloc[:0]
+    late = scale_up(seed_data, spec, n_late, rng, n_rows + 1, 0, BASE_DAYS)
+    new = scale_up(seed_data, spec, n_new, rng, n_rows + n_late + 1, BASE_DAYS, 2 * BASE_DAYS)
+    increment = pd.concat([duplicates, late, new], ignore_index=True)
+    increment = increment.iloc[rng.permutation(len(increment))]
+
+    base_file = os.path.join(out_dir, f"{name}_{n_rows}_base.csv")
+    increment_file = os.path.join(out_dir, f"{name}_{n_rows}_increment.csv")
+    base.to_csv(base_file, index=False)
+    increment.to_csv(increment_file, index=False)
+    return base_file, increment_file
+
+# Function to create the target table of a run from the dtypes of its source
+def create_target_table(conn, table_name, data, timestamp_column):
+    columns = []
+    for column, dtype in data.dtypes.items():
+        sql_type = 'TIMESTAMP' if column == timestamp_column else SQL_TYPES.get(dtype.kind, 'TEXT')
+        columns.append(f'"{column}" {sql_type}')
+    columns.append('hash TEXT')
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+        cur.execute(f"CREATE TABLE {table_name} ({', '.join(columns)})")
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} "
+                    f"(table_name TEXT PRIMARY KEY, watermark TIMESTAMP, last_ingestion_date TIMESTAMP)")
+        cur.execute(f"DELETE FROM {METADATA_TABLE} WHERE table_name = %s", (table_name,))
+        cur.execute(f"INSERT INTO {METADATA_TABLE} (table_name) VALUES (%s)", (table_name,))
+    conn.commit()
+
+# Function to preload the base file for the incremental strategies, outside the measured run
+def seed_target_table(conn, table_name, base_file, strategy, timestamp_column):
+    base = pd.read_csv(base_file)
+    if strategy == 'hash':
+        base['hash'] = hash_rows(base)
+    bulk_load(conn, base, table_name)
+    if strategy == 'date':
+        with conn.cursor() as cur:
+            cur.execute(f"UPDATE {METADATA_TABLE} SET watermark = (SELECT MAX({timestamp_column}) FROM {table_name}) "
+                        f"WHERE table_name = %s", (table_name,))
+    conn.commit()
+
+# Function to run one strategy in a worker process and measure it (executed in a fresh process)
+def run_strategy(dsn, strategy, file_path, table_name, timestamp_column, batch_size, chunksize):
+    os.environ['DATABASE_URL'] = dsn
+    import ingestion_core
+
+    start_time = time.time()
+    with ingestion_run(table_name, strategy, file_path) as metrics:
+        if chunksize:
+            connection = ingestion_core.conn
+            if strategy == 'full':
+                rows = ingestion_core.streaming_full_ingestion(connection, file_path, table_name, batch_size, chunksize)
+            elif strategy == 'date':
+                rows = ingestion_core.streaming_date_based_ingestion(connection, file_path, table_name, timestamp_column,
+                                                                     batch_size, chunksize)
+            elif strategy == 'hash':
+                rows = ingestion_core.streaming_hash_based_ingestion(connection, file_path, table_name, batch_size, chunksize)
+            else:
+                rows = ingestion_core.streaming_hybrid_ingestion(connection, file_path, table_name, timestamp_column,
+                                                                 batch_size, chunksize)
+        elif strategy == 'full':
+            rows = ingestion_core.full_ingestion(file_path, table_name, batch_size)
+        elif strategy == 'date':
+            rows = ingestion_core.date_based_ingestion(file_path, table_name, timestamp_column, batch_size)
+        elif strategy == 'hash':
+            rows = ingestion_core.hash_based_ingestion(file_path, table_name, batch_size)
+        else:
+            rows = ingestion_core.hybrid_ingestion(file_path, table_name, timestamp_column, batch_size)
+    elapsed_time = time.time() - start_time
+
+    ingestion_core.conn.close()
+    return {'rows_loaded': rows, 'ingest_seconds': elapsed_time, 'peak_rss_mb': round(peak_rss_mb(), 1),
+            'ingest_stages': {name: round(entry['seconds'], 3) for name, entry in metrics['stages'].items()}}
+
+# Function to start a throwaway embedded PostgreSQL server when no DSN is given
+def start_embedded_postgres():
+    try:
+        import testing.postgresql
+    except ImportError:
+        raise RuntimeError("No --dsn given and testing.postgresql is not installed to start an embedded PostgreSQL.")
+    server = testing.postgresql.Postgresql()
+    return server, server.url()
+
+# Function to read the commit the benchmark runs against, so results can be compared across commits
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Function to run the whole benchmark matrix and return one record per (dataset, size, strategy)
+def run_benchmark(dsn, datasets, sizes, strategies, duplicate_ratio, late_ratio, seed=42, batch_size=None,
+                  chunksize=None, work_dir=None):
+    results = []
+    commit = current_commit()
+    with tempfile.TemporaryDirectory(dir=work_dir) as out_dir:
+        conn = psycopg2.connect(dsn)
+        for name in datasets:
+            spec = DATASETS[name]
+            for n_rows in sizes:
+                start_time = time.time()
+                base_file, increment_file = generate_dataset(name, n_rows, duplicate_ratio, late_ratio, seed, out_dir)
+                generate_seconds = time.time() - start_time
+
+                for strategy in strategies:
+                    table_name = f"bench_{name}_{strategy}"
+                    sample = pd.read_csv(base_file, nrows=1000)
+                    create_target_table(conn, table_name, sample, spec['timestamp_column'])
+
+                    start_time = time.time()
+                    if strategy != 'full':
+                        seed_target_table(conn, table_name, base_file, strategy, spec['timestamp_column'])
+                    seed_seconds = time.time() - start_time
+
+                    file_path = base_file if strategy == 'full' else increment_file
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                        run = executor.submit(run_strategy, dsn, strategy, file_path, table_name,
+                                              spec['timestamp_column'], batch_size, chunksize).result()
+
+                    record = {
+                        'commit': commit,
+                        'dataset': name,
+                        'strategy': strategy,
+                        'rows': n_rows,
+                        'duplicate_ratio': duplicate_ratio,
+                        'late_ratio': late_ratio,
+                        'chunksize': chunksize,
+                        'rows_loaded': run['rows_loaded'],
+                        'rows_per_second': round(n_rows / run['ingest_seconds'], 1) if run['ingest_seconds'] else None,
+                        'peak_rss_mb': run['peak_rss_mb'],
+                        'stages': {
+                            'generate': round(generate_seconds, 3),
+                            'seed_load': round(seed_seconds, 3),
+                            'ingest': round(run['ingest_seconds'], 3),
+                        },
+                        'ingest_stages': run['ingest_stages'],
+                    }
+                    results.append(record)
+                    print(f"{name:6} {n_rows:>10} {strategy:7} {str(record['rows_per_second']):>12} rows/s "
+                          f"{record['peak_rss_mb']:>9} MB peak")
+
+                    with conn.cursor() as cur:
+                        cur.execute(f"DROP TABLE IF EXISTS {table_name}")
+                    conn.commit()
+        conn.close()
+    return results
+
+# Function to flag runs whose throughput dropped by more than `tolerance` against a baseline
+def compare_results(baseline, current, tolerance=0.10):
+    key = lambda record: (record['dataset'], record['strategy'], record['rows'], record.get('chunksize'))
+    baseline_by_key = {key(record): record for record in baseline}
+    regressions = []
+    for record in current:
+        previous = baseline_by_key.get(key(record))
+        if not previous or not previous['rows_per_second'] or not record['rows_per_second']:
+            continue
+        change = record['rows_per_second'] / previous['rows_per_second'] - 1
+        print(f"{record['dataset']:6} {record['rows']:>10} {record['strategy']:7} {change:+.1%}")
+        if change < -tolerance:
+            regressions.append({'run': key(record), 'baseline': previous['rows_per_second'],
+                                'current': record['rows_per_second'], 'change': round(change, 4)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion strategies on synthetic datasets.")
+    parser.add_argument('--dsn', help="PostgreSQL DSN; an embedded server is started when omitted")
+    parser.add_argument('--datasets', nargs='+', default=list(DATASETS), choices=list(DATASETS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--strategies', nargs='+', default=STRATEGIES, choices=STRATEGIES)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--late-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--chunksize', type=int, help="benchmark the streaming pipeline with this chunk size")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="compare two result files instead of running the benchmark")
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%}: {json.dumps(regressions, indent=2)}")
+            sys.exit(1)
+        return
+
+    server = None
+    dsn = args.dsn
+    if dsn is None:
+        server, dsn = start_embedded_postgres()
+    try:
+        results = run_benchmark(dsn, args.datasets, args.sizes, args.strategies, args.duplicate_ratio,
+                                args.late_ratio, args.seed, args.batch_size, args.chunksize)
+    finally:
+        if server is not None:
+            server.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,40 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import os
 import pandas as pd
 import psycopg2
 import hashlib
 import time
-from datetime import datetime
-
-
-# Establish database connection -- setup to be provided
+from bulk_loader import bulk_load, insert_new_rows_by_hash, merge_rows_by_key, parse_key_columns
+from row_hashing import hash_rows
+from hash_index import open_hash_index, lookup_hashes, add_hashes, invalidate_hash_index
+from streaming_ingestion import (streaming_full_ingestion, streaming_date_based_ingestion,
+                                 streaming_hash_based_ingestion, streaming_hybrid_ingestion, streaming_merge_ingestion,
+                                 DEFAULT_CHUNK_SIZE)
+from async_ingestion import (async_full_ingestion, async_date_based_ingestion, async_hash_based_ingestion,
+                             async_hybrid_ingestion, async_merge_ingestion, async_reload_blockers)
+from watermarks import read_watermark, advance_watermark, rows_after_watermark, mark_ingested, DEFAULT_WATERMARK
+from source_cache import cached_read_source_with_hashes, source_cache_stats
+from source_readers import fetch_target_columns
+from dtype_planning import plan_dtypes, plan_chunk_dtypes, cached_plan, memory_report
+from ingestion_metrics import stage, ingestion_run, persist_run_record, annotate_run
+from metadata_rules import preflight_check, VALID_DEDUP_MODES
+from table_swap import prepare_full_load, finish_full_load
+from checkpoints import open_checkpoint
+from retry_policy import parse_retry_policy, retry_delay, is_transient, record_failure
+from parallel_executor import create_connection_pool, run_tables_in_parallel, resolve_concurrency_level
+from partitioned_ingestion import (partition_spec, prepare_partitioned_table, partitioned_full_ingestion,
+                                   partitioned_date_based_ingestion, partitioned_hash_based_ingestion)
+
+
+# Establish database connection -- setup to be provided (DATABASE_URL environment variable)
+DATABASE_URL = os.environ.get('DATABASE_URL')
 
 conn = psycopg2.connect(DATABASE_URL)
 cursor = conn.cursor()
 
-# Function to calculate hash
+# Function to calculate hash (reference row-wise implementation; hash_rows reproduces it in bulk)
 def calculate_hash(row):
     row_string = '|'.join(map(str, row))
     return hashlib.sha256(row_string.encode()).hexdigest()
@@ -23,90 +45,170 @@ def fetch_metadata():
     metadata = pd.read_sql(query, conn)
     return metadata
 
+# Function to read the source of a run, recorded as the 'read' stage (file read and parse)
+# with_hashes: also return the row hashes computed while parsing the source (None when there are none)
+def read_new_data(file_path, read_options=None, with_hashes=False):
+    with stage('read', bytes_read=os.path.getsize(file_path)) as counters:
+        new_data, row_hashes = cached_read_source_with_hashes(file_path, **(read_options or {}))
+        counters['rows'] = len(new_data)
+    report_memory(file_path, new_data, read_options)
+    if with_hashes:
+        return new_data, row_hashes
+    return new_data
+
+# Function to report the memory held by a source read with planned dtypes, against the default dtypes
+def report_memory(file_path, data, read_options):
+    plan = cached_plan(file_path, (read_options or {}).get('dtype'))
+    if plan is None:
+        return
+    report = memory_report(data, plan)
+    annotate_run(memory=report)
+    if report['reduction_pct'] is not None:
+        print(f"Source held in {report['bytes'] / 1024 ** 2:.2f} MB instead of an estimated "
+              f"{report['baseline_bytes'] / 1024 ** 2:.2f} MB ({report['reduction_pct']}% less).")
+    else:
+        print(f"Source held in {report['bytes'] / 1024 ** 2:.2f} MB ({report['plan']} dtypes).")
+
 # Function for date-based ingestion
-def date_based_ingestion(file_path, table_name, timestamp_column):
+# time_ordered: the source is sorted by timestamp_column, so the new rows are found by binary search
+# primary_key: merge the new rows on this key instead of appending them (historical_data_handling = Merge)
+def date_based_ingestion(file_path, table_name, timestamp_column, batch_size=None, connection=None, time_ordered=False,
+                         read_options=None, primary_key=None):
     start_time = time.time()
+    connection = connection or conn
 
     # Read new data
-    new_data = pd.read_csv(file_path)
-    new_data[timestamp_column] = pd.to_datetime(new_data[timestamp_column])
+    new_data = read_new_data(file_path, read_options)
+    with stage('timestamp_conversion', rows=len(new_data)):
+        new_data[timestamp_column] = pd.to_datetime(new_data[timestamp_column])
 
-    # Fetch max timestamp from the database
-    query = f"SELECT MAX({timestamp_column}) FROM {table_name}"
-    cursor.execute(query)
-    max_timestamp = cursor.fetchone()[0]
-    if max_timestamp is None:
-        max_timestamp = datetime(1970, 1, 1)
+    # Fetch the persisted watermark from the metadata table
+    with stage('lookup'):
+        max_timestamp = read_watermark(connection, table_name, timestamp_column)
 
     # Filter data based on the timestamp
-    filtered_data = new_data[new_data[timestamp_column] > max_timestamp]
-
-    # Insert filtered data into the database
-    for _, row in filtered_data.iterrows():
-        columns = ', '.join(filtered_data.columns)
-        placeholders = ', '.join(['%s'] * len(row))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        cursor.execute(insert_query, tuple(row))
-
-    conn.commit()
+    with stage('filter', rows=len(new_data)):
+        filtered_data = rows_after_watermark(new_data, timestamp_column, max_timestamp, time_ordered)
+
+    # Insert filtered data into the database and advance the watermark in the same transaction
+    if primary_key is not None:
+        with stage('hashing', rows=len(filtered_data)):
+            filtered_data = filtered_data.assign(hash=hash_rows(filtered_data))
+    with stage('load', rows=len(filtered_data)):
+        if primary_key is None:
+            loaded = bulk_load(connection, filtered_data, table_name, batch_size)
+        else:
+            counts = merge_rows_by_key(connection, filtered_data, table_name, parse_key_columns(primary_key),
+                                       batch_size)
+            loaded = counts['inserted'] + counts['updated']
+        advance_watermark(connection, table_name, filtered_data[timestamp_column].max())
+
+    with stage('commit'):
+        connection.commit()
+    if primary_key is not None:
+        annotate_run(merge_counts=counts)
     elapsed_time = time.time() - start_time
     print(f"Date-based ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
 
 # Function for hash-based ingestion
-def hash_based_ingestion(file_path, table_name):
+# dedup_mode: 'anti_join' or 'on_conflict' deduplicate server-side through a staging table,
+# 'local_index' checks rows against a persistent on-disk hash index of the table,
+# 'client' pulls every existing hash into Python and filters with isin
+def hash_based_ingestion(file_path, table_name, batch_size=None, dedup_mode='anti_join', connection=None,
+                         read_options=None):
     start_time = time.time()
+    connection = connection or conn
 
-    # Read new data
-    new_data = pd.read_csv(file_path)
-    new_data['hash'] = new_data.apply(calculate_hash, axis=1)
+    # Read new data, reusing the row hashes computed while parsing it if any
+    new_data, row_hashes = read_new_data(file_path, read_options, with_hashes=True)
+    with stage('hashing', rows=len(new_data)):
+        new_data['hash'] = row_hashes if row_hashes is not None else hash_rows(new_data)
 
-    # Fetch existing hashes from the database
-    query = f"SELECT hash FROM {table_name}"
-    existing_hashes = pd.read_sql(query, conn)['hash'].tolist()
+    if dedup_mode == 'client':
+        # Fetch existing hashes from the database
+        with stage('lookup') as counters:
+            query = f"SELECT hash FROM {table_name}"
+            existing_hashes = pd.read_sql(query, connection)['hash'].tolist()
+            counters['rows'] = len(existing_hashes)
+
+        # Filter new data based on hash
+        with stage('filter', rows=len(new_data)):
+            filtered_data = new_data[~new_data['hash'].isin(existing_hashes)]
+
+        # Insert filtered data into the database
+        with stage('load', rows=len(filtered_data)):
+            loaded = bulk_load(connection, filtered_data, table_name, batch_size)
+    elif dedup_mode == 'local_index':
+        # Filter new data against the local hash index instead of the table's hash column
+        with stage('lookup', rows=len(new_data)):
+            index_dir = open_hash_index(connection, table_name)
+            seen = lookup_hashes(index_dir, new_data['hash'])
+        with stage('filter', rows=len(new_data)):
+            filtered_data = new_data[~seen]
+
+        # Insert filtered data into the database
+        with stage('load', rows=len(filtered_data)):
+            loaded = bulk_load(connection, filtered_data, table_name, batch_size)
+    else:
+        # Stage the batch and insert only the rows whose hash is not in the table
+        # (lookup, filter and load happen in one server-side statement)
+        with stage('load', rows=len(new_data)):
+            loaded = insert_new_rows_by_hash(connection, new_data, table_name, batch_size, method=dedup_mode)
 
-    # Filter new data based on hash
-    filtered_data = new_data[~new_data['hash'].isin(existing_hashes)]
+    with stage('commit'):
+        connection.commit()
 
-    # Insert filtered data into the database
-    for _, row in filtered_data.iterrows():
-        columns = ', '.join(filtered_data.columns)
-        placeholders = ', '.join(['%s'] * len(row))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        cursor.execute(insert_query, tuple(row))
+    # The index only learns about rows once they are committed
+    if dedup_mode == 'local_index':
+        with stage('lookup', rows=len(filtered_data)):
+            add_hashes(index_dir, filtered_data['hash'])
 
-    conn.commit()
     elapsed_time = time.time() - start_time
     print(f"Hash-based ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
 
 # Function for full ingestion
-def full_ingestion(file_path, table_name):
+# load_mode: 'swap' loads a shadow table and swaps it in, so readers are only blocked for the swap;
+# 'truncate' truncates and reloads the live table
+def full_ingestion(file_path, table_name, batch_size=None, connection=None, read_options=None, load_mode='swap'):
     start_time = time.time()
+    connection = connection or conn
 
     # Read new data
-    new_data = pd.read_csv(file_path)
+    new_data = read_new_data(file_path, read_options)
 
-    # Truncate the table before full ingestion
-    truncate_query = f"TRUNCATE TABLE {table_name}"
-    cursor.execute(truncate_query)
+    # Load into a shadow table (or the truncated live table)
+    target_table = prepare_full_load(connection, table_name, load_mode)
 
     # Insert all data into the table
-    for _, row in new_data.iterrows():
-        columns = ', '.join(new_data.columns)
-        placeholders = ', '.join(['%s'] * len(row))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        cursor.execute(insert_query, tuple(row))
+    with stage('load', rows=len(new_data)):
+        loaded = bulk_load(connection, new_data, target_table, batch_size)
 
-    conn.commit()
+    finish_full_load(connection, table_name, target_table)
+
+    with stage('commit'):
+        connection.commit()
     elapsed_time = time.time() - start_time
     print(f"Full ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
 
-def hybrid_ingestion(file_path, table_name, timestamp_column):
+# Function for hybrid ingestion: full load of the first half, incremental load of the rest
+# load_mode as in full_ingestion: both halves are loaded into the shadow table before the swap
+def hybrid_ingestion(file_path, table_name, timestamp_column, batch_size=None, dedup_mode='anti_join', connection=None,
+                     read_options=None, load_mode='swap'):
     start_time = time.time()
+    connection = connection or conn
 
     # Read the new dataset
-    new_data = pd.read_csv(file_path)
-    new_data[timestamp_column] = pd.to_datetime(new_data[timestamp_column], errors="coerce") if timestamp_column else None
-    new_data['hash'] = new_data.apply(calculate_hash, axis=1)
+    new_data = read_new_data(file_path, read_options)
+    if pd.isna(timestamp_column):
+        timestamp_column = None
+    if timestamp_column:
+        with stage('timestamp_conversion', rows=len(new_data)):
+            new_data[timestamp_column] = pd.to_datetime(new_data[timestamp_column], errors="coerce")
+    with stage('hashing', rows=len(new_data)):
+        new_data['hash'] = hash_rows(new_data)
 
     # Split the dataset into two halves
     half_index = len(new_data) // 2
@@ -115,77 +217,416 @@ def hybrid_ingestion(file_path, table_name, timestamp_column):
 
     # Perform full ingestion on the first half
     print(f"Performing full ingestion for the first 50% of the dataset.")
-    truncate_query = f"TRUNCATE TABLE {table_name}"
-    cursor.execute(truncate_query)
+    target_table = prepare_full_load(connection, table_name, load_mode)
 
-    for _, row in full_data.iterrows():
-        columns = ', '.join(full_data.columns)
-        placeholders = ', '.join(['%s'] * len(row))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        cursor.execute(insert_query, tuple(row))
+    with stage('load', rows=len(full_data)):
+        loaded = bulk_load(connection, full_data, target_table, batch_size)
 
     # Perform incremental ingestion on the second half
     if timestamp_column:
         print(f"Performing date-based ingestion for the remaining 50% of the dataset.")
-        # Fetch max timestamp from the database
-        query_max_timestamp = f"SELECT MAX({timestamp_column}) FROM {table_name}"
-        cursor.execute(query_max_timestamp)
-        max_timestamp = cursor.fetchone()[0]
-        if max_timestamp is None:
-            max_timestamp = datetime(1970, 1, 1)
+        # The table was truncated, so its max timestamp is the max of the first half
+        with stage('lookup'):
+            max_timestamp = full_data[timestamp_column].max()
+            if pd.isna(max_timestamp):
+                max_timestamp = DEFAULT_WATERMARK
 
         # Filter incremental data based on timestamp
-        filtered_incremental_data = incremental_data[incremental_data[timestamp_column] > max_timestamp]
-    else:
+        with stage('filter', rows=len(incremental_data)):
+            filtered_incremental_data = incremental_data[incremental_data[timestamp_column] > max_timestamp]
+
+        # Insert filtered incremental data into the database
+        with stage('load', rows=len(filtered_incremental_data)):
+            loaded += bulk_load(connection, filtered_incremental_data, target_table, batch_size)
+
+        # Reset the watermark to the reloaded contents of the table
+        new_watermark = pd.concat([full_data[timestamp_column], filtered_incremental_data[timestamp_column]]).max()
+        advance_watermark(connection, table_name, new_watermark, reset=True)
+    elif dedup_mode == 'client':
         print(f"Performing hash-based ingestion for the remaining 50% of the dataset.")
         # Fetch existing hashes from the database
-        query_hashes = f"SELECT hash FROM {table_name}"
-        existing_hashes = pd.read_sql(query_hashes, conn)['hash'].tolist()
+        with stage('lookup') as counters:
+            query_hashes = f"SELECT hash FROM {target_table}"
+            existing_hashes = pd.read_sql(query_hashes, connection)['hash'].tolist()
+            counters['rows'] = len(existing_hashes)
 
         # Filter incremental data based on hash
-        filtered_incremental_data = incremental_data[~incremental_data['hash'].isin(existing_hashes)]
+        with stage('filter', rows=len(incremental_data)):
+            filtered_incremental_data = incremental_data[~incremental_data['hash'].isin(existing_hashes)]
 
-    # Insert filtered incremental data into the database
-    for _, row in filtered_incremental_data.iterrows():
-        columns = ', '.join(filtered_incremental_data.columns)
-        placeholders = ', '.join(['%s'] * len(row))
-        insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-        cursor.execute(insert_query, tuple(row))
+        # Insert filtered incremental data into the database
+        with stage('load', rows=len(filtered_incremental_data)):
+            loaded += bulk_load(connection, filtered_incremental_data, target_table, batch_size)
+    else:
+        print(f"Performing hash-based ingestion for the remaining 50% of the dataset.")
+        # Deduplicate the incremental half server-side through a staging table
+        with stage('load', rows=len(incremental_data)):
+            loaded += insert_new_rows_by_hash(connection, incremental_data, target_table, batch_size, method=dedup_mode)
 
-    conn.commit()
+    finish_full_load(connection, table_name, target_table)
+
+    with stage('commit'):
+        connection.commit()
     elapsed_time = time.time() - start_time
     print(f"Hybrid ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
 
+# Function for merge ingestion: upsert keyed on the primary key, skipping rows whose hash is unchanged
+# Returns the number of rows inserted or updated
+def merge_ingestion(file_path, table_name, primary_key, batch_size=None, connection=None, read_options=None):
+    start_time = time.time()
+    connection = connection or conn
 
-# Main ingestion function
-def perform_ingestion(file_path):
-    metadata = fetch_metadata()
+    # Read new data, reusing the row hashes computed while parsing it if any
+    new_data, row_hashes = read_new_data(file_path, read_options, with_hashes=True)
+    with stage('hashing', rows=len(new_data)):
+        new_data['hash'] = row_hashes if row_hashes is not None else hash_rows(new_data)
 
-    # Assume metadata contains columns: table_name, ingestion_type, schema, refresh_rate, timestamp_column
-    for _, meta in metadata.iterrows():
-        table_name = meta['table_name']
-        ingestion_type = meta['ingestion_type']
-        schema = meta['schema']  # Not used here but can validate dataset columns
-        timestamp_column = meta['timestamp_column']
+    # Stage the batch and apply it with one UPDATE and one INSERT
+    with stage('load', rows=len(new_data)):
+        counts = merge_rows_by_key(connection, new_data, table_name, parse_key_columns(primary_key), batch_size)
 
-        print(f"Starting {ingestion_type} ingestion for table: {table_name}")
+    with stage('commit'):
+        connection.commit()
+    annotate_run(merge_counts=counts)
 
+    elapsed_time = time.time() - start_time
+    print(f"Merge ingestion for {file_path} completed in {elapsed_time:.2f} seconds: "
+          f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged.")
+    return counts['inserted'] + counts['updated']
+
+
+# Function to build the reader options declared by a metadata row: the source format and a
+# projection onto the target table's columns plus the timestamp column
+# With the source's file_path, the dtypes planned for it (declared schema or pre-scan) are applied at read time
+def build_read_options(connection, meta, file_path=None):
+    timestamp_column = meta['timestamp_column']
+    columns = [column for column in fetch_target_columns(connection, meta['table_name']) if column != 'hash']
+    if columns and pd.notna(timestamp_column) and timestamp_column not in columns:
+        columns.append(timestamp_column)
+    read_options = {'file_format': meta.get('source_file_format'), 'columns': columns or None}
+    if file_path is not None:
+        plan = plan_dtypes(file_path, read_options['file_format'], meta.get('schema'))
+        read_options.update(dtype=plan['dtype'], downcast=plan['downcast'])
+    return read_options
+
+# Function to tell whether a metadata row asks for merge ingestion (historical_data_handling = Merge,
+# with a primary key to merge on): the rows its ingestion_type selects are upserted on the key instead of
+# appended (all of them for full loads, those past the watermark for date-based loads, those whose hash
+# changed for hash-based loads); hybrid reloads rebuild the table from the source and ignore it
+def uses_merge(meta):
+    handling = meta.get('historical_data_handling')
+    return (pd.notna(handling) and str(handling).strip().lower() == 'merge' and meta['ingestion_type'] != 'hybrid'
+            and bool(parse_key_columns(meta.get('primary_key'))))
+
+# Function to tell whether a merge selects its rows by watermark (date-based incremental loads)
+def merges_after_watermark(meta):
+    return uses_merge(meta) and meta['ingestion_type'] == 'incremental' and pd.notna(meta['timestamp_column'])
+
+# Function to tell whether a metadata row asks full reloads of its partitioned table to replace only the
+# partitions present in the batch (historical_data_handling = Overwrite Partitions) instead of the whole table
+def overwrites_partitions(meta):
+    handling = meta.get('historical_data_handling')
+    return pd.notna(handling) and ' '.join(str(handling).lower().split()) == 'overwrite partitions'
+
+# Dedup modes the async and partitioned paths support: they deduplicate server-side through staging tables
+SERVER_DEDUP_MODES = ['anti_join', 'on_conflict']
+
+# Function to read how the hash-based loads of a table deduplicate (dedup_mode column, default anti_join)
+# A mode the chosen path does not support falls back to anti_join
+def resolve_dedup_mode(meta, supported=VALID_DEDUP_MODES):
+    mode = meta.get('dedup_mode')
+    if mode is None or pd.isna(mode) or not str(mode).strip():
+        return 'anti_join'
+    mode = str(mode).strip().lower()
+    if mode not in supported:
+        print(f"Dedup mode '{mode}' is not supported by this load of table {meta['table_name']}; using anti_join.")
+        return 'anti_join'
+    return mode
+
+# Function to tell whether a table's source is sorted by its timestamp_column (time_ordered column, default
+# false): date-based loads then find the new rows by binary search and advance the watermark with every commit
+def is_time_ordered(meta):
+    value = meta.get('time_ordered')
+    return pd.notna(value) and str(value).strip().lower() in ('true', 'yes', '1')
+
+# Function to tell whether a run keeps the local hash index of its table up to date: only sequential
+# hash-based loads deduplicating against it do, any other load writes the table behind its back
+def maintains_hash_index(meta, pipeline_options=None):
+    dedup_mode = meta.get('dedup_mode')
+    return (pipeline_options is None and not uses_merge(meta) and meta['ingestion_type'] == 'incremental'
+            and pd.isna(meta['timestamp_column']) and pd.notna(dedup_mode)
+            and str(dedup_mode).strip().lower() == 'local_index')
+
+# Function to run the ingestion declared by one metadata row, returning the number of rows loaded
+# chunksize: stream the file in chunks of this many rows instead of reading it whole,
+# committing every `commit_every` chunks
+# pipeline_options: run the asyncio pipeline instead (see async_ingestion.DEFAULT_PIPELINE_OPTIONS),
+# streaming chunks of `chunksize` rows through concurrent parsing and database writes
+# parse_workers: parse and hash whole-file CSV sources on that many processes (see parallel_csv.py)
+# Every run is timed per stage and recorded in the audit table, failed runs included
+# Transient failures are retried as declared by retry_policy; chunked loads resume after their last
+# committed chunk, and every failure is written to the error_log and last_error_timestamp of the table
+# reconnect: called with a lost connection, returns the one to retry on (e.g. from a connection pool); the caller
+# then owns both. Without it, a lost connection is replaced by a private one, closed before returning
+def ingest_table(file_path, meta, connection=None, chunksize=None, commit_every=1, pipeline_options=None,
+                 parse_workers=None, reconnect=None):
+    connection = connection or conn
+    table_name = meta['table_name']
+    strategy = 'merge' if uses_merge(meta) else meta['ingestion_type']
+    policy = parse_retry_policy(meta.get('retry_policy'))
+    max_attempts = policy['retries'] + 1
+    reconnected = []
+
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                with ingestion_run(table_name, strategy, file_path) as run:
+                    run['attempt'] = attempt
+                    # A lost connection is replaced for the next attempts
+                    if connection.closed and reconnect:
+                        connection = reconnect(connection)
+                    elif connection.closed:
+                        connection = psycopg2.connect(DATABASE_URL)
+                        reconnected.append(connection)
+                    run['rows_loaded'] = dispatch_ingestion(file_path, meta, connection, chunksize, commit_every,
+                                                            pipeline_options, parse_workers)
+            except Exception as e:
+                # Discard the failed chunk but keep the record of the attempt and its error
+                record_failed_attempt(connection, run, table_name, e, attempt, max_attempts)
+                if attempt == max_attempts or not is_transient(e):
+                    raise
+                delay = retry_delay(policy, attempt)
+                print(f"Ingestion for table {table_name} failed ({e}); "
+                      f"retrying in {delay:.1f} seconds (attempt {attempt + 1}/{max_attempts}).")
+                time.sleep(delay)
+            else:
+                persist_run_record(connection, run)
+                mark_ingested(connection, table_name)
+                connection.commit()
+                return run['rows_loaded']
+    finally:
+        for extra_connection in reconnected:
+            extra_connection.close()
+
+# Function to roll back a failed attempt and record it (audit log and metadata error fields)
+# The connection may be the cause of the failure, so recording is best-effort
+def record_failed_attempt(connection, run, table_name, error, attempt, max_attempts):
+    if connection.closed:
+        print(f"Could not record the failure of table {table_name}: the connection is closed.")
+        return
+    try:
+        connection.rollback()
+        persist_run_record(connection, run)
+        record_failure(connection, table_name, error, attempt, max_attempts)
+        connection.commit()
+    except psycopg2.Error as e:
+        connection.rollback()
+        print(f"Could not record the failure of table {table_name}: {e}")
+
+# Function to dispatch one metadata row to its ingestion strategy
+def dispatch_ingestion(file_path, meta, connection, chunksize=None, commit_every=1, pipeline_options=None,
+                       parse_workers=None):
+    table_name = meta['table_name']
+    ingestion_type = meta['ingestion_type']
+    timestamp_column = meta['timestamp_column']
+    batch_size = meta.get('batch_size')
+    read_options = build_read_options(connection, meta, file_path)
+    if parse_workers and not chunksize and pipeline_options is None:
+        read_options['parse_workers'] = parse_workers
+
+    # A load that bypasses the local hash index would leave it stale, so the index is dropped before the
+    # table is written; the next local_index run rebuilds it from the table
+    local_index = maintains_hash_index(meta, pipeline_options)
+    if not local_index and invalidate_hash_index(table_name):
+        print(f"Dropped the local hash index of {table_name}; it is rebuilt by the next local_index load.")
+
+    if pipeline_options is not None:
+        return asyncio.run(dispatch_async_ingestion(file_path, meta, connection, chunksize or DEFAULT_CHUNK_SIZE,
+                                                    read_options, pipeline_options))
+
+    if merges_after_watermark(meta):
+        print(f"Starting date-based merge ingestion for table: {table_name}")
+        if chunksize:
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'date')
+            chunk_options = plan_chunk_dtypes(file_path, read_options)
+            return streaming_date_based_ingestion(connection, file_path, table_name, timestamp_column, batch_size,
+                                                  chunksize, commit_every, time_ordered=is_time_ordered(meta),
+                                                  read_options=chunk_options, checkpoint=checkpoint,
+                                                  primary_key=meta['primary_key'])
+        return date_based_ingestion(file_path, table_name, timestamp_column, batch_size, connection=connection,
+                                    time_ordered=is_time_ordered(meta), read_options=read_options,
+                                    primary_key=meta['primary_key'])
+    elif uses_merge(meta):
+        print(f"Starting merge ingestion for table: {table_name}")
+        if chunksize:
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'merge')
+            return streaming_merge_ingestion(connection, file_path, table_name, meta['primary_key'], batch_size,
+                                             chunksize, commit_every, checkpoint=checkpoint,
+                                             read_options=plan_chunk_dtypes(file_path, read_options))
+        return merge_ingestion(file_path, table_name, meta['primary_key'], batch_size, connection=connection,
+                               read_options=read_options)
+
+    print(f"Starting {ingestion_type} ingestion for table: {table_name}")
+
+    # Whole-file full and incremental loads of tables declaring a partitioning key go partition by partition,
+    # on up to concurrency_level connections; the other paths (and local_index loads) load partitioned tables
+    # through the parent
+    spec = None
+    if not chunksize and ingestion_type in ('full', 'incremental') and not local_index:
+        spec = partition_spec(connection, meta)
+    if spec and prepare_partitioned_table(connection, table_name, spec):
+        workers = resolve_concurrency_level(meta.get('concurrency_level'))
+        if ingestion_type == 'full':
+            return partitioned_full_ingestion(connection, DATABASE_URL, file_path, table_name, spec, batch_size,
+                                              read_options=read_options, workers=workers,
+                                              replace_partitions=overwrites_partitions(meta))
+        elif pd.notna(timestamp_column):
+            return partitioned_date_based_ingestion(connection, file_path, table_name, timestamp_column, spec,
+                                                    batch_size, read_options=read_options,
+                                                    time_ordered=is_time_ordered(meta))
+        return partitioned_hash_based_ingestion(connection, DATABASE_URL, file_path, table_name, spec, batch_size,
+                                                dedup_mode=resolve_dedup_mode(meta, SERVER_DEDUP_MODES),
+                                                read_options=read_options, workers=workers)
+
+    # Chunked loads checkpoint every commit and resume after their last committed chunk
+    # Their chunks are cast to the dtypes of a whole-file read, so rows hash alike whatever the chunking
+    if chunksize:
+        chunk_options = plan_chunk_dtypes(file_path, read_options)
         if ingestion_type == 'full':
-            full_ingestion(file_path, table_name)
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'full')
+            return streaming_full_ingestion(connection, file_path, table_name, batch_size, chunksize, commit_every,
+                                            read_options=chunk_options, checkpoint=checkpoint)
         elif ingestion_type == 'incremental' and pd.notna(timestamp_column):
-            date_based_ingestion(file_path, table_name, timestamp_column)
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'date')
+            return streaming_date_based_ingestion(connection, file_path, table_name, timestamp_column, batch_size, chunksize,
+                                                  commit_every, time_ordered=is_time_ordered(meta),
+                                                  read_options=chunk_options, checkpoint=checkpoint)
         elif ingestion_type == 'incremental':
-            hash_based_ingestion(file_path, table_name)
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'hash-based')
+            dedup_mode = resolve_dedup_mode(meta, SERVER_DEDUP_MODES + ['local_index'])
+            return streaming_hash_based_ingestion(connection, file_path, table_name, batch_size, chunksize, commit_every,
+                                                  dedup_mode, read_options=chunk_options, checkpoint=checkpoint)
         elif ingestion_type == 'hybrid':
-            hybrid_ingestion(file_path, table_name, timestamp_column)
-        else:
-            print(f"Unknown ingestion type: {ingestion_type}")
+            checkpoint = open_checkpoint(connection, table_name, file_path, 'hybrid')
+            return streaming_hybrid_ingestion(connection, file_path, table_name, timestamp_column, batch_size, chunksize,
+                                              commit_every, resolve_dedup_mode(meta, SERVER_DEDUP_MODES),
+                                              read_options=chunk_options, checkpoint=checkpoint)
+    elif ingestion_type == 'full':
+        return full_ingestion(file_path, table_name, batch_size, connection=connection, read_options=read_options)
+    elif ingestion_type == 'incremental' and pd.notna(timestamp_column):
+        return date_based_ingestion(file_path, table_name, timestamp_column, batch_size, connection=connection,
+                                    time_ordered=is_time_ordered(meta), read_options=read_options)
+    elif ingestion_type == 'incremental':
+        return hash_based_ingestion(file_path, table_name, batch_size, resolve_dedup_mode(meta), connection=connection,
+                                    read_options=read_options)
+    elif ingestion_type == 'hybrid':
+        return hybrid_ingestion(file_path, table_name, timestamp_column, batch_size,
+                                resolve_dedup_mode(meta, SERVER_DEDUP_MODES + ['client']), connection=connection,
+                                read_options=read_options)
+
+    print(f"Unknown ingestion type: {ingestion_type}")
+    return 0
+
+# Function to dispatch one metadata row to its strategy on the asyncio pipeline
+async def dispatch_async_ingestion(file_path, meta, connection, chunksize, read_options, pipeline_options):
+    table_name = meta['table_name']
+    ingestion_type = meta['ingestion_type']
+    timestamp_column = meta['timestamp_column']
+    batch_size = meta.get('batch_size')
+    # Chunks are cast to the dtypes of a whole-file read, so rows hash alike whatever the chunking
+    chunk_options = plan_chunk_dtypes(file_path, read_options)
+
+    if merges_after_watermark(meta):
+        print(f"Starting async date-based merge ingestion for table: {table_name}")
+        checkpoint = open_checkpoint(connection, table_name, file_path, 'date')
+        return await async_date_based_ingestion(connection, DATABASE_URL, file_path, table_name, timestamp_column,
+                                                batch_size, chunksize, time_ordered=is_time_ordered(meta),
+                                                read_options=chunk_options, pipeline_options=pipeline_options,
+                                                checkpoint=checkpoint, primary_key=meta['primary_key'])
+    elif uses_merge(meta):
+        print(f"Starting async merge ingestion for table: {table_name}")
+        return await async_merge_ingestion(connection, DATABASE_URL, file_path, table_name, meta['primary_key'],
+                                           batch_size, chunksize, chunk_options, pipeline_options)
+
+    # Reloads of tables that cannot be swapped truncate and load them in one transaction instead
+    if ingestion_type in ('full', 'hybrid'):
+        blockers = async_reload_blockers(connection, table_name)
+        if blockers:
+            print(f"Cannot reload {table_name} on the async pipeline ({'; '.join(blockers)}); "
+                  f"starting sequential {ingestion_type} ingestion instead.")
+            if ingestion_type == 'full':
+                return full_ingestion(file_path, table_name, batch_size, connection=connection,
+                                      read_options=read_options)
+            return hybrid_ingestion(file_path, table_name, timestamp_column, batch_size,
+                                    resolve_dedup_mode(meta, SERVER_DEDUP_MODES + ['client']), connection=connection,
+                                    read_options=read_options)
+
+    print(f"Starting async {ingestion_type} ingestion for table: {table_name}")
+    if ingestion_type == 'full':
+        return await async_full_ingestion(connection, DATABASE_URL, file_path, table_name, batch_size, chunksize,
+                                          chunk_options, pipeline_options=pipeline_options)
+    elif ingestion_type == 'incremental' and pd.notna(timestamp_column):
+        checkpoint = open_checkpoint(connection, table_name, file_path, 'date')
+        return await async_date_based_ingestion(connection, DATABASE_URL, file_path, table_name, timestamp_column,
+                                                batch_size, chunksize, time_ordered=is_time_ordered(meta),
+                                                read_options=chunk_options, pipeline_options=pipeline_options,
+                                                checkpoint=checkpoint)
+    elif ingestion_type == 'incremental':
+        return await async_hash_based_ingestion(connection, DATABASE_URL, file_path, table_name, batch_size, chunksize,
+                                                resolve_dedup_mode(meta, SERVER_DEDUP_MODES), read_options=chunk_options,
+                                                pipeline_options=pipeline_options)
+    elif ingestion_type == 'hybrid':
+        return await async_hybrid_ingestion(connection, DATABASE_URL, file_path, table_name, timestamp_column,
+                                            batch_size, chunksize, resolve_dedup_mode(meta, SERVER_DEDUP_MODES),
+                                            read_options=chunk_options, pipeline_options=pipeline_options)
+
+    print(f"Unknown ingestion type: {ingestion_type}")
+    return 0
 
-# Example usage
-file_path = "path/to/your/dataset.csv"
-perform_ingestion(file_path)
+# Main ingestion function
+# max_workers: load independent tables in parallel on a pool of that many connections
+# pipeline_options: load each table through the asyncio pipeline (see ingest_table)
+# parse_workers: parse and hash whole-file CSV sources on that many processes (see dispatch_ingestion)
+def perform_ingestion(file_path, chunksize=None, commit_every=1, max_workers=None, pipeline_options=None,
+                      parse_workers=None):
+    metadata = fetch_metadata()
+
+    # Pre-flight: apply the consistency rules and skip the tables with blocking alerts
+    metadata, alerts = preflight_check(metadata)
+    if not alerts.empty:
+        print(f"Pre-flight check raised {len(alerts)} alerts:")
+        print(alerts[['table_name', 'rule', 'severity', 'message']].to_string(index=False))
 
-# Close the connection
-cursor.close()
-conn.close()
+    # Assume metadata contains columns: table_name, ingestion_type, schema, refresh_rate, timestamp_column
+    if not max_workers:
+        for _, meta in metadata.iterrows():
+            ingest_table(file_path, meta, chunksize=chunksize, commit_every=commit_every,
+                         pipeline_options=pipeline_options, parse_workers=parse_workers)
+        print(f"Source cache: {source_cache_stats()}")
+        return None
+
+    pool = create_connection_pool(DATABASE_URL, max_workers)
+    try:
+        summary = run_tables_in_parallel(
+            pool, metadata,
+            lambda meta, connection, reconnect: ingest_table(file_path, meta, connection, chunksize, commit_every,
+                                                             pipeline_options, parse_workers, reconnect),
+            max_workers,
+        )
+    finally:
+        pool.closeall()
+
+    print(summary.to_string(index=False))
+    print(f"Source cache: {source_cache_stats()}")
+    return summary
+
+if __name__ == '__main__':
+    # Example usage
+    file_path = "path/to/your/dataset.csv"
+    perform_ingestion(file_path)
+
+    # Close the connection
+    cursor.close()
+    conn.close()
 
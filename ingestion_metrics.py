@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+
+# Table receiving one row per ingestion run (see the metadata table's audit_logs column)
+AUDIT_TABLE = 'ingestion_audit_log'
+
+# Stage names used by the ingestion functions
+STAGES = ['read', 'transform', 'timestamp_conversion', 'hashing', 'lookup', 'filter', 'partition', 'load', 'index', 'swap', 'commit']
+
+# Gauges written by the Prometheus text-file exporter
+METRIC_HELP = {
+    'ingestion_run_seconds': 'Duration of the last ingestion run.',
+    'ingestion_rows_loaded': 'Rows loaded by the last ingestion run.',
+    'ingestion_run_success': 'Whether the last ingestion run succeeded.',
+    'ingestion_peak_rss_bytes': 'Peak resident memory of the ingestion process.',
+    'ingestion_stage_seconds': 'Time spent per stage in the last ingestion run.',
+    'ingestion_stage_rows': 'Rows processed per stage in the last ingestion run.',
+    'ingestion_stage_bytes': 'Bytes read per stage in the last ingestion run.',
+}
+
+_hooks = []
+_local = threading.local()
+
+# Function to read the peak RSS of the current process in MB
+# VmHWM belongs to the process image, whereas Linux carries ru_maxrss over from the forking parent
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Function to register a hook called with every finished run record
+def register_metrics_hook(hook):
+    _hooks.append(hook)
+    return hook
+
+# Function to remove a previously registered hook
+def unregister_metrics_hook(hook):
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+# Function to return the run being recorded on this thread, if any
+def current_run():
+    return getattr(_local, 'run', None)
+
+# Function to attach extra fields (e.g. strategy-specific counts) to the run being recorded on this thread
+def annotate_run(**fields):
+    run = current_run()
+    if run is not None:
+        run.update(fields)
+
+# Context manager recording one ingestion run; stages timed on this thread are attached to it
+@contextmanager
+def ingestion_run(table_name, strategy, file_path):
+    run = {
+        'run_id': uuid.uuid4().hex,
+        'table_name': table_name,
+        'strategy': strategy,
+        'file_path': file_path,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'status': 'running',
+        'rows_loaded': None,
+        'stages': {},
+    }
+    previous_run = current_run()
+    _local.run = run
+    start_time = time.perf_counter()
+    try:
+        yield run
+        run['status'] = 'success'
+    except Exception as e:
+        run['status'] = 'failed'
+        run['error'] = str(e)
+        raise
+    finally:
+        run['elapsed_seconds'] = round(time.perf_counter() - start_time, 6)
+        run['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        _local.run = previous_run
+        for hook in list(_hooks):
+            try:
+                hook(run)
+            except Exception as e:
+                print(f"Metrics hook {hook} failed: {e}")
+
+# Context manager timing one stage of the current run; repeated stages (e.g. per chunk) accumulate
+# The yielded dict can be filled in with 'rows' and 'bytes' once they are known
+@contextmanager
+def stage(name, rows=None, bytes_read=None):
+    run = current_run()
+    counters = {'rows': rows, 'bytes': bytes_read}
+    if run is None:
+        yield counters
+        return
+
+    start_time = time.perf_counter()
+    start_peak = peak_rss_mb()
+    try:
+        yield counters
+    finally:
+        elapsed_time = time.perf_counter() - start_time
+        entry = run['stages'].setdefault(name, {'seconds': 0.0, 'rows': 0, 'bytes': 0, 'calls': 0,
+                                                'peak_rss_growth_mb': 0.0})
+        entry['seconds'] = round(entry['seconds'] + elapsed_time, 6)
+        entry['rows'] += int(counters['rows'] or 0)
+        entry['bytes'] += int(counters['bytes'] or 0)
+        entry['calls'] += 1
+        # The process peak only grows, so each stage is charged with how far it raised it
+        entry['peak_rss_growth_mb'] = round(entry['peak_rss_growth_mb'] + peak_rss_mb() - start_peak, 1)
+
+# Function to time a stage that is a generator: only the time spent producing each item is counted
+def timed_iter(name, iterable, bytes_per_item=None):
+    iterator = iter(iterable)
+    while True:
+        with stage(name) as counters:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            counters['rows'] = len(item) if hasattr(item, '__len__') else None
+            counters['bytes'] = bytes_per_item(item) if bytes_per_item else None
+        yield item
+
+# Function to build a hook appending each run record as one JSON line
+def jsonl_exporter(path):
+    lock = threading.Lock()
+
+    def export(run):
+        with lock, open(path, 'a') as f:
+            f.write(json.dumps(run, default=str) + '\n')
+    return export
+
+# Function to build a hook maintaining a Prometheus text-file collector file with the latest run per table
+def prometheus_textfile_exporter(path):
+    lock = threading.Lock()
+    latest_runs = {}
+
+    def label_string(labels):
+        escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"') for key, value in labels.items()}
+        return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+    def export(run):
+        with lock:
+            latest_runs[run['table_name']] = run
+            # Samples of one metric must form a single group, so they are collected per metric first
+            samples = {name: [] for name in METRIC_HELP}
+            for table_run in latest_runs.values():
+                labels = {'table': table_run['table_name'], 'strategy': table_run['strategy']}
+                samples['ingestion_run_seconds'].append((labels, table_run['elapsed_seconds']))
+                samples['ingestion_rows_loaded'].append((labels, table_run['rows_loaded'] or 0))
+                samples['ingestion_run_success'].append((labels, int(table_run['status'] == 'success')))
+                samples['ingestion_peak_rss_bytes'].append((labels, int(table_run['peak_rss_mb'] * 1024 * 1024)))
+                for stage_name, entry in table_run['stages'].items():
+                    stage_labels = dict(labels, stage=stage_name)
+                    samples['ingestion_stage_seconds'].append((stage_labels, entry['seconds']))
+                    samples['ingestion_stage_rows'].append((stage_labels, entry['rows']))
+                    samples['ingestion_stage_bytes'].append((stage_labels, entry['bytes']))
+
+            lines = []
+            for name, help_text in METRIC_HELP.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(f"{name}{{{label_string(labels)}}} {value}" for labels, value in samples[name])
+
+            # The collector may read the file at any time, so it is replaced atomically
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(tmp_path, path)
+    return export
+
+# Columns of the audit table besides the run id; fields of the run record without a column of their own
+# (e.g. partitions_loaded) are kept in details
+AUDIT_COLUMNS = {
+    'table_name': 'TEXT',
+    'strategy': 'TEXT',
+    'file_path': 'TEXT',
+    'started_at': 'TIMESTAMP',
+    'status': 'TEXT',
+    'attempt': 'INTEGER',
+    'error': 'TEXT',
+    'elapsed_seconds': 'DOUBLE PRECISION',
+    'rows_loaded': 'BIGINT',
+    'peak_rss_mb': 'DOUBLE PRECISION',
+    'stages': 'JSONB',
+    'merge_counts': 'JSONB',
+    'memory': 'JSONB',
+    'details': 'JSONB',
+}
+
+# Function to render a run record field for its audit column
+def audit_value(run, column):
+    if column == 'details':
+        details = {key: value for key, value in run.items() if key != 'run_id' and key not in AUDIT_COLUMNS}
+        return json.dumps(details, default=str) if details else None
+    value = run.get(column)
+    if AUDIT_COLUMNS[column] == 'JSONB' and value is not None:
+        return json.dumps(value, default=str)
+    return value
+
+# Function to persist a run record in the audit table (in the caller's transaction)
+# Audit tables created by earlier versions get the missing columns added (ALTER TABLE locks the table,
+# so it only runs when a column is missing)
+def persist_run_record(conn, run):
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (run_id TEXT PRIMARY KEY)")
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s "
+                    "AND table_schema = current_schema()", (AUDIT_TABLE,))
+        existing = {row[0] for row in cur.fetchall()}
+        missing = [column for column in AUDIT_COLUMNS if column not in existing]
+        if missing:
+            cur.execute(f"ALTER TABLE {AUDIT_TABLE} " +
+                        ", ".join(f"ADD COLUMN IF NOT EXISTS {column} {AUDIT_COLUMNS[column]}" for column in missing))
+        columns = ['run_id'] + list(AUDIT_COLUMNS)
+        cur.execute(
+            f"INSERT INTO {AUDIT_TABLE} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+            [run['run_id']] + [audit_value(run, column) for column in AUDIT_COLUMNS],
+        )
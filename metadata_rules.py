@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import pandas as pd
+
+
+# Columns of the alert frame returned by apply_rules
+ALERT_COLUMNS = ['row', 'table_name', 'rule', 'severity', 'column', 'fixed_value', 'message']
+
+VALID_INGESTION_TYPES = ['incremental', 'full', 'hybrid']
+VALID_COMPRESSION_TYPES = ['gzip', 'snappy']
+VALID_DEDUP_MODES = ['anti_join', 'on_conflict', 'client', 'local_index']
+
+# Function to compare a column case-insensitively with a value (missing values never match)
+def equals_ignore_case(column, value):
+    return column.astype('string').str.lower().eq(value).fillna(False).astype(bool)
+
+# Function to read a column as numbers, with anything non-numeric treated as missing
+def numeric(column):
+    return pd.to_numeric(column, errors='coerce')
+
+# Consistency rules, applied in order: each one is a vectorized condition over the whole frame,
+# an optional default written into `column` for the matching rows, and the alert reported for them
+# severity: 'fixed' when a default was applied, 'warning' when only reported,
+# 'error' when the table must not be ingested
+CONSISTENCY_RULES = [
+    {
+        'name': 'incremental_ingestion_type',
+        'columns': ['ingestion_type', 'incremental_ingestion_type'],
+        'condition': lambda m: m['ingestion_type'].eq('incremental') & m['incremental_ingestion_type'].isna(),
+        'column': 'incremental_ingestion_type',
+        'default': 'hash-based',
+        'alert': "Incremental ingestion type missing, set to default (hash-based).",
+    },
+    {
+        'name': 'watermark',
+        'columns': ['ingestion_type', 'watermark'],
+        'condition': lambda m: m['ingestion_type'].eq('date-based') & m['watermark'].isna(),
+        'column': 'watermark',
+        'default': pd.Timestamp('1970-01-01'),
+        'alert': "Watermark missing for date-based ingestion, set to default (1970-01-01).",
+    },
+    {
+        'name': 'data_transformation_script',
+        'columns': ['transformation_rules', 'data_transformation_script'],
+        'condition': lambda m: m['transformation_rules'].notna() & m['data_transformation_script'].isna(),
+        'column': 'data_transformation_script',
+        'default': 'no_transformation.py',
+        'alert': "Data transformation script missing, set to default (no_transformation.py).",
+    },
+    {
+        'name': 'data_validation_script',
+        'columns': ['data_validation_rules', 'data_validation_script'],
+        'condition': lambda m: m['data_validation_rules'].notna() & m['data_validation_script'].isna(),
+        'column': 'data_validation_script',
+        'default': 'validate_data.py',
+        'alert': "Data validation script missing, set to default (validate_data.py).",
+    },
+    {
+        'name': 'concurrency_level',
+        'columns': ['batch_size', 'concurrency_level'],
+        'condition': lambda m: m['batch_size'].notna() & ~(numeric(m['concurrency_level']) > 0).fillna(False).astype(bool),
+        'column': 'concurrency_level',
+        'default': 1,
+        'alert': "Invalid concurrency level, set to default (1).",
+    },
+    {
+        'name': 'compression_type',
+        'columns': ['source_file_format', 'compression_type'],
+        'condition': lambda m: equals_ignore_case(m['source_file_format'], 'csv')
+                               & ~m['compression_type'].isin(VALID_COMPRESSION_TYPES),
+        'column': 'compression_type',
+        'default': 'gzip',
+        'alert': "Invalid compression type for CSV, set to default (gzip).",
+    },
+    {
+        'name': 'dedup_mode',
+        'columns': ['dedup_mode'],
+        'condition': lambda m: m['dedup_mode'].notna() & ~m['dedup_mode'].isin(VALID_DEDUP_MODES),
+        'column': 'dedup_mode',
+        'default': 'anti_join',
+        'alert': f"Dedup mode is not one of {', '.join(VALID_DEDUP_MODES)}, set to default (anti_join).",
+    },
+    {
+        'name': 'paused_watermark',
+        'columns': ['status', 'watermark'],
+        'condition': lambda m: m['status'].eq('paused') & m['watermark'].notna(),
+        'alert': "Watermark should not be filled when status is 'paused'.",
+    },
+    {
+        'name': 'encryption_target',
+        'columns': ['column_level_encryption', 'target_system'],
+        'condition': lambda m: m['column_level_encryption'].notna() & m['target_system'].ne('encrypted'),
+        'alert': "Column-level encryption is set, but target system is not 'encrypted'.",
+    },
+    {
+        'name': 'schema_evolution',
+        'columns': ['schema_evolution', 'schema'],
+        'condition': lambda m: m['schema_evolution'].eq('allow') & m['schema'].isna(),
+        'column': 'schema',
+        'default': 'default_schema',
+        'alert': "Schema missing for schema evolution, set to default (default_schema).",
+    },
+]
+
+# Rules a table must pass before it is ingested, on top of the consistency rules
+PREFLIGHT_RULES = CONSISTENCY_RULES + [
+    {
+        'name': 'table_name_missing',
+        'columns': ['table_name'],
+        'condition': lambda m: m['table_name'].isna(),
+        'severity': 'error',
+        'alert': "Table name missing, the row cannot be ingested.",
+    },
+    {
+        'name': 'merge_without_primary_key',
+        'columns': ['historical_data_handling', 'primary_key'],
+        'condition': lambda m: equals_ignore_case(m['historical_data_handling'], 'merge') & m['primary_key'].isna(),
+        'alert': "Historical data handling is Merge but no primary key is declared, the ingestion type is used instead.",
+    },
+    {
+        'name': 'ingestion_type_unknown',
+        'columns': ['ingestion_type'],
+        'condition': lambda m: ~m['ingestion_type'].isin(VALID_INGESTION_TYPES),
+        'severity': 'error',
+        'alert': f"Ingestion type is not one of {', '.join(VALID_INGESTION_TYPES)}, the table is skipped.",
+    },
+]
+
+# Function to evaluate one rule: fixes the matching rows in place and returns their alerts as a frame
+def apply_rule(metadata, rule):
+    # Rules over columns this metadata does not have are not applicable
+    if any(column not in metadata.columns for column in rule['columns']):
+        return pd.DataFrame(columns=ALERT_COLUMNS)
+
+    mask = rule['condition'](metadata).to_numpy(dtype=bool)
+    if not mask.any():
+        return pd.DataFrame(columns=ALERT_COLUMNS)
+
+    column = rule.get('column')
+    if column is not None:
+        metadata.loc[mask, column] = rule['default']
+        severity = 'fixed'
+    else:
+        severity = rule.get('severity', 'warning')
+
+    rows = metadata.index[mask]
+    table_names = metadata['table_name'][mask] if 'table_name' in metadata.columns else None
+    return pd.DataFrame({
+        'row': rows,
+        'table_name': table_names.to_numpy() if table_names is not None else None,
+        'rule': rule['name'],
+        'severity': severity,
+        'column': column,
+        'fixed_value': rule.get('default'),
+        'message': 'Row ' + rows.astype(str) + ': ' + rule['alert'],
+    }, columns=ALERT_COLUMNS)
+
+# Function to apply a list of rules in order (later rules see the fixes of earlier ones)
+# Returns one alert frame with a row per (metadata row, rule) that matched
+def apply_rules(metadata, rules):
+    alerts = [apply_rule(metadata, rule) for rule in rules]
+    alerts = [frame for frame in alerts if not frame.empty]
+    if not alerts:
+        return pd.DataFrame(columns=ALERT_COLUMNS)
+    return pd.concat(alerts, ignore_index=True)
+
+# Function to run the consistency checks, fixing the metadata in place and returning the alert frame
+def validate_consistency(metadata):
+    return apply_rules(metadata, CONSISTENCY_RULES)
+
+# Function to check the metadata before ingestion
+# Returns the fixed metadata without the rows that have blocking alerts, and the alert frame
+def preflight_check(metadata):
+    metadata = metadata.copy()
+    alerts = apply_rules(metadata, PREFLIGHT_RULES)
+    blocked_rows = alerts.loc[alerts['severity'] == 'error', 'row'].unique()
+    return metadata.drop(index=blocked_rows), alerts
@@ -1,9 +1,17 @@
 
 
 import pandas as pd
-import difflib
 from datetime import datetime
 import pandas as pd
+import hashlib
+import io
+import json
+import os
+import shutil
+import uuid
+import numpy as np
+from metadata_rules import validate_consistency, CONSISTENCY_RULES, ALERT_COLUMNS
+from value_standardization import standardize_metadata_values, STANDARD_VALUES
 
 dtype_dict = {
     'table_name': str,
@@ -34,34 +42,21 @@ dtype_dict = {
     'target_system': str,
     'data_sync_type': str,
     'data_validation_frequency': str,
-    'historical_data_handling': str
+    'historical_data_handling': str,
+    'dedup_mode': str,
+    'time_ordered': str
 }
 
 # Specify the columns to parse as dates
 date_columns = ['watermark', 'last_ingestion_date', 'last_error_timestamp']
 
-# Read the CSV and apply the dtype dictionary and parse_dates
-metadata = pd.read_csv('MetadataTable.csv', dtype=dtype_dict, parse_dates=date_columns)
+# Local cache of the last validation (a directory): a JSON state file naming the Parquet files holding
+# the corrected rows, indexed by record fingerprint, and their alerts
+VALIDATION_CACHE_PATH = '.metadata_validation_cache'
+VALIDATION_STATE_FILE = 'state.json'
 
-# Normalize column names (lowercase and replace spaces with underscores)
-metadata.columns = metadata.columns.str.lower().str.replace(' ', '_')
-
-# Function to fix typos in field values using fuzzy matching
-def fix_typos(field_value, valid_values):
-    matches = difflib.get_close_matches(field_value, valid_values, n=1, cutoff=0.8)
-    if matches:
-        return matches[0]  # Return the closest match
-    return field_value  # If no close match, leave the value as is
-
-# Function to auto-correct standard values
-def standardize_values(metadata, field_name, valid_values, default_value=None):
-    # Normalize field_name by replacing underscores with spaces and lowering the case
-    normalized_field_name = field_name.lower().replace(' ', '_')
-
-    for col in metadata.columns:
-        if col.lower().replace(' ', '_') == normalized_field_name:
-            metadata[col] = metadata[col].apply(lambda x: fix_typos(str(x), valid_values) if pd.notna(x) else default_value)
-    return metadata
+# Bump when the correction logic changes in a way the settings below do not capture
+VALIDATION_CACHE_VERSION = 2
 
 # Function to convert string to datetime if possible
 def convert_to_datetime(value, format='%Y-%m-%d %H:%M:%S'):
@@ -86,19 +81,8 @@ def check_mandatory_fields(metadata):
 
 # Function to correct and validate fields
 def correct_metadata(metadata):
-    # Fix typos and standardize values
-    valid_ingestion_types = ['incremental', 'full']
-    valid_refresh_schedules = ['daily', 'weekly', 'monthly']
-    valid_status_values = ['active', 'paused', 'failed']
-    valid_file_formats = ['csv', 'json', 'parquet']
-    valid_compression_types = ['gzip', 'snappy']
-
-    # Standardizing and correcting fields if they exist
-    metadata = standardize_values(metadata, 'ingestion_type', valid_ingestion_types)
-    metadata = standardize_values(metadata, 'refresh_schedule', valid_refresh_schedules)
-    metadata = standardize_values(metadata, 'status', valid_status_values)
-    metadata = standardize_values(metadata, 'source_file_format', valid_file_formats)
-    metadata = standardize_values(metadata, 'compression_type', valid_compression_types)
+    # Fix typos and standardize values of the fields with a controlled vocabulary (if they exist)
+    metadata = standardize_metadata_values(metadata)
 
     # Correct datetime fields (e.g., last_ingestion_date)
     if 'last_ingestion_date' in metadata.columns:
@@ -110,12 +94,6 @@ def correct_metadata(metadata):
 
     return metadata
 
-# Function to standardize values in a column
-def standardize_values(metadata, column_name, valid_values):
-    if column_name in metadata.columns:
-        metadata[column_name] = metadata[column_name].str.lower().apply(lambda x: x if x in valid_values else None)
-    return metadata
-
 # Function to fix missing values with defaults for optional fields
 def fill_optional_fields_with_defaults(metadata, optional_fields, default_values):
     for field in optional_fields:
@@ -161,7 +139,9 @@ def check_data_types(metadata):
         'target_system': str,
         'data_sync_type': str,
         'data_validation_frequency': str,
-        'historical_data_handling': str
+        'historical_data_handling': str,
+        'dedup_mode': str,
+        'time_ordered': str
     }
 
     mismatched_types = {}
@@ -179,7 +159,8 @@ optional_fields = ['last_ingestion_date', 'incremental_ingestion_type', 'error_l
                    'transformation_rules', 'batch_size', 'concurrency_level', 'retry_policy', 'last_error_timestamp',
                    'data_validation_script', 'data_lineage', 'compression_type', 'column_level_encryption', 'schema_evolution',
                    'historical_data_retention_policy', 'data_validation_rules', 'audit_logs', 'notification_rules',
-                   'source_record_count', 'data_validation_frequency', 'historical_data_handling']
+                   'source_record_count', 'data_validation_frequency', 'historical_data_handling', 'dedup_mode',
+                   'time_ordered']
 
 default_values = {
     'last_ingestion_date': datetime(2025, 1, 20, 12, 0),
@@ -202,11 +183,205 @@ default_values = {
     'notification_rules': 'email',
     'source_record_count': 0,
     'data_validation_frequency': 'on ingestion',
-    'historical_data_handling': 'merge'
+    'historical_data_handling': 'merge',
+    'dedup_mode': 'anti_join',
+    'time_ordered': 'false'
 }
 
-# Assuming 'metadata' is the dataframe already loaded
-metadata = standardize_column_names(metadata)
+# Function to split the bytes of a CSV file into records (a quoted field may span several lines)
+def split_csv_records(data):
+    lines = data.splitlines()
+    if b'"' not in data or not any(line.count(b'"') % 2 for line in lines):
+        return [line for line in lines if line]
+
+    records, pending = [], None
+    for line in lines:
+        pending = line if pending is None else pending + b'\n' + line
+        if pending.count(b'"') % 2 == 0:
+            if pending:
+                records.append(pending)
+            pending = None
+    if pending is not None:
+        records.append(pending)
+    return records
+
+# Function to parse metadata records, applying the dtype dictionary and parse_dates
+def read_metadata_records(header, records):
+    metadata = pd.read_csv(io.BytesIO(b'\n'.join([header] + records)), dtype=dtype_dict, parse_dates=date_columns)
+    # Normalize column names (lowercase and replace spaces with underscores)
+    return standardize_column_names(metadata)
+
+# Function to fingerprint the records of the metadata table (8-byte BLAKE2b digests, stable across runs)
+# Identical records get distinct fingerprints through their occurrence number, so every fingerprint is unique
+def fingerprint_records(records):
+    digests = b''.join([hashlib.blake2b(record, digest_size=8).digest() for record in records])
+    fingerprints = pd.Index(np.frombuffer(digests, dtype='<u8'))
+    if fingerprints.is_unique:
+        return fingerprints
+
+    seen = {}
+    numbered = []
+    for record in records:
+        occurrence = seen[record] = seen.get(record, -1) + 1
+        numbered.append(record + b'\x00' + str(occurrence).encode() if occurrence else record)
+    return fingerprint_records(numbered)
+
+# Function to correct the given rows, fill their optional fields and run the consistency checks on them
+def correct_and_check(metadata):
+    corrected = correct_metadata(metadata)
+    corrected = fill_optional_fields_with_defaults(corrected, optional_fields, default_values)
+    alerts = validate_consistency(corrected)
+    return corrected, alerts
+
+# Function to describe everything a cached result depends on besides the records themselves
+def validation_settings(path, header):
+    return repr((VALIDATION_CACHE_VERSION, os.path.abspath(path), header, sorted(default_values.items()),
+                 [(rule['name'], rule.get('default')) for rule in CONSISTENCY_RULES], STANDARD_VALUES))
+
+# Function to describe the dtypes a table was parsed with
+def parsed_dtypes(metadata):
+    return {column: str(dtype) for column, dtype in metadata.dtypes.items()}
+
+# Function to load the validation cache, or None if there is no usable one
+# Alerts are stored without their column and fixed value, which are taken from their rule
+def load_validation_cache(cache_path=VALIDATION_CACHE_PATH):
+    state_path = os.path.join(cache_path, VALIDATION_STATE_FILE)
+    if not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+        corrected = pd.read_parquet(os.path.join(cache_path, state['corrected_file']))
+        alerts = pd.read_parquet(os.path.join(cache_path, state['alerts_file']))
+    except Exception as e:
+        print(f"Ignoring unreadable validation cache {cache_path}: {e}")
+        return None
+
+    rules = {rule['name']: rule for rule in CONSISTENCY_RULES}
+    alerts['column'] = alerts['rule'].map(lambda name: rules.get(name, {}).get('column')).astype(object)
+    alerts['fixed_value'] = alerts['rule'].map(lambda name: rules.get(name, {}).get('default')).astype(object)
+    fingerprints = pd.Index(corrected.index.to_numpy(dtype='<u8'))
+    corrected.index = pd.Index(np.arange(len(corrected)))
+    return {'settings': state['settings'], 'header': state['header'].encode('latin-1'),
+            'source_stat': tuple(state['source_stat']), 'parsed_dtypes': state['parsed_dtypes'],
+            'fingerprints': fingerprints, 'corrected': corrected, 'alerts': alerts[ALERT_COLUMNS]}
+
+# Function to save the validation cache: the Parquet files are written under new names, then the
+# state file pointing to them is replaced atomically and the files of the previous cache are removed
+# A table Parquet cannot store (e.g. a column mixing types) is simply not cached
+def save_validation_cache(cache, cache_path=VALIDATION_CACHE_PATH):
+    token = uuid.uuid4().hex
+    state = {'settings': cache['settings'], 'header': cache['header'].decode('latin-1'),
+             'source_stat': list(cache['source_stat']), 'parsed_dtypes': cache['parsed_dtypes'],
+             'corrected_file': f"corrected-{token}.parquet", 'alerts_file': f"alerts-{token}.parquet"}
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        cache['corrected'].set_axis(cache['fingerprints']).to_parquet(os.path.join(cache_path, state['corrected_file']))
+        alerts = cache['alerts'].drop(columns=['column', 'fixed_value'])
+        alerts.reset_index(drop=True).to_parquet(os.path.join(cache_path, state['alerts_file']))
+        tmp_path = os.path.join(cache_path, VALIDATION_STATE_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(cache_path, VALIDATION_STATE_FILE))
+    except Exception as e:
+        print(f"Could not save the validation cache {cache_path}: {e}")
+        shutil.rmtree(cache_path, ignore_errors=True)
+        return
+    for name in os.listdir(cache_path):
+        if name.endswith('.parquet') and token not in name:
+            os.remove(os.path.join(cache_path, name))
+
+# Function to cast corrected rows to the dtypes of the cached corrected table, so that merging them gives the
+# dtypes of a full run; returns None when a value does not fit them
+def cast_to_cached_dtypes(corrected, cached):
+    for column, dtype in cached.dtypes.items():
+        if column not in corrected.columns or corrected[column].dtype == dtype:
+            continue
+        try:
+            values = corrected[column].astype(dtype)
+        except (TypeError, ValueError):
+            return None
+        if values.isna().sum() != corrected[column].isna().sum():
+            return None
+        corrected[column] = values
+    return corrected
+
+# Function to validate the metadata table
+# incremental: only records that are new or changed since the cached run (by fingerprint of the raw record)
+# are corrected and checked; they are merged with the cached corrected rows and alerts.
+# Every record is parsed, so that they get the dtypes of a full run, and changed rows are cast to the cached
+# dtypes before the merge; when the dtypes no longer match the cache, the whole table is validated again.
+# This gives the same result as a full run, since every correction and check is row-local
+# Returns the parsed metadata (header only when the file is unchanged since the cached run),
+# the corrected metadata and the consistency alerts
+def validate_metadata_table(path, incremental=True, cache_path=VALIDATION_CACHE_PATH):
+    stat = os.stat(path)
+    source_stat = (stat.st_size, stat.st_mtime_ns)
+    cache = load_validation_cache(cache_path) if incremental else None
+
+    # An untouched file is not even read
+    if (cache is not None and cache.get('source_stat') == source_stat
+            and cache['settings'] == validation_settings(path, cache['header'])):
+        print(f"Metadata table unchanged, {len(cache['fingerprints'])} rows taken from the validation cache.")
+        return read_metadata_records(cache['header'], []), cache['corrected'], cache['alerts']
+
+    with open(path, 'rb') as f:
+        records = split_csv_records(f.read())
+    header, records = records[0], records[1:]
+    fingerprints = fingerprint_records(records)
+    settings = validation_settings(path, header)
+    metadata = read_metadata_records(header, records)
+    metadata.index = pd.Index(np.arange(len(metadata)))
+
+    if cache is None or cache['settings'] != settings or cache['parsed_dtypes'] != parsed_dtypes(metadata):
+        cached_positions = np.full(len(records), -1)
+    else:
+        cached_positions = cache['fingerprints'].get_indexer(fingerprints)
+    changed = cached_positions < 0
+    changed_positions = np.flatnonzero(changed)
+
+    corrected, alerts = correct_and_check(metadata.iloc[changed_positions].copy())
+
+    if not changed.all():
+        # Unchanged rows are taken from the cache, at their position in the current table
+        kept = cache['corrected'].iloc[cached_positions[~changed]]
+        kept.index = np.flatnonzero(~changed)
+        if changed.any():
+            corrected = cast_to_cached_dtypes(corrected, kept)
+            if corrected is None:
+                print("Changed metadata rows do not fit the cached dtypes, validating the whole table.")
+                return validate_metadata_table(path, incremental=False, cache_path=cache_path)
+            corrected = pd.concat([kept, corrected]).sort_index()
+        else:
+            corrected = kept
+
+        kept_alerts = cache['alerts']
+        alert_positions = fingerprints.get_indexer(cache['fingerprints'][kept_alerts['row'].to_numpy(dtype=int)])
+        kept_alerts = kept_alerts[alert_positions >= 0].copy()
+        alert_positions = alert_positions[alert_positions >= 0]
+        moved = kept_alerts['row'].to_numpy(dtype=int) != alert_positions
+        if moved.any():
+            kept_alerts['row'] = alert_positions
+            kept_alerts.loc[moved, 'message'] = (
+                'Row ' + kept_alerts.loc[moved, 'row'].astype(str) + ': '
+                + kept_alerts.loc[moved, 'message'].str.replace(r'^Row \d+: ', '', regex=True))
+
+        # Same order as a full run: by rule, then by row
+        if not kept_alerts.empty:
+            rule_order = {rule['name']: i for i, rule in enumerate(CONSISTENCY_RULES)}
+            alerts = pd.concat([kept_alerts, alerts], ignore_index=True) if not alerts.empty else kept_alerts
+            alerts = alerts.sort_values('row', kind='stable')
+            alerts = alerts.sort_values('rule', key=lambda rule: rule.map(rule_order), kind='stable')
+            alerts = alerts.reset_index(drop=True)
+
+    print(f"Validated {len(changed_positions)} new or changed metadata rows out of {len(records)}.")
+    save_validation_cache({'settings': settings, 'header': header, 'source_stat': source_stat,
+                           'parsed_dtypes': parsed_dtypes(metadata), 'fingerprints': fingerprints,
+                           'corrected': corrected, 'alerts': alerts}, cache_path)
+    return metadata, corrected, alerts
+
+# Read and validate the metadata table, re-checking only the rows changed since the last run
+metadata, corrected_metadata, consistency_alerts = validate_metadata_table('MetadataTable.csv')
 
 # Check for missing mandatory fields and report if any
 missing_fields = check_mandatory_fields(metadata)
@@ -216,19 +391,13 @@ if missing_fields:
 else:
     print("All mandatory columns exist.")
 
-# Check for mismatched data types
-mismatched_types = check_data_types(metadata)
+# Check for mismatched data types (on the corrected table, which a cached run returns whole)
+mismatched_types = check_data_types(corrected_metadata)
 if mismatched_types:
     print(f"Data type mismatches found: {mismatched_types}")
 else:
     print("No data type mismatches found.")
 
-# Correct the metadata
-corrected_metadata = correct_metadata(metadata)
-
-# Fill missing values for optional fields with defaults if they exist
-corrected_metadata = fill_optional_fields_with_defaults(corrected_metadata, optional_fields, default_values)
-
 # Check the ingestion type and summarize
 incremental_tables = corrected_metadata[corrected_metadata['ingestion_type'] == 'incremental']
 full_tables = corrected_metadata[corrected_metadata['ingestion_type'] == 'full']
@@ -248,118 +417,11 @@ print(f"Full ingestion tables: {len(full_tables)}")
 print(f"Unique data sources: {unique_data_sources}")
 
 ## Consisency Chekcs
+# The checks are declared as vectorized rules in metadata_rules.CONSISTENCY_RULES
+# (run by validate_metadata_table on the corrected rows)
 
-def check_ingestion_type_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if row['ingestion_type'] == 'incremental' and pd.isna(row['incremental_ingestion_type']):
-            metadata.at[index, 'incremental_ingestion_type'] = 'hash-based'
-            alerts.append(f"Row {index}: Incremental ingestion type missing, set to default (hash-based).")
-    return alerts
-
-
-def check_watermark_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if row['ingestion_type'] == 'date-based' and pd.isna(row['watermark']):
-            metadata.at[index, 'watermark'] = '1970-01-01'  # Default date
-            alerts.append(f"Row {index}: Watermark missing for date-based ingestion, set to default (1970-01-01).")
-    return alerts
-
-def check_transformation_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if pd.notna(row['transformation_rules']) and pd.isna(row['data_transformation_script']):
-            metadata.at[index, 'data_transformation_script'] = 'no_transformation.py'  # Default script
-            alerts.append(f"Row {index}: Data transformation script missing, set to default (no_transformation.py).")
-    return alerts
-
-def check_data_validation_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if pd.notna(row['data_validation_rules']) and pd.isna(row['data_validation_script']):
-            metadata.at[index, 'data_validation_script'] = 'validate_data.py'  # Default validation script
-            alerts.append(f"Row {index}: Data validation script missing, set to default (validate_data.py).")
-    return alerts
-
-def check_batch_and_concurrency_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if pd.notna(row['batch_size']) and (pd.isna(row['concurrency_level']) or row['concurrency_level'] <= 0):
-            metadata.at[index, 'concurrency_level'] = 1  # Default concurrency level
-            alerts.append(f"Row {index}: Invalid concurrency level, set to default (1).")
-    return alerts
-
-
-def check_source_file_format_consistency(metadata):
-    valid_compression_types = ['gzip', 'snappy']
-    alerts = []
-    for index, row in metadata.iterrows():
-        if row['source_file_format'] == 'CSV' and row['compression_type'] not in valid_compression_types:
-            metadata.at[index, 'compression_type'] = 'gzip'  # Default compression type
-            alerts.append(f"Row {index}: Invalid compression type for CSV, set to default (gzip).")
-    return alerts
-
-
-def check_status_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if row['status'] == 'paused' and pd.notna(row['watermark']):
-            alerts.append(f"Row {index}: Watermark should not be filled when status is 'paused'.")
-    return alerts
-
-
-def check_encryption_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if pd.notna(row['column_level_encryption']) and row['target_system'] != 'encrypted':
-            alerts.append(f"Row {index}: Column-level encryption is set, but target system is not 'encrypted'.")
-    return alerts
-
-
-def check_schema_evolution_consistency(metadata):
-    alerts = []
-    for index, row in metadata.iterrows():
-        if row['schema_evolution'] == 'allow' and pd.isna(row['schema']):
-            metadata.at[index, 'schema'] = 'default_schema'  # Default schema value
-            alerts.append(f"Row {index}: Schema missing for schema evolution, set to default (default_schema).")
-    return alerts
-
-
-
-def validate_consistency(metadata):
-    all_alerts = []
-
-    alerts = check_ingestion_type_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_watermark_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_transformation_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_data_validation_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_batch_and_concurrency_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_source_file_format_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_status_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_encryption_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    alerts = check_schema_evolution_consistency(metadata)
-    all_alerts.extend(alerts)
-
-    return all_alerts
-
-
-
-validate_consistency(metadata)
-
+if consistency_alerts.empty:
+    print("No consistency issues found.")
+else:
+    print(f"\nConsistency alerts ({len(consistency_alerts)}):")
+    print(consistency_alerts.groupby(['rule', 'severity']).size().to_string())
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from row_hashing import hash_rows
+from source_readers import read_source, open_text_source, normalize_file_format, projection, downcast_numeric_columns
+
+try:
+    import pyarrow as pa
+except ImportError:  # without pyarrow, workers send their frames back pickled
+    pa = None
+
+
+# Files smaller than this are parsed sequentially: starting the workers would cost more than it saves
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 ** 2
+
+# Smallest byte range handed to a worker; files are cut in about 4 ranges per worker for load balancing
+MIN_RANGE_BYTES = 8 * 1024 ** 2
+RANGES_PER_WORKER = 4
+
+# Bytes scanned at a time when counting quotes
+SCAN_BLOCK_BYTES = 64 * 1024 ** 2
+
+# Function to count the quote characters between two offsets of a mapped file
+def count_quotes(mapped, start, end):
+    quotes = 0
+    for block_start in range(start, end, SCAN_BLOCK_BYTES):
+        quotes += mapped[block_start:min(end, block_start + SCAN_BLOCK_BYTES)].count(b'"')
+    return quotes
+
+# Function to find the first record boundary at or after `offset`, given the number of quotes before it
+# A newline ends a record only outside quoted fields, i.e. after an even number of quotes
+# (escaped quotes are doubled, so they keep the parity); returns the boundary and the quotes before it
+def next_record_start(mapped, offset, quotes):
+    while True:
+        newline = mapped.find(b'\n', offset)
+        if newline == -1:
+            return len(mapped), quotes + count_quotes(mapped, offset, len(mapped))
+        quotes += count_quotes(mapped, offset, newline)
+        offset = newline + 1
+        if quotes % 2 == 0:
+            return offset, quotes
+
+# Function to split a CSV file into byte ranges of whole records, quote-aware
+# Returns the header bytes and the (start, end) ranges covering the data rows
+def split_byte_ranges(file_path, ranges):
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end, quotes = next_record_start(mapped, 0, 0)
+        header = mapped[:header_end]
+        range_bytes = max(MIN_RANGE_BYTES, (size - header_end) // max(1, ranges) + 1)
+
+        boundaries = [header_end]
+        offset = header_end
+        while offset < size:
+            target = min(size, boundaries[-1] + range_bytes)
+            quotes += count_quotes(mapped, offset, target)
+            offset, quotes = next_record_start(mapped, target, quotes) if target < size else (size, quotes)
+            boundaries.append(offset)
+    return header, [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+# Function to tell whether a column can cross the process boundary as Arrow and come back unchanged
+def arrow_compatible(values):
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.api.types.is_string_dtype(dtype.categories) and not pd.api.types.is_object_dtype(dtype.categories)
+    if isinstance(dtype, pd.StringDtype):
+        return True
+    return isinstance(dtype, np.dtype) and dtype.kind in 'biuf'
+
+# Function to pack a parsed range for the parent: one Arrow IPC buffer for the columns Arrow round-trips
+# (numbers, strings, string categoricals) and NumPy arrays for the rest
+def pack_frame(data):
+    arrow_columns = [column for column in data.columns if arrow_compatible(data[column])]
+    if pa is None:
+        arrow_columns = []
+    packed = {
+        'columns': list(data.columns),
+        'dtypes': {column: data[column].dtype for column in data.columns},
+        'rows': len(data),
+        'arrow': None,
+        'arrays': {column: data[column].to_numpy() for column in data.columns if column not in arrow_columns},
+    }
+    if arrow_columns:
+        table = pa.Table.from_pandas(data[arrow_columns], preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        packed['arrow'] = sink.getvalue()
+    return packed
+
+# Function to rebuild a parsed range packed by pack_frame
+def unpack_frame(packed):
+    columns = {}
+    if packed['arrow'] is not None:
+        frame = pa.ipc.open_stream(packed['arrow']).read_all().to_pandas()
+        columns.update({column: frame[column] for column in frame.columns})
+    columns.update({column: pd.Series(values) for column, values in packed['arrays'].items()})
+    data = pd.DataFrame({column: columns[column] for column in packed['columns']},
+                        index=pd.RangeIndex(packed['rows']))
+    for column, dtype in packed['dtypes'].items():
+        if data[column].dtype != dtype:
+            data[column] = data[column].astype(dtype)
+    return data
+
+# Worker: parse one byte range (with the header prepended), apply the planned dtypes and hash the rows
+# Digests come back as a fixed-width bytes array rather than Python strings
+def parse_byte_range(file_path, byte_range, header, columns=None, dtype=None, hash_mode='compat'):
+    start, end = byte_range
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start)
+    data = pd.read_csv(io.BytesIO(header + body), usecols=projection(columns), dtype=dtype)
+    digests = None
+    if hash_mode:
+        digests = np.array(hash_rows(data, hash_mode, workers=1).tolist(), dtype='S64')
+    return pack_frame(data), digests
+
+# Function to tell whether the dtypes of a column are all strings or missing values only
+def is_string_or_empty(dtype, values):
+    if isinstance(dtype, pd.StringDtype):
+        return True
+    if pd.api.types.is_object_dtype(dtype):
+        return all(isinstance(value, str) for value in values.dropna())
+    return pd.api.types.is_float_dtype(dtype) and values.isna().all()
+
+# Function to tell whether rows keep their rendering (hence their hash) when a column is cast to `target`
+def renders_alike(dtype, target):
+    return dtype == target or (isinstance(dtype, pd.CategoricalDtype) and isinstance(target, pd.CategoricalDtype))
+
+# Function to find the dtype the whole file would have been parsed with, for a column parsed per range
+# Returns (dtype, whether the ranges must be parsed again as strings); None when it cannot be inferred
+def unified_dtype(parts, column):
+    dtypes = [part[column].dtype for part in parts]
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return dtypes[0], False
+    if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+        categories = pd.api.types.union_categoricals([part[column] for part in parts], sort_categories=True)
+        return pd.CategoricalDtype(categories.categories), False
+    if all(isinstance(dtype, np.dtype) and dtype.kind in 'iuf' for dtype in dtypes):
+        return np.result_type(*dtypes), False
+    # Booleans with missing values in some ranges only: the whole file holds them as objects
+    if all(dtype == bool or (pd.api.types.is_object_dtype(dtype) and
+                             all(isinstance(value, bool) for value in part[column].dropna())) or
+           (pd.api.types.is_float_dtype(dtype) and part[column].isna().all())
+           for dtype, part in zip(dtypes, parts)):
+        return np.dtype(object), False
+    # Text in some ranges and numbers (or nothing) in others: the whole file keeps the raw text
+    if any(isinstance(dtype, pd.StringDtype) or pd.api.types.is_object_dtype(dtype) for dtype in dtypes) and \
+            all(is_string_or_empty(dtype, part[column]) or (isinstance(dtype, np.dtype) and dtype.kind in 'iuf')
+                for dtype, part in zip(dtypes, parts)):
+        return None, True
+    return None, False
+
+# Function to read a CSV source on `parse_workers` processes, each parsing and hashing a byte range
+# Returns the frame, identical to read_source (ranges are re-parsed or cast to the dtypes the whole file would get),
+# and the hash_rows digests of its rows (None when not hashed); anything else (other formats, compressed files,
+# extra reader options, small files) is read sequentially by read_source, without hashes
+def read_source_parallel(file_path, file_format=None, columns=None, dtype=None, downcast=False, parse_workers=None,
+                         hash_mode='compat', **read_options):
+    file_format = normalize_file_format(file_format, file_path)
+    parse_workers = parse_workers or os.cpu_count() or 1
+    sequential = (file_format != 'csv' or read_options or parse_workers <= 1
+                  or os.path.getsize(file_path) < PARALLEL_PARSE_MIN_BYTES or open_text_source(file_path)[1] is not None)
+    if sequential:
+        return read_source(file_path, file_format, columns, dtype=dtype, downcast=downcast, **read_options), None
+
+    header, byte_ranges = split_byte_ranges(file_path, parse_workers * RANGES_PER_WORKER)
+    with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+        def parse_all(ranges, range_dtype):
+            futures = [executor.submit(parse_byte_range, file_path, byte_range, header, columns, range_dtype, hash_mode)
+                       for byte_range in ranges]
+            # Ranges holding only blank lines parse to empty frames with meaningless dtypes
+            results = [result for result in (future.result() for future in futures) if result[0]['rows']]
+            return [unpack_frame(packed) for packed, _ in results], [digests for _, digests in results]
+
+        parts, digests = parse_all(byte_ranges, dtype)
+        if not parts:
+            return read_source(file_path, file_format, columns, dtype=dtype, downcast=downcast), None
+
+        # Columns holding text in some ranges only are parsed again as text everywhere
+        reparse = [column for column in parts[0].columns if unified_dtype(parts, column)[1]]
+        if reparse:
+            parts, digests = parse_all(byte_ranges, dict(dtype or {}, **{column: str for column in reparse}))
+
+    targets = {}
+    for column in parts[0].columns:
+        target, _ = unified_dtype(parts, column)
+        if target is None:
+            print(f"Column {column} of {file_path} parses differently across ranges; reading it sequentially.")
+            return read_source(file_path, file_format, columns, dtype=dtype, downcast=downcast), None
+        targets[column] = target
+
+    hashes = []
+    for index, part in enumerate(parts):
+        # A part whose dtypes change renders differently, so its worker hashes no longer apply
+        if any(not renders_alike(part[column].dtype, target) for column, target in targets.items()):
+            digests[index] = None
+        if any(part[column].dtype != target for column, target in targets.items()):
+            parts[index] = part = part.astype(targets)
+        if hash_mode and digests[index] is None:
+            digests[index] = np.array(hash_rows(part, hash_mode).tolist(), dtype='S64')
+        hashes.append(digests[index])
+
+    data = pd.concat(parts, ignore_index=True)
+    if downcast:
+        data = downcast_numeric_columns(data)
+    # Downcasting keeps the rendering of the rows, so the hashes still match the final dtypes
+    if not hash_mode:
+        return data, None
+    return data, pd.Series(np.concatenate(hashes).astype(str), index=data.index, dtype=object)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+import pandas as pd
+from psycopg2.pool import ThreadedConnectionPool
+
+
+# Global limit on tables loaded at the same time
+DEFAULT_MAX_WORKERS = 4
+
+# Ingestion types reloading the whole table through <table>__shadow (or a truncate): two of them at once collide on
+# the shadow table, and rows another load commits next to one are lost when it swaps the table in
+RELOAD_INGESTION_TYPES = ['full', 'hybrid']
+
+# Connection budget of the run the current thread works for (see run_tables_in_parallel)
+_local = threading.local()
+
+# Function to create a connection pool with one connection per worker
+def create_connection_pool(dsn, max_workers=DEFAULT_MAX_WORKERS):
+    return ThreadedConnectionPool(1, max_workers, dsn)
+
+# Function to read the per-table concurrency level, defaulting to 1
+def resolve_concurrency_level(concurrency_level):
+    if concurrency_level is None or pd.isna(concurrency_level) or int(concurrency_level) <= 0:
+        return 1
+    return int(concurrency_level)
+
+# Function to build the slots of each target table: a semaphore sized by its concurrency_level (the lowest
+# declared by its rows, so no row runs beside more loads than it allows) and a lock taken by its reloads
+def build_table_slots(metadata):
+    table_slots = {}
+    for table_name, group in metadata.groupby('table_name'):
+        if 'concurrency_level' in group.columns:
+            level = min(resolve_concurrency_level(value) for value in group['concurrency_level'])
+        else:
+            level = 1
+        table_slots[table_name] = {'level': level, 'slots': threading.BoundedSemaphore(level),
+                                   'reload': threading.Lock()}
+    return table_slots
+
+# Function to tell whether a metadata row reloads its whole table
+def reloads_table(meta):
+    ingestion_type = meta.get('ingestion_type')
+    return pd.notna(ingestion_type) and str(ingestion_type).strip().lower() in RELOAD_INGESTION_TYPES
+
+# Context manager holding the slots a load needs on its table: one for loads that can share the table,
+# all of them for reloads, which must have it to themselves
+# Reloads take their slots one by one under the reload lock, so two of them never hold part of the slots each
+@contextmanager
+def table_slot(slots, exclusive=False):
+    if not exclusive:
+        with slots['slots']:
+            yield
+        return
+
+    acquired = 0
+    with slots['reload']:
+        try:
+            for _ in range(slots['level']):
+                slots['slots'].acquire()
+                acquired += 1
+            yield
+        finally:
+            for _ in range(acquired):
+                slots['slots'].release()
+
+# Function to take the slots a load needs on its table without waiting (one, or all of them for reloads)
+# Returns how many were taken: 0 when the table is busy, in which case none is held
+def try_acquire_slots(slots, exclusive=False):
+    wanted = slots['level'] if exclusive else 1
+    if not slots['reload'].acquire(blocking=False):
+        return 0
+    try:
+        taken = 0
+        while taken < wanted and slots['slots'].acquire(blocking=False):
+            taken += 1
+        if taken < wanted:
+            release_slots(slots, taken)
+            return 0
+        return taken
+    finally:
+        slots['reload'].release()
+
+# Function to give back slots taken by try_acquire_slots
+def release_slots(slots, taken):
+    for _ in range(taken):
+        slots['slots'].release()
+
+# Context manager lending up to `wanted` extra connections from the budget of the current run, without waiting,
+# and yielding how many were lent; outside run_tables_in_parallel there is no budget and all of them are lent
+@contextmanager
+def borrowed_connections(wanted):
+    budget = getattr(_local, 'budget', None)
+    if budget is None:
+        yield wanted
+        return
+
+    lent = 0
+    try:
+        while lent < wanted and budget.acquire(blocking=False):
+            lent += 1
+        yield lent
+    finally:
+        for _ in range(lent):
+            budget.release()
+
+# Function to run one metadata row on a pooled connection, isolating its transaction and errors
+# A connection lost during the run is discarded and replaced from the pool
+def run_table_on_pool(pool, run_table, meta):
+    table_name = meta['table_name']
+    start_time = time.time()
+    held = {'connection': pool.getconn()}
+
+    def reconnect(lost_connection):
+        held['connection'] = None
+        pool.putconn(lost_connection, close=True)
+        held['connection'] = pool.getconn()
+        return held['connection']
+
+    try:
+        rows = run_table(meta, held['connection'], reconnect)
+        held['connection'].commit()
+        status, error = 'success', None
+    except Exception as e:
+        if held['connection'] is not None and not held['connection'].closed:
+            held['connection'].rollback()
+        rows, status, error = 0, 'failed', str(e)
+        print(f"Ingestion for table {table_name} failed: {e}")
+    finally:
+        # Broken connections are discarded instead of being handed to the next table
+        if held['connection'] is not None:
+            pool.putconn(held['connection'], close=bool(held['connection'].closed))
+    elapsed_time = time.time() - start_time
+
+    return {'table_name': table_name, 'status': status, 'rows_loaded': rows,
+            'elapsed_seconds': round(elapsed_time, 3), 'error': error}
+
+# Function to run one metadata row on a pooled connection once its table has the slots it needs
+def run_table_isolated(pool, run_table, meta, table_slots):
+    with table_slot(table_slots[meta['table_name']], reloads_table(meta)):
+        return run_table_on_pool(pool, run_table, meta)
+
+# Function to run one metadata row holding slots on its table and a connection of the budget, given back after
+def run_table_in_slots(pool, run_table, meta, slots, taken, budget):
+    _local.budget = budget
+    try:
+        return run_table_on_pool(pool, run_table, meta)
+    finally:
+        _local.budget = None
+        release_slots(slots, taken)
+        budget.release()
+
+# Function to run every metadata row on a bounded worker pool and summarize the results per table
+# A row starts once a connection of the budget (max_workers) and the slots of its table are free; until then it
+# waits in the queue instead of holding a worker, and rows of the same table start in metadata order
+# Partitioned loads borrow the connections of their extra workers from the same budget (see borrowed_connections)
+def run_tables_in_parallel(pool, metadata, run_table, max_workers=DEFAULT_MAX_WORKERS):
+    table_slots = build_table_slots(metadata)
+    budget = threading.BoundedSemaphore(max_workers)
+    pending = [meta for _, meta in metadata.iterrows()]
+    positions = list(range(len(pending)))
+    results = [None] * len(pending)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            waiting, waiting_positions, busy_tables = [], [], set()
+            for position, meta in zip(positions, pending):
+                table_name = meta['table_name']
+                taken = 0
+                if table_name not in busy_tables and budget.acquire(blocking=False):
+                    taken = try_acquire_slots(table_slots[table_name], reloads_table(meta))
+                    if not taken:
+                        budget.release()
+                if not taken:
+                    busy_tables.add(table_name)
+                    waiting.append(meta)
+                    waiting_positions.append(position)
+                    continue
+                future = executor.submit(run_table_in_slots, pool, run_table, meta, table_slots[table_name], taken,
+                                         budget)
+                running[future] = position
+            pending, positions = waiting, waiting_positions
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+
+    return pd.DataFrame(results, columns=['table_name', 'status', 'rows_loaded', 'elapsed_seconds', 'error'])
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import hashlib
+import os
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pandas as pd
+import psycopg2
+from bulk_loader import (bulk_load, column_list, create_staging_table, dedup_insert_query, ensure_hash_index,
+                         resolve_batch_size)
+from row_hashing import hash_rows
+from source_cache import cached_read_source_with_hashes
+from source_readers import fetch_target_columns
+from ingestion_metrics import stage, annotate_run
+from parallel_executor import create_connection_pool, borrowed_connections
+from table_swap import (shadow_table_name, split_table_name, swap_blockers, table_exists, fetch_indexes, copy_grants,
+                        swap_tables, SHADOW_SUFFIX)
+from watermarks import read_watermark, advance_watermark, rows_after_watermark, METADATA_TABLE
+
+
+# Columns looked for when the partitioning key names a kind of value (date/region/category) rather than a column
+PARTITION_KEY_COLUMNS = {
+    'date': ['date', 'transaction_date', 'sale_date', 'order_date', 'created_at'],
+    'region': ['region', 'country', 'state', 'city', 'location'],
+    'category': ['category', 'product_category', 'product_name', 'sector'],
+}
+
+# Column types partitioned by month (RANGE); any other key is partitioned by value (LIST)
+RANGE_COLUMN_TYPES = ['date', 'timestamp without time zone', 'timestamp with time zone']
+
+# Suffix of the DEFAULT partition, which receives the rows no partition covers (e.g. NULL dates, or rows
+# routed through the parent table by the serial strategies before their partition existed)
+DEFAULT_PARTITION = 'default'
+
+# Longest PostgreSQL identifier; longer partition names are shortened with a digest
+MAX_IDENTIFIER_LENGTH = 63
+
+# Function to keep a generated table name within the identifier limit
+def bounded_table_name(table_name):
+    schema_name, bare_name = split_table_name(table_name)
+    if len(bare_name) > MAX_IDENTIFIER_LENGTH:
+        digest = hashlib.md5(bare_name.encode()).hexdigest()[:8]
+        bare_name = f"{bare_name[:MAX_IDENTIFIER_LENGTH - 9]}_{digest}"
+    return f"{schema_name}.{bare_name}" if schema_name else bare_name
+
+# Function to read the type of a column of the target table
+def fetch_column_type(conn, table_name, column):
+    schema_name, bare_name = split_table_name(table_name)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_name = %s AND table_schema = COALESCE(NULLIF(%s, ''), current_schema()) AND column_name = %s",
+            (bare_name, schema_name, column),
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+# Function to resolve the partitioning declared by a metadata row into a partition spec, or None
+# Accepts a column name, a kind of key (date, region, category) matched against the table's columns
+# (date first tries the timestamp column), or 'kind:column'
+def partition_spec(conn, meta):
+    partitioning = meta.get('partitioning')
+    if partitioning is None or pd.isna(partitioning) or not str(partitioning).strip():
+        return None
+
+    table_name = meta['table_name']
+    kind, _, column = str(partitioning).strip().partition(':')
+    kind, column = kind.strip().lower(), column.strip()
+    if column:
+        candidates = [column]
+    else:
+        candidates = [kind]
+        if kind == 'date' and pd.notna(meta.get('timestamp_column')):
+            candidates.append(meta['timestamp_column'])
+        candidates += PARTITION_KEY_COLUMNS.get(kind, [])
+
+    columns = fetch_target_columns(conn, table_name)
+    column = next((candidate for candidate in candidates if candidate in columns), None)
+    if column is None:
+        print(f"Partitioning '{partitioning}' of {table_name} matches none of its columns; loading it unpartitioned.")
+        return None
+
+    column_type = fetch_column_type(conn, table_name, column)
+    method = 'range' if column_type in RANGE_COLUMN_TYPES else 'list'
+    # A date stored as text would get one LIST partition per distinct value instead of one per month
+    if method == 'list' and (kind == 'date' or column in PARTITION_KEY_COLUMNS['date']):
+        print(f"Partitioning '{partitioning}' of {table_name} needs a date or timestamp column but {column} is "
+              f"{column_type}; cast it (ALTER TABLE ... TYPE date) to partition it by month. Loading it unpartitioned.")
+        return None
+    return {'kind': kind, 'column': column, 'method': method}
+
+# Function to compute the partition key of every row: the month for RANGE partitions, the value for LIST ones
+def partition_keys(data, spec):
+    values = data[spec['column']]
+    if spec['method'] == 'range':
+        return pd.to_datetime(values, errors='coerce').dt.to_period('M')
+    return values
+
+# Function to convert a partition key to a plain Python value (None for missing keys)
+def plain_key(key):
+    if pd.isna(key):
+        return None
+    return key.item() if hasattr(key, 'item') else key
+
+# Function to split a batch into one frame per partition key
+def split_partitions(data, spec):
+    groups = data.groupby(partition_keys(data, spec), dropna=False, observed=True, sort=True)
+    return [(plain_key(key), part) for key, part in groups]
+
+# Function to build the name of the DEFAULT partition of `table_name`
+def default_partition_name(table_name):
+    return bounded_table_name(f"{table_name}__p_{DEFAULT_PARTITION}")
+
+# Function to tell whether a key falls in the DEFAULT partition (RANGE partitions have no NULL bound)
+def is_default_key(spec, key):
+    return key is None and spec['method'] == 'range'
+
+# Function to build the name of the partition of `table_name` holding `key`
+def partition_table_name(table_name, spec, key):
+    if is_default_key(spec, key):
+        return default_partition_name(table_name)
+    if key is None:
+        suffix = 'null'
+    elif spec['method'] == 'range':
+        suffix = f"{key.year:04d}_{key.month:02d}"
+    else:
+        # The digest keeps values differing only by case or punctuation apart
+        slug = re.sub(r'[^a-z0-9]+', '_', str(key).lower()).strip('_')[:24]
+        suffix = f"{slug}_{hashlib.md5(str(key).encode()).hexdigest()[:6]}"
+    return bounded_table_name(f"{table_name}__p_{suffix}")
+
+# Function to build the bound of the partition holding `key` and the condition selecting its rows
+# Returns (FOR VALUES clause, its parameters, row condition, its parameters)
+def partition_bound(spec, key):
+    column = column_list([spec['column']])
+    if is_default_key(spec, key):
+        return 'DEFAULT', (), f"{column} IS NULL", ()
+    if key is None:
+        return 'IN (NULL)', (), f"{column} IS NULL", ()
+    if spec['method'] == 'range':
+        bounds = (key.start_time.to_pydatetime(), (key + 1).start_time.to_pydatetime())
+        return 'FROM (%s) TO (%s)', bounds, f"{column} IS NOT NULL AND {column} >= %s AND {column} < %s", bounds
+    return 'IN (%s)', (key,), f"{column} IS NOT NULL AND {column} = %s", (key,)
+
+# Function to tell whether a table is a partitioned table
+def is_partitioned(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table_name,))
+        row = cur.fetchone()
+    return bool(row and row[0])
+
+# Function to find the DEFAULT partition of a partitioned table (`parent`, or the table itself), creating it
+# when the table has none (e.g. partitioned by hand); returns its name
+def ensure_default_partition(conn, table_name, parent=None):
+    parent = parent or table_name
+    with conn.cursor() as cur:
+        cur.execute("SELECT NULLIF(partdefid, 0)::regclass::text FROM pg_partitioned_table "
+                    "WHERE partrelid = to_regclass(%s)", (parent,))
+        row = cur.fetchone()
+        if row and row[0]:
+            return row[0]
+        cur.execute(f"CREATE TABLE {default_partition_name(table_name)} PARTITION OF {parent} DEFAULT")
+    print(f"Created the DEFAULT partition of {table_name}.")
+    return default_partition_name(table_name)
+
+# Function to create the partition of `table_name` holding `key` (attached to `parent`, the table itself
+# unless it is being built as a shadow); rows of that key held by the DEFAULT partition are moved into it
+def create_partition(conn, table_name, spec, key, parent=None):
+    parent = parent or table_name
+    partition = partition_table_name(table_name, spec, key)
+    default_partition = ensure_default_partition(conn, table_name, parent)
+    for_values, bound_params, condition, condition_params = partition_bound(spec, key)
+
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE {partition} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cur.execute(f"WITH moved AS (DELETE FROM {default_partition} WHERE {condition} RETURNING *) "
+                    f"INSERT INTO {partition} SELECT * FROM moved", condition_params)
+        cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {partition} FOR VALUES {for_values}", bound_params)
+    return partition
+
+# Function to create the partitions missing for `keys`, in the caller's transaction
+def ensure_partitions(conn, table_name, spec, keys):
+    created = []
+    for key in keys:
+        if is_default_key(spec, key):
+            ensure_default_partition(conn, table_name)
+            continue
+        if table_exists(conn, partition_table_name(table_name, spec, key)):
+            continue
+        created.append(create_partition(conn, table_name, spec, key))
+    if created:
+        print(f"Created {len(created)} partitions of {table_name}.")
+    return created
+
+# Function to list the unique indexes (primary key included) of a table that do not contain `column`
+# A partitioned table cannot enforce them, since uniqueness is only checked within each partition
+def unique_indexes_without_key(conn, table_name, column):
+    key_pattern = re.compile(rf'(^|[\s,("]){re.escape(column)}($|[\s,)"])')
+    missing = []
+    for index_name, definition, _, _ in fetch_indexes(conn, table_name):
+        indexed = definition[definition.find('(') + 1:definition.rfind(')')]
+        if ' UNIQUE INDEX ' in definition and not key_pattern.search(indexed):
+            missing.append(index_name)
+    return missing
+
+# Function to rebuild the indexes of a table on its partitioned shadow
+def build_partitioned_indexes(conn, table_name, shadow_table):
+    with conn.cursor() as cur:
+        for index_name, definition, constraint_name, constraint_definition in fetch_indexes(conn, table_name):
+            if constraint_name:
+                cur.execute(f"ALTER TABLE {shadow_table} ADD CONSTRAINT {constraint_name}{SHADOW_SUFFIX} "
+                            f"{constraint_definition}")
+            else:
+                cur.execute(re.sub(r' INDEX \S+ ON \S+ ', f" INDEX {index_name}{SHADOW_SUFFIX} ON {shadow_table} ",
+                                   definition, count=1))
+
+# Function to turn a plain table into a partitioned one, keeping its rows, indexes and grants
+# A partitioned shadow table is filled from it and swapped in (see table_swap.py); the caller commits
+def convert_to_partitioned(conn, table_name, spec):
+    shadow_table = shadow_table_name(table_name)
+    column = column_list([spec['column']])
+    key_expression = f"date_trunc('month', {column})" if spec['method'] == 'range' else column
+
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+        cur.execute(
+            f"CREATE TABLE {shadow_table} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+            f"INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY {spec['method'].upper()} ({column})"
+        )
+        cur.execute(f"CREATE TABLE {default_partition_name(table_name)} PARTITION OF {shadow_table} DEFAULT")
+        cur.execute(f"SELECT DISTINCT {key_expression} FROM {table_name}")
+        keys = [row[0] for row in cur.fetchall()]
+    if spec['method'] == 'range':
+        keys = [None if key is None else pd.Period(key, 'M') for key in keys]
+
+    for key in keys:
+        if not is_default_key(spec, key):
+            create_partition(conn, table_name, spec, key, parent=shadow_table)
+    with conn.cursor() as cur:
+        cur.execute(f"INSERT INTO {shadow_table} SELECT * FROM {table_name}")
+
+    build_partitioned_indexes(conn, table_name, shadow_table)
+    copy_grants(conn, table_name, shadow_table)
+    with conn.cursor() as cur:
+        cur.execute(f"ANALYZE {shadow_table}")
+    swap_tables(conn, table_name, shadow_table)
+    print(f"Converted {table_name} to a table partitioned by {spec['method']} on {spec['column']} "
+          f"({len(keys)} partitions).")
+
+# Function to tell whether a table is partitioned as declared; plain tables are only converted by
+# migrate_to_partitioned, so until then they keep being loaded unpartitioned
+def prepare_partitioned_table(conn, table_name, spec):
+    if is_partitioned(conn, table_name):
+        return True
+    print(f"{table_name} declares partitioning on {spec['column']} but is not partitioned; run "
+          f"migrate_to_partitioned (python partitioned_ingestion.py {table_name}) to convert it. "
+          f"Loading it unpartitioned.")
+    return False
+
+# Function to convert the table of a metadata row to the partitioning it declares, committing the conversion
+# Refuses (ValueError) tables that cannot be swapped and tables whose primary key or unique indexes do not
+# contain the partition key, since a partitioned table could not enforce them
+def migrate_to_partitioned(conn, meta):
+    table_name = meta['table_name']
+    spec = partition_spec(conn, meta)
+    if spec is None:
+        raise ValueError(f"{table_name} declares no usable partitioning.")
+    if is_partitioned(conn, table_name):
+        print(f"{table_name} is already partitioned.")
+        return spec
+    blockers = swap_blockers(conn, table_name)
+    if blockers:
+        raise ValueError(f"Cannot partition {table_name}: {'; '.join(blockers)}.")
+    missing = unique_indexes_without_key(conn, table_name, spec['column'])
+    if missing:
+        raise ValueError(f"Cannot partition {table_name} on {spec['column']}: unique indexes {', '.join(missing)} "
+                         f"do not contain it; add {spec['column']} to them or drop them first.")
+    try:
+        with stage('partition'):
+            convert_to_partitioned(conn, table_name, spec)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return spec
+
+# Function to run `load(connection)` for every task, one transaction each, on up to `workers` connections:
+# `connection` when given, plus extra connections borrowed from the connection budget of the run
+def run_partition_loads(dsn, loads, workers, connection=None):
+    if not loads:
+        return []
+    workers = max(1, min(workers, len(loads)))
+    tasks = queue.SimpleQueue()
+    for position, load in enumerate(loads):
+        tasks.put((position, load))
+    results = [None] * len(loads)
+
+    # Each lane takes the next task until none is left
+    def run_lane(lane_connection):
+        while True:
+            try:
+                position, load = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[position] = load(lane_connection)
+                lane_connection.commit()
+            except Exception:
+                if not lane_connection.closed:
+                    lane_connection.rollback()
+                raise
+
+    with borrowed_connections(workers - 1 if connection is not None else workers) as extra:
+        if connection is None:
+            extra = max(1, extra)
+        pool = create_connection_pool(dsn, extra) if extra else None
+
+        def run_pooled_lane():
+            pooled = pool.getconn()
+            try:
+                run_lane(pooled)
+            finally:
+                pool.putconn(pooled, close=bool(pooled.closed))
+
+        try:
+            with ThreadPoolExecutor(max_workers=extra + 1) as executor:
+                futures = [executor.submit(run_pooled_lane) for _ in range(extra)]
+                if connection is not None:
+                    futures.append(executor.submit(run_lane, connection))
+                for future in futures:
+                    future.result()
+        finally:
+            if pool:
+                pool.closeall()
+    return results
+
+# Read stage of the partitioned strategies
+# with_hashes: also return the row hashes computed while parsing the source (None when there are none)
+def read_source_frame(file_path, read_options=None, with_hashes=False):
+    with stage('read', bytes_read=os.path.getsize(file_path)) as counters:
+        data, row_hashes = cached_read_source_with_hashes(file_path, **(read_options or {}))
+        counters['rows'] = len(data)
+    if with_hashes:
+        return data, row_hashes
+    return data
+
+# Worker load of a partitioned full reload: the rows of one partition are loaded into a standalone table
+# with the parent's indexes and a CHECK constraint matching the partition bound, so attaching it is cheap
+def stage_partition(connection, table_name, spec, key, data, batch_size, index_definitions):
+    stage_table = bounded_table_name(f"{partition_table_name(table_name, spec, key)}__stage")
+    _, _, condition, condition_params = partition_bound(spec, key)
+    with connection.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {stage_table}")
+        cur.execute(f"CREATE TABLE {stage_table} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+                    f"INCLUDING STORAGE)")
+    bulk_load(connection, data, stage_table, batch_size)
+    with connection.cursor() as cur:
+        if not is_default_key(spec, key):
+            for definition in index_definitions:
+                cur.execute(re.sub(r' INDEX \S+ ON (ONLY )?\S+ ', f" INDEX ON {stage_table} ", definition, count=1))
+            cur.execute(f"ALTER TABLE {stage_table} ADD CONSTRAINT {split_table_name(stage_table)[1]}_bound "
+                        f"CHECK ({condition})", condition_params)
+        cur.execute(f"ANALYZE {stage_table}")
+    return stage_table
+
+# Function to swap the staged partitions in, replacing the partitions they cover (the caller commits)
+# Rows of those keys held by the DEFAULT partition are replaced too; NULL dates are replaced in place
+def attach_staged_partitions(conn, table_name, spec, staged):
+    default_partition = ensure_default_partition(conn, table_name)
+    with conn.cursor() as cur:
+        for key, stage_table in staged:
+            for_values, bound_params, condition, condition_params = partition_bound(spec, key)
+            cur.execute(f"DELETE FROM {default_partition} WHERE {condition}", condition_params)
+            if is_default_key(spec, key):
+                cur.execute(f"INSERT INTO {default_partition} SELECT * FROM {stage_table}")
+                cur.execute(f"DROP TABLE {stage_table}")
+                continue
+            partition = partition_table_name(table_name, spec, key)
+            cur.execute(f"DROP TABLE IF EXISTS {partition}")
+            cur.execute(f"ALTER TABLE {stage_table} RENAME TO {split_table_name(partition)[1]}")
+            cur.execute(f"ALTER TABLE {table_name} ATTACH PARTITION {partition} FOR VALUES {for_values}", bound_params)
+            cur.execute(f"ALTER TABLE {partition} DROP CONSTRAINT {split_table_name(stage_table)[1]}_bound")
+
+# Function to drop the staged tables left by a failed partitioned full reload (best-effort)
+def drop_staged_partitions(dsn, table_name, spec, keys):
+    def drop(connection):
+        with connection.cursor() as cur:
+            for key in keys:
+                cur.execute(f"DROP TABLE IF EXISTS "
+                            f"{bounded_table_name(f'{partition_table_name(table_name, spec, key)}__stage')}")
+    try:
+        run_partition_loads(dsn, [drop], 1)
+    except Exception as e:
+        print(f"Could not drop the staged partitions of {table_name}: {e}")
+
+# Function for partitioned full ingestion: the partitions present in the batch are loaded concurrently
+# on `workers` connections and swapped in, in one transaction that first empties the whole table
+# replace_partitions: replace only the partitions present in the batch and keep the others
+# (historical_data_handling = Overwrite Partitions); rows deleted at the source survive in untouched partitions
+def partitioned_full_ingestion(conn, dsn, file_path, table_name, spec, batch_size=None, read_options=None, workers=1,
+                               replace_partitions=False):
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+
+    new_data = read_source_frame(file_path, read_options)
+    with stage('partition', rows=len(new_data)):
+        partitions = split_partitions(new_data, spec)
+        index_definitions = [definition for _, definition, _, _ in fetch_indexes(conn, table_name)]
+    conn.commit()
+
+    loads = [partial(stage_partition, table_name=table_name, spec=spec, key=key, data=part, batch_size=batch_size,
+                     index_definitions=index_definitions) for key, part in partitions]
+    try:
+        with stage('load', rows=len(new_data)):
+            stage_tables = run_partition_loads(dsn, loads, workers, conn)
+        with stage('swap'):
+            if not replace_partitions:
+                with conn.cursor() as cur:
+                    cur.execute(f"TRUNCATE {table_name}")
+            attach_staged_partitions(conn, table_name, spec, list(zip([key for key, _ in partitions], stage_tables)))
+        with stage('commit'):
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        drop_staged_partitions(dsn, table_name, spec, [key for key, _ in partitions])
+        raise
+    annotate_run(partitions_loaded=len(partitions))
+
+    elapsed_time = time.time() - start_time
+    replaced = f"{len(partitions)} partitions replaced" if replace_partitions else f"{len(partitions)} partitions loaded"
+    print(f"Partitioned full ingestion for {file_path} completed in {elapsed_time:.2f} seconds: {replaced}.")
+    return len(new_data)
+
+# Worker load of a partitioned hash-based ingestion: the rows of one partition whose hash is not in it
+# are inserted through a staging table (identical rows share their key, hence their partition)
+def insert_partition_rows_by_hash(connection, partition, data, batch_size, method):
+    if method == 'on_conflict':
+        ensure_hash_index(connection, partition, unique=True)
+    staging_table = create_staging_table(connection, partition)
+    bulk_load(connection, data, staging_table, batch_size)
+    with connection.cursor() as cur:
+        cur.execute(f"ANALYZE {staging_table}")
+        cur.execute(dedup_insert_query(partition, staging_table, data.columns, method))
+        inserted = cur.rowcount
+        cur.execute(f"DROP TABLE {staging_table}")
+    return inserted
+
+# Function for partitioned hash-based ingestion: missing partitions are created, then every partition is
+# deduplicated and loaded concurrently on `workers` connections, each committing its own partition
+# Loads are idempotent, so a failed run is completed by the next one
+def partitioned_hash_based_ingestion(conn, dsn, file_path, table_name, spec, batch_size=None, dedup_mode='anti_join',
+                                     read_options=None, workers=1):
+    if dedup_mode not in ('anti_join', 'on_conflict'):
+        raise ValueError(f"Unsupported dedup mode for partitioned loads: {dedup_mode}")
+    start_time = time.time()
+    batch_size = resolve_batch_size(batch_size)
+
+    new_data, row_hashes = read_source_frame(file_path, read_options, with_hashes=True)
+    with stage('hashing', rows=len(new_data)):
+        new_data['hash'] = row_hashes if row_hashes is not None else hash_rows(new_data)
+
+    with stage('partition', rows=len(new_data)):
+        partitions = split_partitions(new_data, spec)
+        ensure_partitions(conn, table_name, spec, [key for key, _ in partitions])
+        if dedup_mode == 'anti_join':
+            ensure_hash_index(conn, table_name)
+    conn.commit()
+
+    loads = [partial(insert_partition_rows_by_hash, partition=partition_table_name(table_name, spec, key), data=part,
+                     batch_size=batch_size, method=dedup_mode) for key, part in partitions]
+    with stage('load', rows=len(new_data)):
+        loaded = sum(run_partition_loads(dsn, loads, workers, conn))
+    annotate_run(partitions_loaded=len(partitions))
+
+    elapsed_time = time.time() - start_time
+    print(f"Partitioned hash-based ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for partitioned date-based ingestion: missing partitions are created and the new rows routed
+# through the parent table, in one transaction with the watermark (the serial path keeps them consistent)
+def partitioned_date_based_ingestion(conn, file_path, table_name, timestamp_column, spec, batch_size=None,
+                                     read_options=None, time_ordered=False):
+    start_time = time.time()
+
+    new_data = read_source_frame(file_path, read_options)
+    with stage('timestamp_conversion', rows=len(new_data)):
+        new_data[timestamp_column] = pd.to_datetime(new_data[timestamp_column])
+
+    with stage('lookup'):
+        max_timestamp = read_watermark(conn, table_name, timestamp_column)
+    with stage('filter', rows=len(new_data)):
+        filtered_data = rows_after_watermark(new_data, timestamp_column, max_timestamp, time_ordered)
+
+    with stage('partition', rows=len(filtered_data)):
+        ensure_partitions(conn, table_name, spec, [key for key, _ in split_partitions(filtered_data, spec)])
+    with stage('load', rows=len(filtered_data)):
+        loaded = bulk_load(conn, filtered_data, table_name, batch_size)
+        advance_watermark(conn, table_name, filtered_data[timestamp_column].max())
+
+    with stage('commit'):
+        conn.commit()
+    elapsed_time = time.time() - start_time
+    print(f"Partitioned date-based ingestion for {file_path} completed in {elapsed_time:.2f} seconds.")
+    return loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert tables to the partitioning declared in the metadata table.")
+    parser.add_argument('table', nargs='+', help="table_name of a metadata row declaring partitioning")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
+    try:
+        metadata = pd.read_sql(f"SELECT * FROM {METADATA_TABLE} WHERE table_name = ANY(%s)", conn, params=(args.table,))
+        for table_name in args.table:
+            rows = metadata[metadata['table_name'] == table_name]
+            if rows.empty:
+                print(f"{table_name} has no row in {METADATA_TABLE}.")
+                continue
+            migrate_to_partitioned(conn, rows.iloc[0])
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
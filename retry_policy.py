@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import random
+import re
+import psycopg2
+from watermarks import METADATA_TABLE
+
+
+# Policy used when the metadata row does not declare one
+# retries: attempts after the first one; delay: seconds before the first retry;
+# backoff: 'fixed' waits `delay` every time, 'exponential' doubles it up to max_delay
+DEFAULT_RETRY_POLICY = {
+    'retries': 3,
+    'delay': 5.0,
+    'backoff': 'exponential',
+    'max_delay': 300.0,
+}
+
+# Errors worth another attempt: lost connections, server restarts, deadlocks and serialization failures
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError,
+                    psycopg2.extensions.TransactionRollbackError, ConnectionError, TimeoutError)
+
+# Longest error message written back to the metadata table
+MAX_ERROR_LOG_LENGTH = 2000
+
+# Function to parse the retry_policy declared in the metadata table
+# Accepts e.g. 'retry 2', '3 retries', 'backoff time', 'retry 4 backoff 10s'; a retry count alone
+# retries at a fixed interval, mentioning backoff makes the interval grow exponentially
+def parse_retry_policy(retry_policy):
+    policy = dict(DEFAULT_RETRY_POLICY)
+    if retry_policy is None or not isinstance(retry_policy, str) or not retry_policy.strip():
+        return policy
+
+    text = retry_policy.strip().lower()
+    retries = re.search(r'(\d+)\s*(?:retries|retry|times)|(?:retry|retries)\s*(\d+)', text)
+    if retries:
+        policy['retries'] = int(retries.group(1) or retries.group(2))
+        policy['backoff'] = 'fixed'
+    if 'backoff' in text:
+        policy['backoff'] = 'exponential'
+        delay = re.search(r'(\d+(?:\.\d+)?)\s*s\b', text)
+        if delay:
+            policy['delay'] = float(delay.group(1))
+    return policy
+
+# Function to compute the wait before retry number `attempt` (1 for the first retry)
+# Exponential backoff is jittered so tables failing together do not retry in lockstep
+def retry_delay(policy, attempt):
+    if policy['backoff'] == 'fixed':
+        return policy['delay']
+    delay = min(policy['max_delay'], policy['delay'] * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+# Function to tell whether an error is transient and the load worth retrying
+def is_transient(error):
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    # asyncpg (async pipeline) reports lost connections with its own exception types
+    return type(error).__module__.startswith('asyncpg') and 'Connection' in type(error).__name__
+
+# Function to write a failed attempt back to the error fields of the table's metadata row
+def record_failure(conn, table_name, error, attempt, max_attempts):
+    message = f"Attempt {attempt}/{max_attempts} failed: {type(error).__name__}: {error}".strip()
+    with conn.cursor() as cur:
+        cur.execute(
+            f"UPDATE {METADATA_TABLE} SET error_log = %s, last_error_timestamp = now() WHERE table_name = %s",
+            (message[:MAX_ERROR_LOG_LENGTH], table_name),
+        )
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+# Long-running ingestion scheduler. Every tick it works out which tables are due from their
+# refresh_schedule and last_ingestion_date, skips paused tables, groups the due tables by the source
+# they read so each source is parsed once, and hands the groups by priority to a bounded worker pool.
+#
+#   python scheduler.py --default-source data/sales.csv --source Zoomdog=data/zoomdog.csv --max-workers 4
+#   python scheduler.py --default-source data/sales.csv --dry-run --horizon-hours 48
+
+import argparse
+import itertools
+import queue
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+from ingestion_core import DATABASE_URL, fetch_metadata, ingest_table, build_read_options
+from metadata_rules import preflight_check
+from parallel_executor import create_connection_pool, run_table_isolated, build_table_slots, DEFAULT_MAX_WORKERS
+from source_cache import cached_read_source, source_cache_stats
+from source_readers import normalize_file_format
+
+
+# Time between two runs of a table, by refresh_schedule
+REFRESH_INTERVALS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(days=1),
+    'weekly': timedelta(weeks=1),
+    'monthly': timedelta(days=30),
+}
+
+# Schedule used for tables without a known refresh_schedule
+DEFAULT_REFRESH_SCHEDULE = 'daily'
+
+# Groups are dispatched in this order (lower first), then by how long they have been due:
+# the tables refreshed most often have the tightest freshness expectations
+SCHEDULE_PRIORITIES = {'hourly': 0, 'daily': 1, 'weekly': 2, 'monthly': 3}
+
+# Tables with one of these statuses are never scheduled
+INACTIVE_STATUSES = ['paused', 'not-active']
+
+# A table whose last run failed (after its own retries) is tried again after this delay
+FAILED_RETRY_INTERVAL = timedelta(minutes=15)
+
+DEFAULT_TICK_SECONDS = 60
+
+# Priority of the marker stopping a worker: after every queued group
+STOP_PRIORITY = (float('inf'),)
+
+# Columns of the plan built at every tick (row: index of the metadata row, key: its row_key)
+PLAN_COLUMNS = ['row', 'key', 'table_name', 'source', 'file_format', 'refresh_schedule', 'due_at', 'priority']
+
+# Metadata columns the runs themselves update; they are left out of the key identifying a row across ticks
+RUN_STATE_COLUMNS = ['watermark', 'last_ingestion_date', 'error_log', 'last_error_timestamp']
+
+# Function to normalize the refresh_schedule of a metadata row
+def refresh_schedule(meta):
+    schedule = meta.get('refresh_schedule')
+    schedule = str(schedule).strip().lower() if pd.notna(schedule) else None
+    return schedule if schedule in REFRESH_INTERVALS else DEFAULT_REFRESH_SCHEDULE
+
+# Function to tell whether a metadata row may be scheduled at all
+def is_schedulable(meta):
+    status = meta.get('status')
+    return not (pd.notna(status) and str(status).strip().lower() in INACTIVE_STATUSES)
+
+# Function to identify a metadata row across ticks: several rows may declare the same table_name, and the
+# order of the rows fetched may change between ticks, so rows are told apart by their configuration
+def row_key(meta):
+    return tuple((column, None if pd.isna(value) else str(value))
+                 for column, value in meta.items() if column not in RUN_STATE_COLUMNS)
+
+# Function to read a metadata timestamp as a naive local time, comparable with datetime.now()
+# (timestamptz columns are read tz-aware, timestamp columns naive)
+def local_timestamp(value):
+    timestamp = pd.to_datetime(value, errors='coerce')
+    if pd.notna(timestamp) and timestamp.tzinfo is not None:
+        timestamp = timestamp.tz_convert(datetime.now().astimezone().tzinfo).tz_localize(None)
+    return timestamp
+
+# Function to compute when a table is next due: right away if it was never ingested, one refresh
+# interval after its last ingestion, or FAILED_RETRY_INTERVAL after a failure newer than that
+def next_due(meta):
+    last_ingestion = local_timestamp(meta.get('last_ingestion_date'))
+    last_error = local_timestamp(meta.get('last_error_timestamp'))
+    if pd.notna(last_error) and (pd.isna(last_ingestion) or last_error > last_ingestion):
+        return last_error + FAILED_RETRY_INTERVAL
+    if pd.isna(last_ingestion):
+        return None
+    return last_ingestion + REFRESH_INTERVALS[refresh_schedule(meta)]
+
+# Function to find the source file of a metadata row
+# sources: one path for every table, a callable meta -> path, or a dict keyed by data_source_name
+# or table_name, with '*' as the fallback
+def resolve_source(meta, sources):
+    if callable(sources):
+        return sources(meta)
+    if isinstance(sources, str):
+        return sources
+    for key in (meta.get('data_source_name'), meta.get('table_name'), '*'):
+        if pd.notna(key) and key in sources:
+            return sources[key]
+    return None
+
+# Function to list the tables due at `now`, with the source they read and their dispatch priority
+def plan_due_tables(metadata, sources, now):
+    rows = []
+    for index, meta in metadata.iterrows():
+        if not is_schedulable(meta):
+            continue
+        due_at = next_due(meta)
+        if due_at is not None and due_at > now:
+            continue
+        source = resolve_source(meta, sources)
+        if source is None:
+            print(f"No source configured for table {meta['table_name']}, skipping it.")
+            continue
+        schedule = refresh_schedule(meta)
+        rows.append({
+            'row': index,
+            'key': row_key(meta),
+            'table_name': meta['table_name'],
+            'source': source,
+            'file_format': normalize_file_format(meta.get('source_file_format'), source),
+            'refresh_schedule': schedule,
+            'due_at': due_at if due_at is not None else pd.NaT,
+            'priority': (SCHEDULE_PRIORITIES[schedule], due_at if due_at is not None else pd.Timestamp.min),
+        })
+    return pd.DataFrame(rows, columns=PLAN_COLUMNS)
+
+# Function to group planned tables by source, most urgent group first
+# A group takes the priority of its most urgent table
+def group_by_source(plan):
+    groups = []
+    for (source, file_format), group in plan.groupby(['source', 'file_format'], sort=False):
+        groups.append({
+            'source': source,
+            'file_format': file_format,
+            'tables': list(group['table_name']),
+            'rows': list(group['row']),
+            'keys': list(group['key']),
+            'priority': min(group['priority']),
+        })
+    return sorted(groups, key=lambda group: group['priority'])
+
+# Function to parse a source once for every table of a group: the union of their projections is read
+# into the source cache, from which each table's own projection is then served
+def warm_source(connection, source, metas):
+    read_options = [build_read_options(connection, meta, source) for meta in metas]
+    if any(not options['columns'] for options in read_options):
+        columns = None
+    else:
+        columns = sorted({column for options in read_options for column in options['columns']})
+    # Tables are served from the wider read only when the rest of their read options (e.g. dtypes) match
+    cached_read_source(source, **dict(read_options[0], columns=columns))
+
+# Function to run one group on the pool: the shared source is read once, then every table is loaded
+# in its own transaction
+def run_group(pool, group, metas, chunksize=None):
+    # Chunked loads stream the source per table, so there is nothing to share
+    if not chunksize and len(metas) > 1:
+        connection = pool.getconn()
+        try:
+            warm_source(connection, group['source'], metas)
+        except Exception as e:
+            print(f"Could not read source {group['source']} once for {len(metas)} tables: {e}")
+        finally:
+            connection.rollback()
+            pool.putconn(connection)
+
+    table_slots = build_table_slots(pd.DataFrame(metas))
+    run_table = lambda meta, connection, reconnect: ingest_table(group['source'], meta, connection, chunksize,
+                                                                 reconnect=reconnect)
+    return [run_table_isolated(pool, run_table, meta, table_slots) for meta in metas]
+
+# Function to start the workers taking groups from the priority queue
+def start_workers(pool, work_queue, state, max_workers, chunksize=None):
+    def worker():
+        while True:
+            _, _, group = work_queue.get()
+            if group is None:
+                return
+            try:
+                results = run_group(pool, group, group['metas'], chunksize)
+            except Exception as e:
+                print(f"Group for source {group['source']} failed: {e}")
+                results = []
+            with state['lock']:
+                state['results'].extend(results)
+                state['in_flight'].difference_update(group['keys'])
+
+    threads = [threading.Thread(target=worker, name=f"ingestion-worker-{i}", daemon=True) for i in range(max_workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+# Function to plan one tick and queue its groups; metadata rows still queued or running are not queued twice
+def schedule_tick(work_queue, state, sources, sequence, now=None):
+    now = now or datetime.now()
+    metadata, alerts = preflight_check(fetch_metadata())
+    plan = plan_due_tables(metadata, sources, now)
+
+    with state['lock']:
+        plan = plan[[key not in state['in_flight'] for key in plan['key']]]
+        state['in_flight'].update(plan['key'])
+
+    groups = group_by_source(plan)
+    for group in groups:
+        group['metas'] = [metadata.loc[row] for row in group['rows']]
+        work_queue.put((group['priority'], next(sequence), group))
+
+    print(f"[{now:%Y-%m-%d %H:%M:%S}] {len(plan)} tables due in {len(groups)} source groups "
+          f"({len(state['in_flight'])} queued or running).")
+    return groups
+
+# Function to run the scheduler until interrupted (or for a single tick with once=True)
+# Returns the per-table results of the runs completed
+def run_scheduler(sources, tick_seconds=DEFAULT_TICK_SECONDS, max_workers=DEFAULT_MAX_WORKERS, chunksize=None,
+                  once=False, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    state = {'lock': threading.Lock(), 'in_flight': set(), 'results': []}
+    work_queue = queue.PriorityQueue()
+    sequence = itertools.count()
+
+    pool = create_connection_pool(DATABASE_URL, max_workers)
+    threads = start_workers(pool, work_queue, state, max_workers, chunksize)
+    interrupted = False
+    try:
+        while True:
+            # A failed tick (e.g. the metadata cannot be fetched) is retried at the next one
+            try:
+                schedule_tick(work_queue, state, sources, sequence)
+            except Exception as e:
+                print(f"Scheduler tick failed: {e}")
+            if once or stop_event.wait(tick_seconds):
+                break
+    except KeyboardInterrupt:
+        interrupted = True
+        print("Stopping the scheduler; groups not started yet are dropped.")
+    finally:
+        if interrupted:
+            while not work_queue.empty():
+                work_queue.get_nowait()
+        for _ in threads:
+            work_queue.put((STOP_PRIORITY, next(sequence), None))
+        for thread in threads:
+            thread.join()
+        pool.closeall()
+
+    results = pd.DataFrame(state['results'], columns=['table_name', 'status', 'rows_loaded', 'elapsed_seconds', 'error'])
+    print(f"Source cache: {source_cache_stats()}")
+    return results
+
+# Function to simulate the schedule over `horizon` (every run taken to succeed at the tick it is due),
+# returning one row per tick and source group in dispatch order
+def plan_timeline(metadata, sources, start, horizon, tick_seconds=DEFAULT_TICK_SECONDS):
+    tick = timedelta(seconds=tick_seconds)
+    end = start + horizon
+    events = []
+    for _, meta in metadata.iterrows():
+        if not is_schedulable(meta):
+            continue
+        source = resolve_source(meta, sources)
+        if source is None:
+            continue
+        schedule = refresh_schedule(meta)
+        due_at = next_due(meta)
+        run_at = start if due_at is None or due_at <= start else start + tick * -(-(due_at - start) // tick)
+        while run_at < end:
+            events.append({'run_at': run_at, 'source': source, 'table_name': meta['table_name'],
+                           'refresh_schedule': schedule, 'rank': SCHEDULE_PRIORITIES[schedule]})
+            run_at += tick * -(-REFRESH_INTERVALS[schedule] // tick)
+
+    columns = ['run_at', 'priority', 'source', 'tables', 'refresh_schedules']
+    if not events:
+        return pd.DataFrame(columns=columns)
+    timeline = (pd.DataFrame(events)
+                .groupby(['run_at', 'source'])
+                .agg(priority=('rank', 'min'), tables=('table_name', ', '.join),
+                     refresh_schedules=('refresh_schedule', lambda values: ', '.join(sorted(set(values)))))
+                .reset_index())
+    return timeline.sort_values(['run_at', 'priority'])[columns].reset_index(drop=True)
+
+# Function to print the planned execution timeline without loading anything
+def dry_run(sources, horizon=timedelta(hours=24), tick_seconds=DEFAULT_TICK_SECONDS, now=None):
+    now = (now or datetime.now()).replace(microsecond=0)
+    metadata, _ = preflight_check(fetch_metadata())
+    skipped = [meta['table_name'] for _, meta in metadata.iterrows() if not is_schedulable(meta)]
+    if skipped:
+        print(f"Not scheduled (inactive): {', '.join(map(str, skipped))}")
+
+    timeline = plan_timeline(metadata, sources, now, horizon, tick_seconds)
+    print(f"Planned runs from {now:%Y-%m-%d %H:%M} for {horizon}:")
+    print(timeline.to_string(index=False) if not timeline.empty else "Nothing due.")
+    return timeline
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ingestion tables on their refresh schedule.")
+    parser.add_argument('--source', action='append', default=[], metavar='NAME=PATH',
+                        help="source file of a data_source_name (or table_name); may be repeated")
+    parser.add_argument('--default-source', help="source file of the tables without their own --source")
+    parser.add_argument('--tick-seconds', type=int, default=DEFAULT_TICK_SECONDS)
+    parser.add_argument('--max-workers', type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument('--chunksize', type=int, help="stream sources in chunks of this many rows")
+    parser.add_argument('--once', action='store_true', help="run the tables due now and exit")
+    parser.add_argument('--dry-run', action='store_true', help="print the planned timeline and exit")
+    parser.add_argument('--horizon-hours', type=float, default=24, help="length of the dry-run timeline")
+    args = parser.parse_args()
+
+    sources = dict(source.split('=', 1) for source in args.source)
+    if args.default_source:
+        sources['*'] = args.default_source
+    if not sources:
+        parser.error("at least one --source or --default-source is required")
+
+    if args.dry_run:
+        dry_run(sources, timedelta(hours=args.horizon_hours), args.tick_seconds)
+        return
+    results = run_scheduler(sources, args.tick_seconds, args.max_workers, args.chunksize, args.once)
+    if not results.empty:
+        print(results.to_string(index=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from source_readers import read_source, project_frame
+from parallel_csv import read_source_parallel
+
+
+# Eviction limits: least recently used sources are dropped past either bound
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHE_MAX_ENTRIES = 16
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_loading = {}
+_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'cached_bytes': 0, 'parse_seconds_saved': 0.0}
+
+# Function to change the eviction limits of the source cache
+def configure_source_cache(max_bytes=None, max_entries=None):
+    global CACHE_MAX_BYTES, CACHE_MAX_ENTRIES
+    with _cache_lock:
+        if max_bytes is not None:
+            CACHE_MAX_BYTES = max_bytes
+        if max_entries is not None:
+            CACHE_MAX_ENTRIES = max_entries
+        evict_over_budget()
+
+# Function to build the cache key: a changed file (size or mtime) or different read options miss the cache
+def source_cache_key(file_path, read_options):
+    stat = os.stat(file_path)
+    options = repr(sorted(read_options.items()))
+    return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, options)
+
+# Function to tell whether a cached read's projection contains every column of another one
+def projection_covers(cached_columns, columns):
+    if not cached_columns:
+        return True
+    return bool(columns) and set(columns) <= set(cached_columns)
+
+# Function to find a cached read of the same file and options whose projection covers `columns`
+# (lock must be held); tables sharing a source can then all be served by one wider read
+def covering_entry(key, read_options):
+    options = {name: value for name, value in read_options.items() if name != 'columns'}
+    for cached_key, entry in _cache.items():
+        if (cached_key[:3] == key[:3] and entry['options'] == options
+                and projection_covers(entry['columns'], read_options.get('columns'))):
+            return cached_key, entry
+    return None, None
+
+# Function to drop least recently used entries until the cache fits its limits (lock must be held)
+def evict_over_budget():
+    while _cache and (_cache_stats['cached_bytes'] > CACHE_MAX_BYTES or len(_cache) > CACHE_MAX_ENTRIES):
+        _, entry = _cache.popitem(last=False)
+        _cache_stats['cached_bytes'] -= entry['bytes']
+        _cache_stats['evictions'] += 1
+
+# Function to read a source through the cache, returning a shallow copy the caller may add or replace columns on
+# Strategies only assign whole columns, which never writes through to the cached frame
+# (and is copy-on-write when pandas Copy-on-Write is enabled)
+def cached_read_source(file_path, **read_options):
+    return cached_read_source_with_hashes(file_path, **read_options)[0]
+
+# Function to read a source through the cache together with the row hashes computed while parsing it
+# (parse_workers reads, see parallel_csv.py); hashes are None when the read computed none or the frame
+# is projected from a wider cached read
+def cached_read_source_with_hashes(file_path, **read_options):
+    key = source_cache_key(file_path, read_options)
+
+    while True:
+        with _cache_lock:
+            entry = _cache.get(key)
+            if entry is None:
+                cached_key, entry = covering_entry(key, read_options)
+            else:
+                cached_key = key
+            if entry is not None:
+                _cache.move_to_end(cached_key)
+                _cache_stats['hits'] += 1
+                _cache_stats['parse_seconds_saved'] += entry['parse_seconds']
+                if cached_key != key:
+                    return project_frame(entry['data'], read_options.get('columns')).copy(deep=False), None
+                return entry['data'].copy(deep=False), copy_hashes(entry['hashes'])
+            loading = _loading.get(key)
+            if loading is None:
+                _cache_stats['misses'] += 1
+                _loading[key] = threading.Event()
+                break
+        # Another worker is parsing the same source; wait for it instead of parsing twice
+        loading.wait()
+
+    # Parse outside the lock so other sources can be served meanwhile
+    try:
+        start_time = time.time()
+        # parse_workers: parse (and hash) the source on that many processes (see parallel_csv.py)
+        if read_options.get('parse_workers'):
+            data, hashes = read_source_parallel(file_path, **read_options)
+        else:
+            data, hashes = read_source(file_path, **read_options), None
+        parse_seconds = time.time() - start_time
+        size = int(data.memory_usage(deep=True).sum())
+        if hashes is not None:
+            size += int(hashes.memory_usage(deep=True))
+
+        with _cache_lock:
+            if size <= CACHE_MAX_BYTES:
+                _cache[key] = {'data': data, 'hashes': hashes, 'bytes': size, 'parse_seconds': parse_seconds,
+                               'columns': read_options.get('columns'),
+                               'options': {name: value for name, value in read_options.items() if name != 'columns'}}
+                _cache_stats['cached_bytes'] += size
+                evict_over_budget()
+    finally:
+        with _cache_lock:
+            _loading.pop(key).set()
+    return data.copy(deep=False), copy_hashes(hashes)
+
+# Function to copy cached row hashes for a caller, who may assign them to its frame
+def copy_hashes(hashes):
+    return None if hashes is None else hashes.copy()
+
+# Function to report hit/miss counters and the parse time saved by the cache
+def source_cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats, entries=len(_cache))
+
+# Function to empty the cache (counters are kept)
+def clear_source_cache():
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats['cached_bytes'] = 0
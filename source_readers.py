@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet sources need pyarrow
+    pq = None
+
+try:
+    import snappy
+except ImportError:  # snappy-compressed CSV/JSON sources need python-snappy
+    snappy = None
+
+
+# Leading bytes of the compressed streams we can open transparently
+GZIP_MAGIC = b'\x1f\x8b'
+SNAPPY_FRAMED_MAGIC = b'\xff\x06\x00\x00sNaPpY'
+
+# Bytes scanned at a time when looking for the record a resumed CSV read starts from
+RECORD_SCAN_BLOCK_BYTES = 4 * 1024 ** 2
+
+# Reader options that change how CSV records map to lines; resumed reads with them parse and drop the rows instead
+CSV_LAYOUT_OPTIONS = {'header', 'names', 'skiprows', 'skipfooter', 'nrows', 'comment', 'skip_blank_lines',
+                      'lineterminator', 'quotechar', 'quoting', 'escapechar', 'doublequote', 'encoding'}
+
+# Function to normalize the source_file_format declared in the metadata (CSV/JSON/Parquet)
+def normalize_file_format(file_format, file_path):
+    if file_format is None or pd.isna(file_format):
+        suffixes = [part.lower() for part in file_path.split('.')[1:]]
+        for candidate in ('parquet', 'json', 'jsonl', 'csv'):
+            if candidate in suffixes:
+                return 'json' if candidate == 'jsonl' else candidate
+        return 'csv'
+    return str(file_format).strip().lower()
+
+# Function to detect the compression of a file from its leading bytes
+# The declared compression_type is only a default in the metadata, so the file itself is authoritative
+def detect_compression(file_path):
+    with open(file_path, 'rb') as f:
+        head = f.read(len(SNAPPY_FRAMED_MAGIC))
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(SNAPPY_FRAMED_MAGIC):
+        return 'snappy'
+    return None
+
+# Function to decompress a framed-snappy file into a temporary file pandas can stream from
+def open_snappy_source(file_path):
+    if snappy is None:
+        raise ImportError("python-snappy is required to read snappy-compressed sources.")
+    decompressed = tempfile.TemporaryFile()
+    with open(file_path, 'rb') as src:
+        snappy.stream_decompress(src, decompressed)
+    decompressed.seek(0)
+    return decompressed
+
+# Function to open a text source, returning what pandas should read and the compression to pass it
+def open_text_source(file_path):
+    compression = detect_compression(file_path)
+    if compression == 'snappy':
+        return open_snappy_source(file_path), None
+    return file_path, compression
+
+# Function to build a usecols filter that keeps file order and ignores columns missing from the source
+def projection(columns):
+    if not columns:
+        return None
+    wanted = set(columns)
+    return lambda column: column in wanted
+
+# Function to restrict a parsed frame to the projected columns (readers without native projection)
+def project_frame(data, columns):
+    if not columns:
+        return data
+    return data[[column for column in data.columns if column in set(columns)]]
+
+# Function to cast the columns of a decoded frame to planned dtypes (readers without a dtype argument)
+def apply_dtypes(data, dtype):
+    if not dtype:
+        return data
+    return data.astype({column: value for column, value in dtype.items() if column in data.columns})
+
+# Function to downcast integer columns to the smallest integer type holding their values, and float
+# columns holding only integral values exactly representable in float32 (those render identically,
+# so row hashes and COPY buffers are unchanged)
+def downcast_numeric_columns(data):
+    downcast = {}
+    for column in data.columns:
+        values = data[column]
+        if not isinstance(values.dtype, np.dtype) or pd.api.types.is_bool_dtype(values):
+            continue
+        if values.dtype.kind == 'i':
+            downcast[column] = pd.to_numeric(values, downcast='integer')
+        elif values.dtype == np.float64:
+            present = values.dropna()
+            if present.empty or ((present % 1 == 0).all() and present.abs().max() < 2 ** 24):
+                downcast[column] = values.astype(np.float32)
+    if not downcast:
+        return data
+
+    # Hashing renders rows through the frame's common dtype, which must not change for all-numeric frames
+    compact = data.assign(**downcast)
+    if all(pd.api.types.is_numeric_dtype(dtype) for dtype in data.dtypes) and \
+            np.result_type(*compact.dtypes) != np.result_type(*data.dtypes):
+        return data
+    return compact
+
+# Function to read the column names of a Parquet file that are part of the projection
+def parquet_columns(parquet_file, columns):
+    if not columns:
+        return None
+    wanted = set(columns)
+    return [name for name in parquet_file.schema_arrow.names if name in wanted]
+
+# Function to read a whole source into a DataFrame
+# columns: only these columns are read (the target table's columns plus the timestamp column)
+# dtype: planned dtypes (see dtype_planning.py), applied by the CSV parser itself;
+# downcast: downcast numeric columns once parsed
+def read_source(file_path, file_format=None, columns=None, dtype=None, downcast=False, **read_options):
+    file_format = normalize_file_format(file_format, file_path)
+
+    if file_format == 'parquet':
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet sources.")
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        data = apply_dtypes(parquet_file.read(columns=parquet_columns(parquet_file, columns)).to_pandas(), dtype)
+    else:
+        source, compression = open_text_source(file_path)
+        if file_format == 'json':
+            data = pd.read_json(source, lines=True, compression=compression, **read_options)
+            data = apply_dtypes(project_frame(data, columns), dtype)
+        elif file_format == 'csv':
+            data = pd.read_csv(source, compression=compression, usecols=projection(columns), dtype=dtype,
+                               **read_options)
+        else:
+            raise ValueError(f"Unsupported source file format: {file_format}")
+    return downcast_numeric_columns(data) if downcast else data
+
+# Function to stream a source in chunks of at most `chunksize` rows
+# dtype and downcast as in read_source; start_row: skip the first data rows (e.g. to resume a load)
+# chunk_dtypes: dtype every chunk is cast to, per column (see dtype_planning.plan_chunk_dtypes)
+def iter_source_chunks(file_path, chunksize, file_format=None, columns=None, dtype=None, downcast=False,
+                       start_row=0, chunk_dtypes=None, **read_options):
+    if start_row:
+        chunks = iter_chunks_after_row(file_path, chunksize, start_row, file_format, columns, dtype, **read_options)
+    else:
+        chunks = iter_decoded_chunks(file_path, chunksize, file_format, columns, dtype, **read_options)
+    for chunk in chunks:
+        if chunk_dtypes:
+            casts = {column: target for column, target in chunk_dtypes.items()
+                     if column in chunk.columns and chunk[column].dtype != target}
+            if casts:
+                chunk = chunk.astype(casts)
+        yield downcast_numeric_columns(chunk) if downcast else chunk
+
+# Function to find the byte offset of data row `start_row` of an uncompressed CSV file, scanning it block by block
+# A newline ends a record only after an even number of quotes, and blank lines are no records (the parser
+# skips them); returns the size of the file when it holds fewer rows
+def csv_row_offset(file_path, start_row):
+    wanted = start_row + 1  # the header is the first record
+    records, quotes, record_start, position, last_byte = 0, 0, 0, 0, 0
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(RECORD_SCAN_BLOCK_BYTES)
+            if not block:
+                return position
+            data = np.frombuffer(block, dtype=np.uint8)
+            newlines = np.flatnonzero(data == ord('\n'))
+            quotes_before = quotes + np.cumsum(data == ord('"'), dtype=np.int64)
+            ends = newlines[quotes_before[newlines] % 2 == 0] + position
+            starts = np.concatenate(([record_start], ends[:-1] + 1))
+            lengths = ends - starts
+            # A one-byte record is blank when that byte is the \r of a \r\n line end (possibly the previous block's last)
+            first_bytes = np.concatenate(([last_byte], data))[np.clip(starts - position + 1, 0, len(data))]
+            blank = (lengths == 0) | ((lengths == 1) & (first_bytes == ord('\r')))
+            found = ends[~blank] + 1
+            if records + len(found) >= wanted:
+                return int(found[wanted - records - 1])
+            records += len(found)
+            quotes = int(quotes_before[-1])
+            if len(ends):
+                record_start = int(ends[-1]) + 1
+            position += len(block)
+            last_byte = block[-1]
+
+# Function to stream a source from data row `start_row` on
+# Plain CSV files are read from the byte offset of that row, so the skipped rows are neither parsed nor
+# listed; other sources are parsed from the start and their first rows dropped chunk by chunk
+def iter_chunks_after_row(file_path, chunksize, start_row, file_format=None, columns=None, dtype=None,
+                          **read_options):
+    file_format = normalize_file_format(file_format, file_path)
+    if file_format == 'csv' and detect_compression(file_path) is None and not CSV_LAYOUT_OPTIONS & set(read_options):
+        names = list(pd.read_csv(file_path, nrows=0, **read_options).columns)
+        offset = csv_row_offset(file_path, start_row)
+        with open(file_path, 'rb') as source:
+            if offset >= os.fstat(source.fileno()).st_size:
+                return
+            source.seek(offset)
+            with pd.read_csv(source, chunksize=chunksize, header=None, names=names, usecols=projection(columns),
+                             dtype=dtype, **read_options) as reader:
+                yield from reader
+        return
+
+    skipped = 0
+    for chunk in iter_decoded_chunks(file_path, chunksize, file_format, columns, dtype, **read_options):
+        if skipped < start_row:
+            head = min(len(chunk), start_row - skipped)
+            skipped += head
+            chunk = chunk.iloc[head:]
+            if chunk.empty:
+                continue
+        yield chunk
+
+# Function to decode the chunks of a source (see iter_source_chunks)
+def iter_decoded_chunks(file_path, chunksize, file_format=None, columns=None, dtype=None, **read_options):
+    file_format = normalize_file_format(file_format, file_path)
+
+    if file_format == 'parquet':
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet sources.")
+        # Batches follow row groups, so only the row groups being converted are held in memory
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=parquet_columns(parquet_file, columns)):
+            yield apply_dtypes(batch.to_pandas(), dtype)
+        return
+
+    source, compression = open_text_source(file_path)
+    if file_format == 'json':
+        reader = pd.read_json(source, lines=True, chunksize=chunksize, compression=compression, **read_options)
+        with reader:
+            for chunk in reader:
+                yield apply_dtypes(project_frame(chunk, columns), dtype)
+        return
+    if file_format == 'csv':
+        with pd.read_csv(source, chunksize=chunksize, compression=compression,
+                         usecols=projection(columns), dtype=dtype, **read_options) as reader:
+            yield from reader
+        return
+    raise ValueError(f"Unsupported source file format: {file_format}")
+
+# Function to count the rows of a source without materializing it
+def count_source_rows(file_path, chunksize, file_format=None):
+    file_format = normalize_file_format(file_format, file_path)
+    if file_format == 'parquet':
+        if pq is None:
+            raise ImportError("pyarrow is required to read Parquet sources.")
+        return pq.ParquetFile(file_path, memory_map=True).metadata.num_rows
+    if file_format == 'csv':
+        # A single-column pass is enough to count CSV rows
+        source, compression = open_text_source(file_path)
+        return sum(len(chunk) for chunk in pd.read_csv(source, usecols=[0], chunksize=chunksize, compression=compression))
+    return sum(len(chunk) for chunk in iter_source_chunks(file_path, chunksize, file_format))
+
+# Function to fetch the column names of the target table, used to project the source
+def fetch_target_columns(conn, table_name):
+    schema_name, _, bare_name = table_name.rpartition('.')
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_name = %s AND table_schema = COALESCE(NULLIF(%s, ''), current_schema()) "
+            "ORDER BY ordinal_position",
+            (bare_name, schema_name),
+        )
+        return [row[0] for row in cur.fetchall()]
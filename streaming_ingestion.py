@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+import time
+import pandas as pd
+from bulk_loader import bulk_load, insert_new_rows_by_hash, merge_rows_by_key, parse_key_columns
+from row_hashing import hash_rows
+from hash_index import open_hash_index, lookup_hashes, add_hashes
+from source_readers import iter_source_chunks, count_source_rows
+from ingestion_metrics import stage, timed_iter, annotate_run
+from table_swap import prepare_full_load, finish_full_load
+from watermarks import read_watermark, advance_watermark, read_chunks_after_watermark, DEFAULT_WATERMARK
+from checkpoints import save_checkpoint, clear_checkpoint, is_resumed, restart_checkpoint
+
+
+# Rows parsed per chunk; peak memory is bounded by a few chunks of this size
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Parse stage: read the source file one chunk at a time, indexing the rows by their position in the source
+# read_options: file_format, columns and reader options passed to iter_source_chunks
+# start_row: resume after the rows committed by an earlier attempt
+def read_chunks(file_path, chunksize=DEFAULT_CHUNK_SIZE, read_options=None, start_row=0):
+    offset = start_row
+    chunks = iter_source_chunks(file_path, chunksize, start_row=start_row, **(read_options or {}))
+    for chunk in timed_iter('read', chunks):
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+# Type-coercion stage: convert the timestamp column of every chunk
+def coerce_timestamps(chunks, timestamp_column, errors='raise'):
+    for chunk in chunks:
+        if timestamp_column:
+            with stage('timestamp_conversion', rows=len(chunk)):
+                chunk[timestamp_column] = pd.to_datetime(chunk[timestamp_column], errors=errors)
+        yield chunk
+
+# Hash stage: add the row hash to every chunk
+# Chunks read with dtype_planning.plan_chunk_dtypes have the dtypes of a whole-file read, so their rows
+# hash as in a whole-file (or differently chunked) read
+def hash_chunks(chunks):
+    for chunk in chunks:
+        with stage('hashing', rows=len(chunk)):
+            chunk['hash'] = hash_rows(chunk)
+        yield chunk
+
+# Filter stage: keep only rows whose hash is not in the local hash index
+# pending: hashes of the rows loaded but not committed yet, hence not indexed; rows matching them are dropped
+# too and the kept ones are added to it (the caller empties it once they are committed and indexed)
+def filter_unindexed_hashes(chunks, index_dir, pending=None):
+    for chunk in chunks:
+        with stage('lookup', rows=len(chunk)):
+            chunk = chunk[~lookup_hashes(index_dir, chunk['hash'])]
+            if pending is not None:
+                chunk = chunk[~chunk['hash'].isin(pending)]
+                pending.update(chunk['hash'])
+        yield chunk
+
+# Split stage: tag rows before `split_row` as 'full' and the remaining rows as 'incremental'
+def split_at_row(chunks, split_row):
+    offset = 0
+    for chunk in chunks:
+        head = max(0, min(len(chunk), split_row - offset))
+        if head:
+            yield 'full', chunk.iloc[:head]
+        if head < len(chunk):
+            yield 'incremental', chunk.iloc[head:]
+        offset += len(chunk)
+
+# Load stage: write each chunk with `loader` and commit every `commit_every` chunks
+# checkpoint: record the source offset reached in the same transaction as the chunks (see checkpoints.py)
+def load_chunks(conn, chunks, loader, commit_every=1, on_commit=None, checkpoint=None):
+    total_rows, pending = 0, []
+    for chunk in chunks:
+        with stage('load', rows=len(chunk[1]) if isinstance(chunk, tuple) else len(chunk)):
+            total_rows += loader(chunk)
+        pending.append(chunk)
+        if len(pending) >= commit_every:
+            with stage('commit'):
+                if checkpoint is not None:
+                    save_checkpoint(conn, checkpoint, pending)
+                conn.commit()
+            if on_commit:
+                on_commit(pending)
+            pending = []
+    with stage('commit'):
+        if checkpoint is not None and pending:
+            save_checkpoint(conn, checkpoint, pending)
+        conn.commit()
+    if on_commit and pending:
+        on_commit(pending)
+    return total_rows
+
+# Function for streaming full ingestion
+# load_mode 'swap': chunks are committed into the shadow table, which replaces the live table once complete
+# checkpoint: resume a failed attempt after its last committed chunk (see checkpoints.open_checkpoint)
+def streaming_full_ingestion(conn, file_path, table_name, batch_size=None, chunksize=DEFAULT_CHUNK_SIZE, commit_every=1,
+                             read_options=None, load_mode='swap', checkpoint=None):
+    start_time = time.time()
+
+    target_table = prepare_full_load(conn, table_name, load_mode, checkpoint)
+    start_row = checkpoint['rows'] if checkpoint else 0
+
+    chunks = read_chunks(file_path, chunksize, read_options, start_row)
+    loaded = load_chunks(conn, chunks, lambda chunk: bulk_load(conn, chunk, target_table, batch_size), commit_every,
+                         checkpoint=checkpoint)
+
+    finish_full_load(conn, table_name, target_table)
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+
+    elapsed_time = time.time() - start_time
+    print(f"Streaming full ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function to find the watermark a date-based load filters against: the one read when the load started,
+# kept in the checkpoint state so that a resumed attempt filters exactly as the failed one did
+def starting_watermark(conn, table_name, timestamp_column, checkpoint=None):
+    if is_resumed(checkpoint):
+        if checkpoint['state'].get('watermark'):
+            return pd.Timestamp(checkpoint['state']['watermark'])
+        restart_checkpoint(checkpoint)
+    with stage('lookup'):
+        watermark = read_watermark(conn, table_name, timestamp_column)
+    if checkpoint is not None:
+        checkpoint['state'] = {'watermark': watermark.isoformat(), 'loaded': None}
+    return watermark
+
+# Function to record the newest timestamp loaded so far in a date-based load's state
+def track_loaded_timestamp(state, newest):
+    if newest is None or pd.isna(newest):
+        return
+    if state.get('loaded') is None or pd.Timestamp(newest) > pd.Timestamp(state['loaded']):
+        state['loaded'] = pd.Timestamp(newest).isoformat()
+
+# Function for streaming date-based ingestion
+# The timestamp filter is pushed into the reader. On a time-ordered source the watermark advances with every
+# committed group; otherwise a row newer than a committed one may still follow, so the watermark only
+# advances once the whole file is loaded
+# checkpoint: resume after the last committed chunk, filtering against the starting watermark it records
+# primary_key: merge the new rows on this key instead of appending them (historical_data_handling = Merge)
+def streaming_date_based_ingestion(conn, file_path, table_name, timestamp_column, batch_size=None,
+                                   chunksize=DEFAULT_CHUNK_SIZE, commit_every=1, time_ordered=False, read_options=None,
+                                   checkpoint=None, primary_key=None):
+    start_time = time.time()
+
+    max_timestamp = starting_watermark(conn, table_name, timestamp_column, checkpoint)
+    state = checkpoint['state'] if checkpoint is not None else {}
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def load_chunk(chunk):
+        if primary_key is None:
+            loaded = bulk_load(conn, chunk, table_name, batch_size)
+        else:
+            chunk = chunk.assign(hash=hash_rows(chunk))
+            chunk_counts = merge_rows_by_key(conn, chunk, table_name, parse_key_columns(primary_key), batch_size)
+            for name, count in chunk_counts.items():
+                counts[name] += count
+            loaded = chunk_counts['inserted'] + chunk_counts['updated']
+        if time_ordered:
+            advance_watermark(conn, table_name, chunk[timestamp_column].max())
+        else:
+            track_loaded_timestamp(state, chunk[timestamp_column].max())
+        return loaded
+
+    # The reader converts and filters the timestamps itself, so that time is part of the 'read' stage
+    chunks = timed_iter('read', read_chunks_after_watermark(file_path, timestamp_column, max_timestamp, chunksize,
+                                                            time_ordered, read_options,
+                                                            checkpoint['rows'] if checkpoint else 0))
+    loaded = load_chunks(conn, chunks, load_chunk, commit_every, checkpoint=checkpoint)
+
+    if not time_ordered:
+        advance_watermark(conn, table_name, state.get('loaded'))
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+    if primary_key is not None:
+        annotate_run(merge_counts=counts)
+
+    elapsed_time = time.time() - start_time
+    print(f"Streaming date-based ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for streaming hash-based ingestion (dedup_mode as in hash_based_ingestion, except 'client')
+# checkpoint as in streaming_full_ingestion
+def streaming_hash_based_ingestion(conn, file_path, table_name, batch_size=None, chunksize=DEFAULT_CHUNK_SIZE,
+                                   commit_every=1, dedup_mode='anti_join', read_options=None, checkpoint=None):
+    if dedup_mode == 'client':
+        raise ValueError("dedup_mode 'client' reads the whole hash column and cannot be streamed.")
+    start_time = time.time()
+
+    chunks = read_chunks(file_path, chunksize, read_options, checkpoint['rows'] if checkpoint else 0)
+    chunks = hash_chunks(chunks)
+
+    if dedup_mode == 'local_index':
+        index_dir = open_hash_index(conn, table_name)
+        # Chunks loaded since the last commit are checked through their hashes until they are indexed
+        pending_hashes = set()
+        chunks = filter_unindexed_hashes(chunks, index_dir, pending_hashes)
+        loader = lambda chunk: bulk_load(conn, chunk, table_name, batch_size)
+        # Committed chunks are added to the index so later chunks are checked against them
+        def on_commit(committed):
+            with stage('lookup'):
+                add_hashes(index_dir, pd.concat([c['hash'] for c in committed]))
+            pending_hashes.clear()
+    else:
+        loader = lambda chunk: insert_new_rows_by_hash(conn, chunk, table_name, batch_size, method=dedup_mode)
+        on_commit = None
+
+    loaded = load_chunks(conn, chunks, loader, commit_every, on_commit, checkpoint)
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+
+    elapsed_time = time.time() - start_time
+    print(f"Streaming hash-based ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for streaming hybrid ingestion: full load of the first half, incremental load of the rest
+# load_mode and checkpoint as in streaming_full_ingestion
+def streaming_hybrid_ingestion(conn, file_path, table_name, timestamp_column, batch_size=None,
+                               chunksize=DEFAULT_CHUNK_SIZE, commit_every=1, dedup_mode='anti_join', read_options=None,
+                               load_mode='swap', checkpoint=None):
+    start_time = time.time()
+    if pd.isna(timestamp_column):
+        timestamp_column = None
+
+    half_index = count_source_rows(file_path, chunksize, (read_options or {}).get('file_format')) // 2
+
+    target_table = prepare_full_load(conn, table_name, load_mode, checkpoint)
+    start_row = checkpoint['rows'] if checkpoint else 0
+
+    chunks = read_chunks(file_path, chunksize, read_options, start_row)
+    chunks = coerce_timestamps(chunks, timestamp_column, errors='coerce')
+    chunks = hash_chunks(chunks)
+
+    # The table was truncated, so the incremental half is filtered against the max of the first half
+    # The watermarks are checkpointed along with the chunks, so a resumed attempt filters the same way
+    watermarks = {'full_half': DEFAULT_WATERMARK, 'loaded': DEFAULT_WATERMARK}
+    if checkpoint is not None:
+        watermarks.update({name: pd.Timestamp(value) for name, value in checkpoint['state'].items()})
+        checkpoint['state'] = watermarks
+
+    def load_part(part):
+        section, chunk = part
+        if not timestamp_column and section == 'incremental':
+            return insert_new_rows_by_hash(conn, chunk, target_table, batch_size, method=dedup_mode)
+        if timestamp_column and section == 'incremental':
+            chunk = chunk[chunk[timestamp_column] > watermarks['full_half']]
+
+        loaded = bulk_load(conn, chunk, target_table, batch_size)
+        if timestamp_column:
+            chunk_max = chunk[timestamp_column].max()
+            if pd.notna(chunk_max):
+                watermarks['loaded'] = max(watermarks['loaded'], chunk_max)
+                if section == 'full':
+                    watermarks['full_half'] = watermarks['loaded']
+        return loaded
+
+    loaded = load_chunks(conn, split_at_row(chunks, half_index - start_row), load_part, commit_every,
+                         checkpoint=checkpoint)
+
+    # Swap the reloaded table in and reset the watermark to its contents, in one transaction
+    finish_full_load(conn, table_name, target_table)
+    if timestamp_column:
+        advance_watermark(conn, table_name, watermarks['loaded'], reset=True)
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+
+    elapsed_time = time.time() - start_time
+    print(f"Streaming hybrid ingestion for {file_path} loaded {loaded} rows in {elapsed_time:.2f} seconds.")
+    return loaded
+
+# Function for streaming merge ingestion: every chunk is upserted keyed on the primary key
+# checkpoint as in streaming_full_ingestion
+def streaming_merge_ingestion(conn, file_path, table_name, primary_key, batch_size=None, chunksize=DEFAULT_CHUNK_SIZE,
+                              commit_every=1, read_options=None, checkpoint=None):
+    start_time = time.time()
+    key_columns = parse_key_columns(primary_key)
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def merge_chunk(chunk):
+        chunk_counts = merge_rows_by_key(conn, chunk, table_name, key_columns, batch_size)
+        for name, count in chunk_counts.items():
+            counts[name] += count
+        return chunk_counts['inserted'] + chunk_counts['updated']
+
+    chunks = hash_chunks(read_chunks(file_path, chunksize, read_options, checkpoint['rows'] if checkpoint else 0))
+    loaded = load_chunks(conn, chunks, merge_chunk, commit_every, checkpoint=checkpoint)
+    clear_checkpoint(conn, checkpoint)
+    conn.commit()
+    annotate_run(merge_counts=counts)
+
+    elapsed_time = time.time() - start_time
+    print(f"Streaming merge ingestion for {file_path} completed in {elapsed_time:.2f} seconds: "
+          f"{counts['inserted']} inserted, {counts['updated']} updated, {counts['unchanged']} unchanged.")
+    return loaded
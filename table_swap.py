@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import re
+from ingestion_metrics import stage
+from checkpoints import is_resumed, restart_checkpoint
+
+
+# Suffix of the shadow table (and of its indexes and constraints until the swap)
+SHADOW_SUFFIX = '__shadow'
+
+# Function to split a possibly schema-qualified table name
+def split_table_name(table_name):
+    schema_name, _, bare_name = table_name.rpartition('.')
+    return schema_name, bare_name
+
+# Function to build the name of the shadow table of a table
+def shadow_table_name(table_name):
+    return table_name + SHADOW_SUFFIX
+
+# Function to list what prevents a table from being replaced by a swap
+# Views and foreign keys point at the table itself, so they would keep pointing at the dropped copy;
+# a shadow of a partitioned table would not carry its partitions
+def swap_blockers(conn, table_name):
+    blockers = []
+    with conn.cursor() as cur:
+        # Partitioned tables are reloaded partition by partition (see partitioned_ingestion.py)
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", (table_name,))
+        if cur.fetchone()[0] == 'p':
+            blockers.append("partitioned")
+        cur.execute("SELECT conrelid::regclass::text FROM pg_constraint WHERE confrelid = %s::regclass", (table_name,))
+        blockers += [f"referenced by a foreign key of {row[0]}" for row in cur.fetchall()]
+        cur.execute(
+            "SELECT DISTINCT r.ev_class::regclass::text FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid "
+            "WHERE d.refobjid = %s::regclass AND r.ev_class <> d.refobjid",
+            (table_name,),
+        )
+        blockers += [f"used by view {row[0]}" for row in cur.fetchall()]
+    return blockers
+
+# Function to create an empty shadow table shaped like the live table, without its indexes
+def create_shadow_table(conn, table_name):
+    shadow_table = shadow_table_name(table_name)
+    with conn.cursor() as cur:
+        # A shadow left behind by a failed streaming load is discarded
+        cur.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+        cur.execute(
+            f"CREATE TABLE {shadow_table} (LIKE {table_name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+            f"INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE INCLUDING COMMENTS)"
+        )
+    return shadow_table
+
+# Function to tell whether a table exists
+def table_exists(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+        return cur.fetchone()[0]
+
+# Function to prepare a full load: returns the table to load into
+# load_mode 'swap' loads into a shadow table swapped in by finish_full_load, so readers keep seeing the
+# old contents meanwhile; 'truncate' (or a table that cannot be swapped) truncates the live table
+# checkpoint: when it resumes an earlier attempt, the part already loaded is kept (its shadow table,
+# or the truncated table); without the shadow table it is restarted from the beginning
+def prepare_full_load(conn, table_name, load_mode='swap', checkpoint=None):
+    if load_mode not in ('swap', 'truncate'):
+        raise ValueError(f"Unknown load mode: {load_mode}")
+    if load_mode == 'swap':
+        blockers = swap_blockers(conn, table_name)
+        if not blockers:
+            shadow_table = shadow_table_name(table_name)
+            if is_resumed(checkpoint):
+                if table_exists(conn, shadow_table):
+                    return shadow_table
+                restart_checkpoint(checkpoint)
+            return create_shadow_table(conn, table_name)
+        print(f"Cannot swap {table_name} ({'; '.join(blockers)}); truncating it instead.")
+
+    if is_resumed(checkpoint):
+        return table_name
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE TABLE {table_name}")
+    return table_name
+
+# Function to normalize an index definition so the same index on two tables compares equal
+def index_signature(index_definition):
+    return re.sub(r' INDEX \S+ ON \S+ ', ' INDEX ON ', index_definition)
+
+# Function to list the indexes of a table with the constraint they back, if any
+def fetch_indexes(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid), con.conname, pg_get_constraintdef(con.oid) "
+            "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "LEFT JOIN pg_constraint con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid "
+            "AND con.contype IN ('p', 'u', 'x') "
+            "WHERE i.indrelid = %s::regclass",
+            (table_name,),
+        )
+        return cur.fetchall()
+
+# Function to build the live table's indexes and index-backed constraints on the loaded shadow table
+# Indexes the load already created on the shadow (e.g. the hash index used for deduplication) are kept
+def build_shadow_indexes(conn, table_name, shadow_table):
+    existing = {index_signature(definition) for _, definition, _, _ in fetch_indexes(conn, shadow_table)}
+
+    with conn.cursor() as cur:
+        for index_name, definition, constraint_name, constraint_definition in fetch_indexes(conn, table_name):
+            if index_signature(definition) in existing:
+                continue
+            if constraint_name:
+                cur.execute(f"ALTER TABLE {shadow_table} ADD CONSTRAINT {constraint_name}{SHADOW_SUFFIX} "
+                            f"{constraint_definition}")
+            else:
+                shadow_definition = re.sub(r' INDEX \S+ ON \S+ ', f" INDEX {index_name}{SHADOW_SUFFIX} ON {shadow_table} ",
+                                           definition, count=1)
+                cur.execute(shadow_definition)
+
+# Function to copy the privileges granted on the live table to the shadow table
+def copy_grants(conn, table_name, shadow_table):
+    schema_name, bare_name = split_table_name(table_name)
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT grantee, string_agg(privilege_type, ', ') FROM information_schema.role_table_grants "
+            "WHERE table_schema = COALESCE(NULLIF(%s, ''), current_schema()) AND table_name = %s "
+            "AND grantee <> current_user GROUP BY grantee",
+            (schema_name, bare_name),
+        )
+        for grantee, privileges in cur.fetchall():
+            grantee = grantee if grantee == 'PUBLIC' else f'"{grantee}"'
+            cur.execute(f"GRANT {privileges} ON {shadow_table} TO {grantee}")
+
+# Function to replace the live table with the shadow table
+# Only this step takes the ACCESS EXCLUSIVE lock, until the caller commits
+def swap_tables(conn, table_name, shadow_table):
+    schema_name, bare_name = split_table_name(table_name)
+    with conn.cursor() as cur:
+        cur.execute(f"LOCK TABLE {table_name} IN ACCESS EXCLUSIVE MODE")
+
+        # Sequences owned by the live table's serial columns are still used by the shadow's defaults
+        cur.execute(
+            "SELECT s.oid::regclass::text, a.attname FROM pg_depend d "
+            "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+            "JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid "
+            "WHERE d.refobjid = %s::regclass AND d.deptype = 'a'",
+            (table_name,),
+        )
+        for sequence_name, column_name in cur.fetchall():
+            cur.execute(f'ALTER SEQUENCE {sequence_name} OWNED BY {shadow_table}."{column_name}"')
+
+        cur.execute(f"DROP TABLE {table_name}")
+        cur.execute(f"ALTER TABLE {shadow_table} RENAME TO {bare_name}")
+
+        # Give indexes and constraints back their original names
+        cur.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND right(conname, %s) = %s",
+            (table_name, len(SHADOW_SUFFIX), SHADOW_SUFFIX),
+        )
+        for (constraint_name,) in cur.fetchall():
+            cur.execute(f"ALTER TABLE {table_name} RENAME CONSTRAINT {constraint_name} "
+                        f"TO {constraint_name[:-len(SHADOW_SUFFIX)]}")
+        cur.execute(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND strpos(c.relname, %s) > 0",
+            (table_name, SHADOW_SUFFIX),
+        )
+        for (index_name,) in cur.fetchall():
+            qualified_index = f"{schema_name}.{index_name}" if schema_name else index_name
+            cur.execute(f"ALTER INDEX {qualified_index} RENAME TO {index_name.replace(SHADOW_SUFFIX, '', 1)}")
+
+# Function to finish a full load started by prepare_full_load: when loading into a shadow table,
+# build the indexes, ANALYZE and swap it in (the caller commits)
+def finish_full_load(conn, table_name, target_table):
+    if target_table == table_name:
+        return
+    with stage('index'):
+        build_shadow_indexes(conn, table_name, target_table)
+        copy_grants(conn, table_name, target_table)
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {target_table}")
+    with stage('swap'):
+        swap_tables(conn, table_name, target_table)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import difflib
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+
+
+# Controlled vocabularies of the metadata fields that are standardized
+STANDARD_VALUES = {
+    'ingestion_type': ['incremental', 'full', 'hybrid'],
+    'refresh_schedule': ['hourly', 'daily', 'weekly', 'monthly'],
+    'status': ['active', 'paused', 'failed'],
+    'source_file_format': ['csv', 'json', 'parquet'],
+    'compression_type': ['gzip', 'snappy'],
+}
+
+# Similarity (difflib ratio) a value needs to be corrected to a valid value
+FUZZY_CUTOFF = 0.8
+
+# Vocabularies at least this large are searched through a trigram index instead of a full scan,
+# comparing each value only with the valid values sharing the most trigrams with it
+INDEX_MIN_VOCABULARY = 64
+INDEX_CANDIDATES = 32
+
+# Corrections already computed, persisted across runs
+CORRECTION_CACHE_PATH = '.standardization_cache.json'
+
+_corrections = None
+_corrections_lock = threading.Lock()
+_indexes = {}
+
+# Function to normalize a raw value before it is matched (case and surrounding spaces are not typos)
+def normalize_value(value):
+    return str(value).strip().lower()
+
+# Function to build the key of a vocabulary in the correction cache: changing the valid values
+# or the cutoff invalidates the corrections made against the old ones
+def vocabulary_key(valid_values, cutoff=FUZZY_CUTOFF):
+    return f"{cutoff}|" + '|'.join(sorted(valid_values))
+
+# Function to load the persisted corrections on first use
+def load_corrections(path=CORRECTION_CACHE_PATH):
+    global _corrections
+    if _corrections is None:
+        try:
+            with open(path) as f:
+                _corrections = json.load(f)
+        except (OSError, ValueError):
+            _corrections = {}
+    return _corrections
+
+# Function to persist the corrections (atomic rewrite, so a crash never leaves a truncated cache)
+def save_corrections(path=CORRECTION_CACHE_PATH):
+    with _corrections_lock:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(load_corrections(path), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+# Function to forget every correction, in memory and on disk
+def clear_corrections(path=CORRECTION_CACHE_PATH):
+    global _corrections
+    with _corrections_lock:
+        _corrections = {}
+        if os.path.exists(path):
+            os.remove(path)
+
+# Function to split a value into padded character trigrams
+def trigrams(value):
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Function to build the candidate index of a vocabulary: valid values by length, and by trigram
+def build_candidate_index(valid_values):
+    by_length = defaultdict(list)
+    by_trigram = defaultdict(set)
+    for valid_value in valid_values:
+        by_length[len(valid_value)].append(valid_value)
+        for gram in trigrams(valid_value):
+            by_trigram[gram].add(valid_value)
+    return {'by_length': by_length, 'by_trigram': by_trigram, 'size': len(valid_values)}
+
+# Function to return the candidate index of a vocabulary, built once per vocabulary
+def candidate_index(valid_values):
+    key = vocabulary_key(valid_values, cutoff='')
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = build_candidate_index(valid_values)
+    return index
+
+# Function to list the valid values that can reach the cutoff
+# A ratio of at least `cutoff` bounds the length of the match, so only those length buckets are read;
+# large vocabularies are further narrowed to the values sharing the most trigrams with the input
+def candidates(value, index, cutoff=FUZZY_CUTOFF):
+    min_length = int(len(value) * cutoff / (2 - cutoff))
+    max_length = int(len(value) * (2 - cutoff) / cutoff) + 1
+    if index['size'] < INDEX_MIN_VOCABULARY:
+        return [valid_value for length in range(min_length, max_length + 1)
+                for valid_value in index['by_length'].get(length, [])]
+
+    shared = Counter()
+    for gram in trigrams(value):
+        shared.update(index['by_trigram'].get(gram, ()))
+    in_range = [(count, valid_value) for valid_value, count in shared.items()
+                if min_length <= len(valid_value) <= max_length]
+    in_range.sort(reverse=True)
+    return [valid_value for _, valid_value in in_range[:INDEX_CANDIDATES]]
+
+# Function to correct one distinct value: the closest valid value, or None if none is close enough
+def correct_value(value, valid_values, cutoff=FUZZY_CUTOFF, index=None):
+    normalized = normalize_value(value)
+    if normalized in valid_values:
+        return normalized
+    index = index or candidate_index(valid_values)
+    matches = difflib.get_close_matches(normalized, candidates(normalized, index, cutoff), n=1, cutoff=cutoff)
+    return matches[0] if matches else None
+
+# Function to correct a set of distinct values, reusing and extending the correction cache
+def correct_distinct_values(values, valid_values, cutoff=FUZZY_CUTOFF):
+    valid_values = set(valid_values)
+    with _corrections_lock:
+        known = load_corrections().setdefault(vocabulary_key(valid_values, cutoff), {})
+    corrections, new_corrections = {}, {}
+    index = None
+    for value in values:
+        raw = str(value)
+        if raw not in known and raw not in new_corrections:
+            index = index or candidate_index(valid_values)
+            new_corrections[raw] = correct_value(raw, valid_values, cutoff, index)
+        corrections[value] = new_corrections[raw] if raw in new_corrections else known[raw]
+
+    if new_corrections:
+        with _corrections_lock:
+            known.update(new_corrections)
+        save_corrections()
+    return corrections
+
+# Function to standardize one column: every distinct value is corrected once and mapped back vectorially
+# unmatched: 'keep' leaves values without a close valid value as they are, 'null' replaces them with default_value
+# default_value: also used for missing values
+def standardize_column(metadata, column_name, valid_values=None, default_value=None, unmatched='keep',
+                       cutoff=FUZZY_CUTOFF):
+    if column_name not in metadata.columns:
+        return metadata
+    if unmatched not in ('keep', 'null'):
+        raise ValueError(f"Unknown unmatched policy: {unmatched}")
+    valid_values = valid_values or STANDARD_VALUES[column_name]
+
+    column = metadata[column_name]
+    corrections = correct_distinct_values(column.dropna().unique(), valid_values, cutoff)
+    if unmatched == 'keep':
+        corrections = {value: value if corrected is None else corrected for value, corrected in corrections.items()}
+
+    standardized = column.map(corrections, na_action='ignore')
+    if default_value is not None:
+        standardized = standardized.fillna(default_value)
+    metadata[column_name] = standardized
+    return metadata
+
+# Function to standardize every field with a controlled vocabulary (STANDARD_VALUES)
+def standardize_metadata_values(metadata, default_values=None, unmatched='keep'):
+    default_values = default_values or {}
+    for column_name, valid_values in STANDARD_VALUES.items():
+        metadata = standardize_column(metadata, column_name, valid_values, default_values.get(column_name), unmatched)
+    return metadata
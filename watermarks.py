@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+import pandas as pd
+from source_readers import iter_source_chunks, normalize_file_format
+
+
+# Table holding one metadata row per target table, including its watermark
+METADATA_TABLE = 'ingestion_metadata'
+
+# Watermark used when neither the metadata nor the target table has one
+DEFAULT_WATERMARK = pd.Timestamp(datetime(1970, 1, 1))
+
+# Function to read the persisted high-water mark of a table, locking its metadata row until commit
+# Falls back to MAX(timestamp_column) only when the metadata has no watermark yet
+def read_watermark(conn, table_name, timestamp_column):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT watermark FROM {METADATA_TABLE} WHERE table_name = %s FOR UPDATE", (table_name,))
+        row = cur.fetchone()
+        watermark = row[0] if row else None
+
+        if watermark is None:
+            cur.execute(f"SELECT MAX({timestamp_column}) FROM {table_name}")
+            watermark = cur.fetchone()[0]
+
+    if watermark is None:
+        return DEFAULT_WATERMARK
+    return pd.Timestamp(watermark)
+
+# Function to advance the watermark and last_ingestion_date in the caller's transaction
+# The watermark never moves backwards unless `reset` is set (after the table was truncated)
+def advance_watermark(conn, table_name, new_watermark, reset=False):
+    if new_watermark is None or pd.isna(new_watermark):
+        if not reset:
+            return
+        new_watermark = None
+    else:
+        new_watermark = pd.Timestamp(new_watermark).to_pydatetime()
+
+    with conn.cursor() as cur:
+        if reset:
+            cur.execute(
+                f"UPDATE {METADATA_TABLE} SET watermark = %s, last_ingestion_date = now() WHERE table_name = %s",
+                (new_watermark, table_name),
+            )
+        else:
+            cur.execute(
+                f"UPDATE {METADATA_TABLE} "
+                f"SET watermark = GREATEST(COALESCE(watermark, %s), %s), last_ingestion_date = now() "
+                f"WHERE table_name = %s",
+                (new_watermark, new_watermark, table_name),
+            )
+
+# Function to record a successful run of any strategy in last_ingestion_date, in the caller's transaction
+def mark_ingested(conn, table_name):
+    with conn.cursor() as cur:
+        cur.execute(f"UPDATE {METADATA_TABLE} SET last_ingestion_date = now() WHERE table_name = %s", (table_name,))
+
+# Function to keep the rows strictly after the watermark
+# time_ordered: the timestamp column is sorted ascending, so the boundary is found by binary search
+def rows_after_watermark(data, timestamp_column, watermark, time_ordered=False):
+    if time_ordered:
+        boundary = data[timestamp_column].searchsorted(watermark, side='right')
+        return data.iloc[boundary:]
+    return data[data[timestamp_column] > watermark]
+
+# Function to count the leading rows of a time-ordered source at or below the watermark,
+# reading only the timestamp column
+def find_watermark_boundary(file_path, timestamp_column, watermark, chunksize, read_options=None):
+    read_options = dict(read_options or {}, columns=[timestamp_column])
+    boundary = 0
+    for chunk in iter_source_chunks(file_path, chunksize, **read_options):
+        timestamps = pd.to_datetime(chunk[timestamp_column])
+        position = int(timestamps.searchsorted(watermark, side='right'))
+        boundary += position
+        if position < len(chunk):
+            break
+    return boundary
+
+# Function to stream the chunks of a source that are newer than the watermark, indexed by their position in the source
+# Chunks entirely at or below the watermark are dropped before any row filtering; for
+# time-ordered CSV files the rows below the watermark are not parsed at all
+# start_row: resume after the rows committed by an earlier attempt (see checkpoints.py)
+def read_chunks_after_watermark(file_path, timestamp_column, watermark, chunksize, time_ordered=False, read_options=None,
+                                start_row=0):
+    read_options = read_options or {}
+    file_format = normalize_file_format(read_options.get('file_format'), file_path)
+
+    if time_ordered and file_format == 'csv':
+        offset = max(start_row, find_watermark_boundary(file_path, timestamp_column, watermark, chunksize, read_options))
+        # Start reading at the first data row above the boundary
+        for chunk in iter_source_chunks(file_path, chunksize, start_row=offset, **read_options):
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            chunk[timestamp_column] = pd.to_datetime(chunk[timestamp_column])
+            yield chunk
+        return
+
+    offset = start_row
+    for chunk in iter_source_chunks(file_path, chunksize, start_row=start_row, **read_options):
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        chunk[timestamp_column] = pd.to_datetime(chunk[timestamp_column])
+        if chunk.empty or not chunk[timestamp_column].max() > watermark:
+            continue
+        yield rows_after_watermark(chunk, timestamp_column, watermark, time_ordered)